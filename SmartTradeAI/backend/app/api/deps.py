@@ -1,4 +1,4 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -9,7 +9,7 @@ from sqlalchemy.orm import Session
 from app import crud, models, schemas
 from app.core import security
 from app.core.config import settings
-from app.db.session import SessionLocal
+from app.db.session import AsyncSessionLocal, SessionLocal
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/login/access-token"
@@ -24,20 +24,42 @@ def get_db() -> Generator:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def decode_token(token: str) -> schemas.TokenPayload:
+    """Validate an access token; raises jwt.JWTError or ValidationError"""
+    payload = jwt.decode(
+        token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
+    )
+    return schemas.TokenPayload(**payload)
+
+
+def user_from_token(db: Session, token: str) -> Optional[models.User]:
+    """The active user a token belongs to, or None; shared with the socket server"""
+    try:
+        token_data = decode_token(token)
+    except (jwt.JWTError, ValidationError):
+        return None
+    user = crud.user.get_cached(db, id=token_data.sub)
+    if not user or not crud.user.is_active(user):
+        return None
+    return user
+
+
 def get_current_user(
     db: Session = Depends(get_db), token: str = Depends(reusable_oauth2)
 ) -> models.User:
     try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
-        )
-        token_data = schemas.TokenPayload(**payload)
+        token_data = decode_token(token)
     except (jwt.JWTError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
-    user = crud.user.get(db, id=token_data.sub)
+    user = crud.user.get_cached(db, id=token_data.sub)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
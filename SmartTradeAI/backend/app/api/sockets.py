@@ -0,0 +1,118 @@
+import asyncio
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+from socketio.exceptions import ConnectionRefusedError
+
+from app.api.deps import user_from_token
+from app.core.socket_manager import sio
+from app.db.session import SessionLocal
+from app.models.portfolio import Portfolio
+from app.services.push import portfolio_room, push_service, symbol_room
+from app.utils.logging import logger
+
+# Most symbol rooms one connection may be in
+MAX_SYMBOLS = 200
+
+
+def _token(environ: Dict, auth: Optional[Dict]) -> Optional[str]:
+    if auth and auth.get("token"):
+        return auth["token"]
+    query = parse_qs(environ.get("QUERY_STRING", ""))
+    if query.get("token"):
+        return query["token"][0]
+    header = environ.get("HTTP_AUTHORIZATION", "")
+    return header[7:] if header.startswith("Bearer ") else None
+
+
+def _authenticate(token: str) -> Optional[int]:
+    db = SessionLocal()
+    try:
+        user = user_from_token(db, token)
+        return user.id if user is not None else None
+    finally:
+        db.close()
+
+
+def _owns_portfolio(user_id: int, portfolio_id: int) -> bool:
+    db = SessionLocal()
+    try:
+        return db.query(Portfolio.id).filter(
+            Portfolio.id == portfolio_id, Portfolio.user_id == user_id
+        ).first() is not None
+    finally:
+        db.close()
+
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    """Same bearer token as the REST API, passed as auth.token, ?token= or an Authorization header"""
+    token = _token(environ, auth)
+    user_id = await asyncio.get_running_loop().run_in_executor(None, _authenticate, token) if token else None
+    if user_id is None:
+        raise ConnectionRefusedError("Could not validate credentials")
+    await sio.save_session(sid, {"user_id": user_id})
+
+
+@sio.event
+async def disconnect(sid):
+    await push_service.leave_all(sid)
+
+
+@sio.event
+async def subscribe_symbols(sid, data) -> Dict:
+    current = [room for room in sio.rooms(sid) if room.startswith("symbol:")]
+    symbols: List[str] = [
+        s for s in dict.fromkeys((data or {}).get("symbols") or []) if symbol_room(s) not in current
+    ]
+    if len(current) + len(symbols) > MAX_SYMBOLS:
+        return {"error": f"At most {MAX_SYMBOLS} symbols per connection"}
+    for symbol in symbols:
+        await push_service.join(sid, symbol_room(symbol))
+    return {"subscribed": symbols}
+
+
+@sio.event
+async def unsubscribe_symbols(sid, data) -> Dict:
+    symbols = (data or {}).get("symbols") or []
+    rooms = sio.rooms(sid)
+    for symbol in symbols:
+        if symbol_room(symbol) in rooms:
+            await push_service.leave(sid, symbol_room(symbol))
+    return {"unsubscribed": symbols}
+
+
+@sio.event
+async def subscribe_portfolio(sid, data) -> Dict:
+    session = await sio.get_session(sid)
+    try:
+        portfolio_id = int((data or {}).get("portfolio_id"))
+    except (TypeError, ValueError):
+        return {"error": "portfolio_id is required"}
+    owned = await asyncio.get_running_loop().run_in_executor(
+        None, _owns_portfolio, session["user_id"], portfolio_id
+    )
+    if not owned:
+        logger.warning(f"User {session['user_id']} tried to subscribe to portfolio {portfolio_id}")
+        return {"error": "Portfolio not found"}
+    if portfolio_room(portfolio_id) not in sio.rooms(sid):
+        await push_service.join(sid, portfolio_room(portfolio_id))
+    return {"subscribed": portfolio_id}
+
+
+@sio.event
+async def unsubscribe_portfolio(sid, data) -> Dict:
+    room = portfolio_room(int((data or {}).get("portfolio_id") or 0))
+    if room in sio.rooms(sid):
+        await push_service.leave(sid, room)
+    return {"unsubscribed": room}
+
+
+@sio.event
+async def resync(sid, data) -> Dict:
+    """Resend a room's latest full payload, for a client that missed a delta"""
+    room = (data or {}).get("room", "")
+    if room not in sio.rooms(sid):
+        return {"error": "Not subscribed"}
+    await push_service.send_last(sid, room)
+    return {"resent": room}
@@ -0,0 +1,120 @@
+from fastapi import APIRouter, Depends, HTTPException
+from app import models
+from app.api import deps
+from app.core.cache import default_cache
+from app.db.session import async_engine, engine
+from app.services.exits import exit_monitor
+from app.services.options import options_service
+from app.services.orders import order_tracker
+from app.services.pretrade import pretrade_gate
+from app.services.push import push_service
+from app.services.zerodha import zerodha_service
+from app.utils import metrics
+
+router = APIRouter()
+
+@router.get("/latency")
+def read_latency(
+    prefix: str = "",
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Latency histograms, optionally filtered by name prefix.
+    """
+    return metrics.snapshot(prefix)
+
+
+@router.get("/payloads")
+def read_payload_sizes(
+    prefix: str = "",
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Encoded payload sizes per serializer, optionally filtered by name prefix.
+    """
+    return metrics.size_snapshot(prefix)
+
+
+@router.get("/pretrade")
+def read_pretrade(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Pre-trade check latency and rejection counts by reason.
+    """
+    return pretrade_gate.stats()
+
+
+@router.get("/cache")
+def read_cache(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Shared cache hit rate and load latency for this process.
+    """
+    return default_cache.stats()
+
+
+@router.get("/push")
+def read_push(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Socket push rooms, messages emitted and updates coalesced away.
+    """
+    return push_service.stats()
+
+
+@router.get("/db")
+def read_db(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Connection pool state plus pool wait and query latency for the sync and async engines.
+    """
+    return {
+        "sync": {"pool": engine.pool.status(), **metrics.snapshot("db.sync.")},
+        "async": {"pool": async_engine.pool.status(), **metrics.snapshot("db.async.")},
+    }
+
+
+@router.get("/orders")
+def read_orders(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Order tracker state: open orders, updates applied or ignored as stale, fills, backfills and write latency.
+    """
+    return order_tracker.stats()
+
+
+@router.get("/exits")
+def read_exits(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Exit monitor: armed trades, exits fired, trailing stop ratchets and per-batch tick latency.
+    """
+    return exit_monitor.stats()
+
+
+@router.get("/options")
+def read_options(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Option chains: chains and contracts watched, contracts solved and batch refresh latency.
+    """
+    return options_service.stats()
+
+
+@router.get("/paper")
+def read_paper(
+    current_user: models.User = Depends(deps.get_current_active_superuser),
+):
+    """
+    Simulated broker state when paper trading: orders, fills, open positions, market clock and match latency.
+    """
+    if not hasattr(zerodha_service, "stats"):
+        raise HTTPException(status_code=404, detail="Paper trading is off")
+    return zerodha_service.stats()
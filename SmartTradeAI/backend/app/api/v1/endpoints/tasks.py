@@ -1,7 +1,10 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy.orm import Session
 from app.worker import tasks
-from app import models
+from app import models, schemas
 from app.api import deps
+from app.models.strategy import Strategy
+from app.services import backtest, optimization
 
 router = APIRouter()
 
@@ -32,3 +35,71 @@ def get_stock_data(
     """
     tasks.get_stock_data_task.delay(ticker, start_date, end_date)
     return {"msg": "Get stock data task has been triggered"}
+
+@router.post("/backtest/{strategy_id}", status_code=202)
+def backtest_strategy(
+    strategy_id: int,
+    start_date: str = None,
+    end_date: str = None,
+    db: Session = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Backtest a strategy's entry/exit rules on stored bars with fills, charges and
+    sizing; results land in the strategy's backtest_results.
+    """
+    strategy = db.query(Strategy).filter(
+        Strategy.id == strategy_id, Strategy.user_id == current_user.id
+    ).first()
+    if not strategy:
+        raise HTTPException(status_code=404, detail="Strategy not found")
+    tasks.backtest_strategy_task.delay(strategy_id, start_date, end_date)
+    return {"msg": "Backtest task has been triggered", "strategy_id": strategy_id}
+
+@router.post("/optimize", status_code=202)
+def optimize(
+    request: schemas.OptimizationRequest,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(deps.get_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Run an SMA parameter sweep, optionally walk-forward, across workers.
+    Identical jobs on unchanged data are answered from the result cache;
+    poll GET /optimize/{job_hash} for the result.
+    """
+    if request.strategy_id is not None:
+        strategy = db.query(Strategy).filter(
+            Strategy.id == request.strategy_id, Strategy.user_id == current_user.id
+        ).first()
+        if not strategy:
+            raise HTTPException(status_code=404, detail="Strategy not found")
+    pairs = backtest.window_grid(request.short_windows, request.long_windows)
+    if not pairs or not request.tickers:
+        raise HTTPException(status_code=422, detail="Need at least one ticker and one short < long window pair")
+    params = dict(
+        days=request.days, interval=request.interval,
+        train_bars=request.train_bars, test_bars=request.test_bars, step=request.step,
+    )
+    request_id = optimization.request_id(request.tickers, pairs, **params)
+    # history is downloaded by the job itself, off the request
+    if optimization.use_celery():
+        tasks.optimize_task.delay(request_id, request.tickers, pairs, dict(params, strategy_id=request.strategy_id))
+    else:
+        background_tasks.add_task(
+            optimization.run, request_id, request.tickers, pairs, strategy_id=request.strategy_id, **params
+        )
+    return {"job_hash": request_id, "status": "submitted"}
+
+@router.get("/optimize/{job_hash}")
+def read_optimization(
+    job_hash: str,
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Result of an optimization job, once it has finished.
+    """
+    result = optimization.cached_result(job_hash)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Result not ready")
+    return result
@@ -1,38 +1,169 @@
-from fastapi import APIRouter, Depends
-from app.services import zerodha, strategy
+from datetime import date, datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services import strategy
+from app.crud.crud_trade import trade as crud_trade
+from app.models.portfolio import Portfolio
+from app.models.trade import TradeStatus, TradeType
+from app.services.options import options_service
+from app.services.orders import order_tracker, verify_postback
+from app.services.pretrade import RiskRejected
+from app.services.prices import price_service
+from app.services.trading import trading_service
 from app import models, schemas
 from app.api import deps
+from app.utils.pagination import CursorPage, CursorParams
 
 router = APIRouter()
 
 @router.post("/place-order")
-def place_order(
+async def place_order(
     order: schemas.Order,
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Place a new order. It is recorded as a PENDING trade and booked as the broker reports fills.
+    """
+    portfolio = await get_own_portfolio(db, order.portfolio_id, current_user)
+    if order.transaction_type not in ("BUY", "SELL"):
+        raise HTTPException(status_code=422, detail="transaction_type must be BUY or SELL")
+    errors = trading_service.validate_exits(order.dict())
+    if errors:
+        raise HTTPException(status_code=422, detail=", ".join(errors))
+    # market orders are recorded at the current price until their fills come in
+    price = order.price or await price_service.ltp(f"{order.exchange}:{order.tradingsymbol}")
+    if not price:
+        raise HTTPException(status_code=422, detail=f"No price for {order.tradingsymbol}")
+    try:
+        trade = await trading_service.place_order(
+            db=db,
+            user_id=current_user.id,
+            portfolio_id=portfolio.id,
+            symbol=order.tradingsymbol,
+            trade_type=TradeType(order.transaction_type),
+            quantity=order.quantity,
+            price=price,
+            order_type=order.order_type,
+            product=order.product,
+            exchange=order.exchange,
+            variety=order.variety,
+            validity=order.validity,
+            disclosed_quantity=order.disclosed_quantity,
+            stop_loss=order.stop_loss,
+            target=order.target,
+            trailing_sl=order.trailing_sl,
+            trigger_price=order.trigger_price,
+            tag=order.tag,
+        )
+    except RiskRejected as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"order_id": trade.order_id, "trade_id": trade.id, "status": trade.status.value}
+
+async def get_own_portfolio(db: AsyncSession, portfolio_id: Optional[int], user: models.User) -> Portfolio:
+    """The user's portfolio, or their latest one when no id is given"""
+    query = select(Portfolio).where(Portfolio.user_id == user.id)
+    if portfolio_id is not None:
+        query = query.where(Portfolio.id == portfolio_id)
+    result = await db.execute(query.order_by(Portfolio.id.desc()))
+    portfolio = result.scalars().first()
+    if not portfolio:
+        raise HTTPException(status_code=404, detail="Portfolio not found")
+    return portfolio
+
+@router.post("/basket", response_model=List[schemas.BasketOrderResult])
+async def place_basket(
+    basket: schemas.BasketOrder,
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Place several orders at once. Nothing is sent if any order is invalid.
+    """
+    await get_own_portfolio(db, basket.portfolio_id, current_user)
+    try:
+        return await trading_service.place_basket(
+            db, current_user.id, basket.portfolio_id, [leg.dict() for leg in basket.orders]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.post("/square-off", response_model=List[schemas.BasketOrderResult])
+async def square_off(
+    request: schemas.SquareOff,
+    db: AsyncSession = Depends(deps.get_async_db),
     current_user: models.User = Depends(deps.get_current_active_user),
 ):
     """
-    Place a new order.
-    """
-    kite = zerodha.get_kite()
-    order_id = zerodha.place_order(
-        kite=kite,
-        variety=order.variety,
-        exchange=order.exchange,
-        tradingsymbol=order.tradingsymbol,
-        transaction_type=order.transaction_type,
-        quantity=order.quantity,
-        product=order.product,
-        order_type=order.order_type,
-        price=order.price,
-        validity=order.validity,
-        disclosed_quantity=order.disclosed_quantity,
-        trigger_price=order.trigger_price,
-        squareoff=order.squareoff,
-        stoploss=order.stoploss,
-        trailing_stoploss=order.trailing_stoploss,
-        tag=order.tag,
+    Close all open positions, optionally only those of one product (e.g. MIS).
+    """
+    await get_own_portfolio(db, request.portfolio_id, current_user)
+    return await trading_service.square_off(
+        db, current_user.id, request.portfolio_id, product=request.product
     )
-    return {"order_id": order_id}
+
+@router.post("/postback")
+async def order_postback(request: Request):
+    """
+    Kite order postback. Unauthenticated; the payload's checksum proves it came from Kite.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    if not isinstance(data, dict) or not verify_postback(data):
+        raise HTTPException(status_code=403, detail="Invalid checksum")
+    order_tracker.receive(data)
+    return {"status": "ok"}
+
+@router.get("/trades", response_model=CursorPage[schemas.Trade])
+async def trade_history(
+    portfolio_id: Optional[int] = None,
+    symbol: Optional[str] = None,
+    status: Optional[TradeStatus] = None,
+    since: Optional[datetime] = None,
+    page: CursorParams = Depends(),
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Trade history, newest first. Follow `next_cursor` for older trades.
+    """
+    try:
+        return await crud_trade.history(
+            db, user_id=current_user.id, portfolio_id=portfolio_id, symbol=symbol,
+            status=status, since=since, cursor=page.cursor, limit=page.limit, count=page.count,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/options/{underlying}/chain")
+async def option_chain(
+    underlying: str,
+    expiry: Optional[date] = None,
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Option chain with IV and Greeks per strike, PCR and max pain. Defaults to the nearest expiry.
+    """
+    chain = await options_service.get(underlying, expiry)
+    if chain is None:
+        raise HTTPException(status_code=404, detail=f"No option chain for {underlying}")
+    return chain.snapshot()
+
+@router.get("/options/{underlying}/surface")
+async def option_surface(
+    underlying: str,
+    expiries: int = 4,
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Out-of-the-money implied volatility by expiry and strike for the nearest expiries.
+    """
+    return await options_service.surface(underlying, count=expiries)
 
 @router.post("/generate-strategy")
 def generate_strategy(
@@ -0,0 +1,459 @@
+import asyncio
+import functools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Sequence, Tuple, Union
+
+from app.core import redis_pool
+from app.core.config import settings
+from app.core.serialization import dumps, loads
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+MISSING = object()
+
+# sync loads of keys hashing to the same stripe wait for each other
+SYNC_LOCK_STRIPES = 64
+
+# Delete a load lock only if it still holds our token; it may have expired and been taken by another process
+_UNLOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def _loads(key: str, data: Optional[bytes]) -> Any:
+    """Decoded entry, or MISSING when there is none or it no longer decodes"""
+    if data is None:
+        return MISSING
+    try:
+        return loads(data, "cache")
+    except Exception as e:
+        logger.warning(f"Dropping undecodable cache entry {key}: {str(e)}")
+        return MISSING
+
+Tags = Union[Sequence[str], Callable[..., Sequence[str]], None]
+
+
+class LRU:
+    """Bounded in-process map with per-entry expiry, safe to share across threads"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            if entry[1] <= time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class Cache:
+    """
+    Two-level read-through cache: a small in-process LRU in front of Redis.
+
+    Values are stored in Redis with the msgpack codec, so arrays and frames
+    round-trip. Tags are Redis sets of keys; invalidating a tag deletes its
+    keys and tells every process subscribed to the invalidation channel to
+    drop them from its LRU (processes that are not subscribed fall back on
+    the short local TTL). Concurrent misses for one key are collapsed into
+    one load per process, and across processes by a short Redis lock. When
+    Redis is unreachable the cache keeps working process-locally. Values
+    served from the LRU are shared objects; callers must not mutate them.
+    """
+
+    def __init__(
+        self,
+        namespace: str = "cache",
+        local_size: Optional[int] = None,
+        local_ttl: Optional[float] = None,
+        lock_ttl: float = 10.0,
+    ):
+        self.namespace = namespace
+        self.local = LRU(local_size or settings.CACHE_LOCAL_SIZE)
+        self.local_ttl = local_ttl if local_ttl is not None else settings.CACHE_LOCAL_TTL
+        self.lock_ttl = lock_ttl
+        self.hits = 0
+        self.misses = 0
+        self.load_latency = histogram(f"cache.{namespace}.load")
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._sync_locks = [threading.Lock() for _ in range(SYNC_LOCK_STRIPES)]
+        self._redis_down_until = 0.0
+        self._listener: Optional[asyncio.Task] = None
+
+    # Keys
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _tag(self, tag: str) -> str:
+        return f"{self.namespace}:tag:{tag}"
+
+    @property
+    def channel(self) -> str:
+        return f"{self.namespace}:invalidate"
+
+    def _redis_failed(self, e: Exception) -> None:
+        if self._redis_down_until <= time.monotonic():
+            logger.warning(f"Cache {self.namespace}: Redis unavailable, using local cache only: {str(e)}")
+        self._redis_down_until = time.monotonic() + 5.0
+
+    def _redis_ok(self) -> bool:
+        return self._redis_down_until <= time.monotonic()
+
+    # Async API
+
+    async def _redis(self):
+        return await redis_pool.get_redis()
+
+    async def get(self, key: str) -> Any:
+        """Cached value or MISSING"""
+        value = self.local.get(key)
+        if value is not MISSING or not self._redis_ok():
+            return value
+        try:
+            data = await (await self._redis()).get(self._key(key))
+        except Exception as e:
+            self._redis_failed(e)
+            return MISSING
+        value = _loads(key, data)
+        if value is not MISSING:
+            self.local.set(key, value, self.local_ttl)
+        return value
+
+    async def get_many(self, keys: Sequence[str]) -> Dict[str, Any]:
+        found: Dict[str, Any] = {}
+        remote = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is MISSING:
+                remote.append(key)
+            else:
+                found[key] = value
+        if remote and self._redis_ok():
+            try:
+                values = await (await self._redis()).mget([self._key(k) for k in remote])
+            except Exception as e:
+                self._redis_failed(e)
+                return found
+            for key, data in zip(remote, values):
+                value = _loads(key, data)
+                if value is not MISSING:
+                    found[key] = value
+                    self.local.set(key, value, self.local_ttl)
+        return found
+
+    async def set(self, key: str, value: Any, ttl: float, tags: Iterable[str] = ()) -> None:
+        await self.set_many({key: value}, ttl, tags)
+
+    async def set_many(self, values: Dict[str, Any], ttl: float, tags: Iterable[str] = ()) -> None:
+        if ttl <= 0:
+            return
+        for key, value in values.items():
+            self.local.set(key, value, min(ttl, self.local_ttl))
+        if not values or not self._redis_ok():
+            return
+        tags = list(tags)
+        try:
+            pipe = (await self._redis()).pipeline()
+            for key, value in values.items():
+                pipe.set(self._key(key), dumps(value, "cache", refs=False), px=max(1, int(ttl * 1000)))
+            for tag in tags:
+                pipe.sadd(self._tag(tag), *(self._key(k) for k in values))
+                pipe.expire(self._tag(tag), int(ttl) + 60)
+            await pipe.execute()
+        except Exception as e:
+            self._redis_failed(e)
+
+    async def invalidate(self, *tags: str) -> int:
+        """Drop every key carrying any of `tags`, here and in subscribed processes"""
+        if not self._redis_ok():
+            self.local.clear()
+            return 0
+        try:
+            redis = await self._redis()
+            keys = set()
+            for tag in tags:
+                keys.update(await redis.smembers(self._tag(tag)))
+            if keys:
+                await redis.delete(*keys)
+                await redis.publish(self.channel, dumps([_decode(k) for k in keys], "cache"))
+            await redis.delete(*(self._tag(t) for t in tags))
+        except Exception as e:
+            self._redis_failed(e)
+            self.local.clear()
+            return 0
+        self._drop_local(keys)
+        return len(keys)
+
+    def _drop_local(self, keys: Iterable) -> None:
+        prefix = f"{self.namespace}:"
+        for key in keys:
+            key = _decode(key)
+            self.local.pop(key[len(prefix):] if key.startswith(prefix) else key)
+
+    async def get_or_load(
+        self, key: str, loader: Callable[[], Awaitable[Any]], ttl: float, tags: Iterable[str] = ()
+    ) -> Any:
+        value = await self.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await self._load_locked(key, loader, ttl, tags)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # nobody else may be waiting; don't warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _load_locked(self, key: str, loader, ttl: float, tags: Iterable[str]) -> Any:
+        lock = self._key(f"lock:{key}")
+        token = uuid.uuid4().hex
+        redis = None
+        if self._redis_ok():
+            try:
+                redis = await self._redis()
+                deadline = time.monotonic() + self.lock_ttl
+                while not await redis.set(lock, token, nx=True, px=int(self.lock_ttl * 1000)):
+                    # another process is loading it; wait for its result
+                    await asyncio.sleep(0.05)
+                    value = await self.get(key)
+                    if value is not MISSING:
+                        return value
+                    if time.monotonic() > deadline:
+                        break
+            except Exception as e:
+                self._redis_failed(e)
+                redis = None
+        try:
+            started = time.perf_counter()
+            self.misses += 1
+            value = await loader()
+            self.load_latency.record(time.perf_counter() - started)
+            await self.set(key, value, ttl, tags)
+            return value
+        finally:
+            if redis is not None:
+                try:
+                    await redis.eval(_UNLOCK, 1, lock, token)
+                except Exception as e:
+                    self._redis_failed(e)
+
+    async def listen(self) -> None:
+        """Drop local entries invalidated by other processes"""
+        while True:
+            try:
+                pubsub = (await self._redis()).pubsub()
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._drop_local(loads(message["data"], "cache"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._redis_failed(e)
+                await asyncio.sleep(5.0)
+
+    def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self.listen())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "local_entries": len(self.local._data),
+            "redis_available": self._redis_ok(),
+            "load": self.load_latency.snapshot(),
+        }
+
+    # Sync API, for Celery workers and sync endpoints
+
+    def get_or_load_sync(self, key: str, loader: Callable[[], Any], ttl: float, tags: Iterable[str] = ()) -> Any:
+        value = self._get_sync(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        with self._sync_locks[hash(key) % SYNC_LOCK_STRIPES]:
+            value = self._get_sync(key)
+            if value is not MISSING:
+                return value
+            return self._load_locked_sync(key, loader, ttl, tags)
+
+    def _load_locked_sync(self, key: str, loader: Callable[[], Any], ttl: float, tags: Iterable[str]) -> Any:
+        lock = self._key(f"lock:{key}")
+        token = uuid.uuid4().hex
+        redis = None
+        if self._redis_ok():
+            try:
+                redis = redis_pool.get_sync_redis()
+                deadline = time.monotonic() + self.lock_ttl
+                while not redis.set(lock, token, nx=True, px=int(self.lock_ttl * 1000)):
+                    # another process is loading it; wait for its result
+                    time.sleep(0.05)
+                    value = self._get_sync(key)
+                    if value is not MISSING:
+                        return value
+                    if time.monotonic() > deadline:
+                        break
+            except Exception as e:
+                self._redis_failed(e)
+                redis = None
+        try:
+            started = time.perf_counter()
+            self.misses += 1
+            value = loader()
+            self.load_latency.record(time.perf_counter() - started)
+            self._set_sync(key, value, ttl, tags)
+            return value
+        finally:
+            if redis is not None:
+                try:
+                    redis.eval(_UNLOCK, 1, lock, token)
+                except Exception as e:
+                    self._redis_failed(e)
+
+    def _get_sync(self, key: str) -> Any:
+        value = self.local.get(key)
+        if value is not MISSING or not self._redis_ok():
+            return value
+        try:
+            data = redis_pool.get_sync_redis().get(self._key(key))
+        except Exception as e:
+            self._redis_failed(e)
+            return MISSING
+        value = _loads(key, data)
+        if value is not MISSING:
+            self.local.set(key, value, self.local_ttl)
+        return value
+
+    def _set_sync(self, key: str, value: Any, ttl: float, tags: Iterable[str]) -> None:
+        if ttl <= 0:
+            return
+        self.local.set(key, value, min(ttl, self.local_ttl))
+        if not self._redis_ok():
+            return
+        try:
+            pipe = redis_pool.get_sync_redis().pipeline()
+            pipe.set(self._key(key), dumps(value, "cache", refs=False), px=max(1, int(ttl * 1000)))
+            for tag in tags:
+                pipe.sadd(self._tag(tag), self._key(key))
+                pipe.expire(self._tag(tag), int(ttl) + 60)
+            pipe.execute()
+        except Exception as e:
+            self._redis_failed(e)
+
+    def invalidate_sync(self, *tags: str) -> int:
+        if not self._redis_ok():
+            self.local.clear()
+            return 0
+        try:
+            redis = redis_pool.get_sync_redis()
+            keys = set()
+            for tag in tags:
+                keys.update(redis.smembers(self._tag(tag)))
+            if keys:
+                redis.delete(*keys)
+                redis.publish(self.channel, dumps([_decode(k) for k in keys], "cache"))
+            redis.delete(*(self._tag(t) for t in tags))
+        except Exception as e:
+            self._redis_failed(e)
+            self.local.clear()
+            return 0
+        self._drop_local(keys)
+        return len(keys)
+
+
+def _decode(key: Union[bytes, str]) -> str:
+    return key.decode() if isinstance(key, bytes) else key
+
+
+def _default_key(func: Callable, args: tuple, kwargs: dict) -> str:
+    parts = [repr(a) for a in args] + [f"{k}={v!r}" for k, v in sorted(kwargs.items())]
+    return f"{func.__module__}.{func.__qualname__}({','.join(parts)})"
+
+
+def cached(
+    ttl: float,
+    key: Optional[Callable[..., str]] = None,
+    tags: Tags = None,
+    cache: Optional["Cache"] = None,
+):
+    """
+    Read-through caching for a function, async or sync:
+
+        @cached(ttl=300, tags=lambda ticker, *a, **k: [f"ticker:{ticker}"])
+        def get_stock_data(ticker, start_date, end_date): ...
+
+    `key` builds the cache key from the call's arguments (default: module,
+    name and argument reprs); `tags` is a list or a callable returning one.
+    """
+    def decorator(func):
+        def resolve(args, kwargs):
+            k = key(*args, **kwargs) if key is not None else _default_key(func, args, kwargs)
+            t = tags(*args, **kwargs) if callable(tags) else (tags or ())
+            return k, t
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                k, t = resolve(args, kwargs)
+                return await (cache or default_cache).get_or_load(k, lambda: func(*args, **kwargs), ttl, t)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def sync_wrapper(*args, **kwargs):
+            k, t = resolve(args, kwargs)
+            return (cache or default_cache).get_or_load_sync(k, lambda: func(*args, **kwargs), ttl, t)
+
+        return sync_wrapper
+
+    return decorator
+
+
+default_cache = Cache()
@@ -1,5 +1,6 @@
 from celery import Celery
 from app.core.config import settings
+from app.core.serialization import register_kombu
 
 celery_app = Celery(
     "worker",
@@ -11,10 +12,21 @@ celery_app.conf.task_routes = {
     "app.worker.tasks.*": "main-queue",
 }
 
+register_kombu()
+
 celery_app.conf.update(
-    task_serializer='json',
-    accept_content=['json'],
-    result_serializer='json',
+    task_serializer='msgpack-task',
+    accept_content=['msgpack-task', 'msgpack-result', 'json'],
+    result_serializer='msgpack-result',
+    result_accept_content=['msgpack-result', 'json'],
     timezone='UTC',
     enable_utc=True,
-)
\ No newline at end of file
+)
+
+# expired array store files are removed by whichever worker runs beat
+celery_app.conf.beat_schedule = {
+    "sweep-array-store": {
+        "task": "app.worker.tasks.sweep_array_store_task",
+        "schedule": settings.SERIALIZATION_SWEEP_INTERVAL,
+    },
+}
@@ -21,6 +21,12 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8  # 60 minutes * 24 hours * 8 days = 8 days
 
     SQLALCHEMY_DATABASE_URI: Optional[str] = os.getenv("DATABASE_URL")
+    # Applied to the sync and the async (asyncpg) engine alike
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
 
     FIRST_SUPERUSER_EMAIL: EmailStr = "admin@example.com"
     FIRST_SUPERUSER_PASSWORD: str = "admin"
@@ -29,6 +35,8 @@ class Settings(BaseSettings):
     KITE_API_KEY: str = os.getenv("KITE_API_KEY", "your-kite-api-key")
     KITE_API_SECRET: str = os.getenv("KITE_API_SECRET", "your-kite-api-secret")
     KITE_ACCESS_TOKEN: str = os.getenv("KITE_ACCESS_TOKEN", "your-kite-access-token")
+    KITE_MAX_CONNECTIONS: int = int(os.getenv("KITE_MAX_CONNECTIONS", "10"))
+    PRICE_CACHE_TTL: float = float(os.getenv("PRICE_CACHE_TTL", "1.0"))
 
     # NewsAPI
     NEWS_API_KEY: str = os.getenv("NEWS_API_KEY", "your-news-api-key")
@@ -43,9 +51,114 @@ class Settings(BaseSettings):
     CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
     CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 
-    # Celery
-    CELERY_BROKER_URL: str = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
-    CELERY_RESULT_BACKEND: str = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+    # Redis
+    REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+
+    # Socket.IO push: rooms are flushed at most once per frame; emits fan out across workers via Redis
+    SOCKETIO_REDIS_MANAGER: bool = os.getenv("SOCKETIO_REDIS_MANAGER", "true").lower() == "true"
+    PUSH_FRAME_INTERVAL: float = float(os.getenv("PUSH_FRAME_INTERVAL", "0.25"))
+    PUSH_SNAPSHOT_TTL: int = int(os.getenv("PUSH_SNAPSHOT_TTL", "300"))
+    PUSH_ROOMS_TTL: int = int(os.getenv("PUSH_ROOMS_TTL", "30"))
+
+    # Shared cache: an in-process LRU in front of Redis; TTLs in seconds
+    CACHE_LOCAL_SIZE: int = int(os.getenv("CACHE_LOCAL_SIZE", "2048"))
+    CACHE_LOCAL_TTL: float = float(os.getenv("CACHE_LOCAL_TTL", "5.0"))
+    CACHE_MARKET_DATA_TTL: int = int(os.getenv("CACHE_MARKET_DATA_TTL", "300"))
+    CACHE_NEWS_TTL: int = int(os.getenv("CACHE_NEWS_TTL", "900"))
+    CACHE_INSTRUMENTS_TTL: int = int(os.getenv("CACHE_INSTRUMENTS_TTL", "21600"))
+    CACHE_STRATEGY_TTL: int = int(os.getenv("CACHE_STRATEGY_TTL", "3600"))
+    CACHE_USER_TTL: int = int(os.getenv("CACHE_USER_TTL", "300"))
+
+    # Worker payloads: msgpack, arrays above REF_MIN_BYTES passed by reference ("file" or "redis")
+    SERIALIZATION_COMPRESS_MIN_BYTES: int = int(os.getenv("SERIALIZATION_COMPRESS_MIN_BYTES", "4096"))
+    SERIALIZATION_REF_MIN_BYTES: int = int(os.getenv("SERIALIZATION_REF_MIN_BYTES", str(1 << 20)))
+    SERIALIZATION_REF_BACKEND: str = os.getenv("SERIALIZATION_REF_BACKEND", "file")
+    SERIALIZATION_REF_TTL: int = int(os.getenv("SERIALIZATION_REF_TTL", "86400"))
+    SHARED_ARRAY_DIR: str = os.getenv("SHARED_ARRAY_DIR", "data/arrays")
+    SERIALIZATION_SWEEP_INTERVAL: int = int(os.getenv("SERIALIZATION_SWEEP_INTERVAL", "3600"))
+
+    # Parameter sweeps fan out to Celery workers, or a local process pool with OPTIMIZATION_BACKEND=local
+    OPTIMIZATION_BACKEND: str = os.getenv("OPTIMIZATION_BACKEND", "celery")
+    OPTIMIZATION_CHUNK_PAIRS: int = int(os.getenv("OPTIMIZATION_CHUNK_PAIRS", "32"))
+    OPTIMIZATION_WORKERS: int = int(os.getenv("OPTIMIZATION_WORKERS", "0"))
+    OPTIMIZATION_CACHE_DIR: str = os.getenv("OPTIMIZATION_CACHE_DIR", "data/optimization")
+
+    # Event-driven strategy backtests: starting cash, slippage per fill and the IST time MIS positions are squared off
+    BACKTEST_CAPITAL: float = float(os.getenv("BACKTEST_CAPITAL", "1000000"))
+    BACKTEST_SLIPPAGE_BPS: float = float(os.getenv("BACKTEST_SLIPPAGE_BPS", "2.0"))
+    BACKTEST_SQUAREOFF: str = os.getenv("BACKTEST_SQUAREOFF", "15:20")
+
+    # Kite instrument master, stored per day as memory-mapped columns; refreshed after this IST hour
+    INSTRUMENTS_DIR: str = os.getenv("INSTRUMENTS_DIR", "data/instruments")
+    INSTRUMENTS_REFRESH_HOUR: int = int(os.getenv("INSTRUMENTS_REFRESH_HOUR", "8"))
+    INSTRUMENTS_CHECK_INTERVAL: float = float(os.getenv("INSTRUMENTS_CHECK_INTERVAL", "600"))
+
+    # Local bar store
+    BAR_STORE_DIR: str = os.getenv("BAR_STORE_DIR", "data/bars")
+
+    # Live ticks
+    TICKER_ENABLED: bool = os.getenv("TICKER_ENABLED", "false").lower() == "true"
+    TICK_BUFFER_SIZE: int = int(os.getenv("TICK_BUFFER_SIZE", "2048"))
+    TICK_QUEUE_SIZE: int = int(os.getenv("TICK_QUEUE_SIZE", "1024"))
+
+    # Automated strategies run in the API process unless sharded across Celery workers
+    STRATEGY_SCHEDULER_ENABLED: bool = os.getenv("STRATEGY_SCHEDULER_ENABLED", "false").lower() == "true"
+
+    # Position books are written to the DB on a debounce and checked against the broker periodically
+    PORTFOLIO_PERSIST_INTERVAL: float = float(os.getenv("PORTFOLIO_PERSIST_INTERVAL", "2.0"))
+    PORTFOLIO_RECONCILE_INTERVAL: float = float(os.getenv("PORTFOLIO_RECONCILE_INTERVAL", "60.0"))
+
+    # Order tracking: fills are written in batches; orders quiet for ORDER_POLL_INTERVAL are backfilled from one orders() call
+    ORDER_FLUSH_INTERVAL: float = float(os.getenv("ORDER_FLUSH_INTERVAL", "0.5"))
+    ORDER_POLL_INTERVAL: float = float(os.getenv("ORDER_POLL_INTERVAL", "5.0"))
+
+    # Paper trading: orders go to an in-process simulated broker matched against live or replayed ticks.
+    # Replays a tick recording (PAPER_REPLAY_PATH) or stored bars of PAPER_REPLAY_SYMBOLS; needs TICKER_ENABLED.
+    PAPER_TRADING: bool = os.getenv("PAPER_TRADING", "false").lower() == "true"
+    PAPER_CAPITAL: float = float(os.getenv("PAPER_CAPITAL", "1000000"))
+    PAPER_SLIPPAGE_BPS: float = float(os.getenv("PAPER_SLIPPAGE_BPS", "2.0"))
+    PAPER_LATENCY: float = float(os.getenv("PAPER_LATENCY", "0.05"))
+    PAPER_PARTICIPATION: float = float(os.getenv("PAPER_PARTICIPATION", "0.1"))
+    PAPER_INSTRUMENTS_CSV: str = os.getenv("PAPER_INSTRUMENTS_CSV", "")
+    PAPER_REPLAY_PATH: str = os.getenv("PAPER_REPLAY_PATH", "")
+    PAPER_REPLAY_SYMBOLS: str = os.getenv("PAPER_REPLAY_SYMBOLS", "")
+    PAPER_REPLAY_INTERVAL: str = os.getenv("PAPER_REPLAY_INTERVAL", "1m")
+    PAPER_REPLAY_START: str = os.getenv("PAPER_REPLAY_START", "")
+    PAPER_REPLAY_END: str = os.getenv("PAPER_REPLAY_END", "")
+    PAPER_REPLAY_SPEED: float = float(os.getenv("PAPER_REPLAY_SPEED", "60.0"))
+
+    # Option chains: IV and Greeks of chains with new ticks are re-solved every OPTIONS_REFRESH_INTERVAL seconds.
+    # OPTIONS_WATCH lists underlyings (e.g. "NIFTY,BANKNIFTY") whose nearest OPTIONS_WATCH_EXPIRIES chains load at startup.
+    OPTIONS_REFRESH_INTERVAL: float = float(os.getenv("OPTIONS_REFRESH_INTERVAL", "1.0"))
+    OPTIONS_RISK_FREE_RATE: float = float(os.getenv("OPTIONS_RISK_FREE_RATE", "0.065"))
+    OPTIONS_WATCH: str = os.getenv("OPTIONS_WATCH", "")
+    OPTIONS_WATCH_EXPIRIES: int = int(os.getenv("OPTIONS_WATCH_EXPIRIES", "3"))
+
+    # Server-side stop-loss/target/trailing exits; ratcheted stops are written back every EXIT_PERSIST_INTERVAL.
+    # Exit orders that fail are retried EXIT_RETRIES times with doubling backoff, then re-armed.
+    EXIT_PERSIST_INTERVAL: float = float(os.getenv("EXIT_PERSIST_INTERVAL", "5.0"))
+    EXIT_RETRIES: int = int(os.getenv("EXIT_RETRIES", "3"))
+    EXIT_RETRY_BACKOFF: float = float(os.getenv("EXIT_RETRY_BACKOFF", "0.5"))
+    # Exits fire from one process only, the holder of a Redis lease renewed well within EXIT_LEADER_TTL seconds
+    EXIT_LEADER_TTL: int = int(os.getenv("EXIT_LEADER_TTL", "15"))
+
+    # Portfolio risk (VaR, beta, correlation) from daily bars in the bar store
+    RISK_REFRESH_INTERVAL: float = float(os.getenv("RISK_REFRESH_INTERVAL", "5.0"))
+    RISK_LOOKBACK: int = int(os.getenv("RISK_LOOKBACK", "250"))
+    RISK_CONFIDENCE: float = float(os.getenv("RISK_CONFIDENCE", "0.95"))
+    RISK_BENCHMARK: str = os.getenv("RISK_BENCHMARK", "^NSEI")
+    SECTOR_MAP_PATH: str = os.getenv("SECTOR_MAP_PATH", "data/sectors.json")
+
+    # Pre-trade limits applied to every user unless overridden; 0 disables a limit
+    PRETRADE_MAX_POSITION_QTY: float = float(os.getenv("PRETRADE_MAX_POSITION_QTY", "10000"))
+    PRETRADE_MAX_ORDER_NOTIONAL: float = float(os.getenv("PRETRADE_MAX_ORDER_NOTIONAL", "1000000"))
+    PRETRADE_MAX_GROSS_NOTIONAL: float = float(os.getenv("PRETRADE_MAX_GROSS_NOTIONAL", "5000000"))
+    PRETRADE_MAX_CONCENTRATION: float = float(os.getenv("PRETRADE_MAX_CONCENTRATION", "0.4"))
+    PRETRADE_CONCENTRATION_FLOOR: float = float(os.getenv("PRETRADE_CONCENTRATION_FLOOR", "100000"))
+    PRETRADE_MAX_DAILY_LOSS: float = float(os.getenv("PRETRADE_MAX_DAILY_LOSS", "50000"))
+    PRETRADE_PRICE_BAND: float = float(os.getenv("PRETRADE_PRICE_BAND", "0.05"))
+    PRETRADE_ORDERS_PER_SECOND: float = float(os.getenv("PRETRADE_ORDERS_PER_SECOND", "5"))
 
     class Config:
         case_sensitive = True
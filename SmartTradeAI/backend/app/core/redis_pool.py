@@ -1,11 +1,13 @@
 import aioredis
+import redis as sync_redis_lib
 from app.core.config import settings
 
 redis = None
+sync_redis = None
 
 async def init_redis():
     global redis
-    redis = await aioredis.from_url(settings.REDIS_URL)
+    redis = aioredis.from_url(settings.REDIS_URL, max_connections=settings.REDIS_MAX_CONNECTIONS)
     return redis
 
 async def get_redis():
@@ -13,7 +15,15 @@ async def get_redis():
         await init_redis()
     return redis
 
+def get_sync_redis():
+    """Blocking client for Celery workers and sync endpoints"""
+    global sync_redis
+    if sync_redis is None:
+        sync_redis = sync_redis_lib.Redis.from_url(settings.REDIS_URL, max_connections=settings.REDIS_MAX_CONNECTIONS)
+    return sync_redis
+
 async def close_redis():
+    global redis
     if redis is not None:
         await redis.close()
-        await redis.wait_closed()
\ No newline at end of file
+        redis = None
@@ -0,0 +1,223 @@
+import functools
+import hashlib
+import os
+import time
+import zlib
+from datetime import date, datetime
+from typing import Any, Optional
+
+import msgpack
+import numpy as np
+
+from app.core.config import settings
+from app.utils.metrics import histogram, size_stats
+
+# msgpack extension type codes
+EXT_NDARRAY = 1
+EXT_ARRAY_REF = 2
+EXT_DATAFRAME = 3
+EXT_DATETIME = 4
+EXT_DATE = 5
+EXT_ARROW = 6
+
+# First byte of every payload
+RAW = b"\x00"
+ZLIB = b"\x01"
+
+
+class ArrayStore:
+    """
+    Content-addressed home for arrays too large to inline in a message.
+
+    "file" writes .npy files to a directory every worker can see and maps
+    them back read-only; "redis" keeps the raw bytes under an expiring key.
+    Identical arrays share one entry.
+    """
+
+    def __init__(self, backend: Optional[str] = None, root: Optional[str] = None, ttl: Optional[int] = None):
+        self.backend = backend or settings.SERIALIZATION_REF_BACKEND
+        self.root = root or settings.SHARED_ARRAY_DIR
+        self.ttl = ttl or settings.SERIALIZATION_REF_TTL
+        self._redis = None
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            import redis
+
+            self._redis = redis.Redis.from_url(settings.REDIS_URL)
+        return self._redis
+
+    def put(self, array: np.ndarray) -> str:
+        array = np.ascontiguousarray(array)
+        key = hashlib.sha1(array.data).hexdigest()
+        # a reused entry must live as long as a new one, so its expiry is pushed back
+        if self.backend == "redis":
+            if not self.redis.set(f"array:{key}", array.tobytes(), ex=self.ttl, nx=True):
+                self.redis.expire(f"array:{key}", self.ttl)
+            return key
+        path = os.path.join(self.root, f"{key}.npy")
+        try:
+            os.utime(path)
+            return key
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp, path)
+        return key
+
+    def get(self, key: str, dtype: str, shape) -> np.ndarray:
+        if self.backend == "redis":
+            data = self.redis.get(f"array:{key}")
+            if data is None:
+                raise KeyError(f"Array {key} has expired")
+            return np.frombuffer(data, dtype=dtype).reshape(shape)
+        return np.load(os.path.join(self.root, f"{key}.npy"), mmap_mode="r")
+
+    def sweep(self, max_age: Optional[int] = None) -> int:
+        """Delete file entries older than `max_age` seconds; returns how many"""
+        if self.backend == "redis" or not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - (max_age or self.ttl)
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                # swept by another worker
+                continue
+        return removed
+
+
+array_store = ArrayStore()
+
+
+def _pack_array(array: np.ndarray, default) -> bytes:
+    if array.dtype.hasobject:
+        return msgpack.packb(["O", list(array.shape), array.tolist()], default=default, use_bin_type=True)
+    array = np.ascontiguousarray(array)
+    return msgpack.packb([array.dtype.str, list(array.shape), array.tobytes()], use_bin_type=True)
+
+
+def _unpack_array(data: bytes) -> np.ndarray:
+    dtype, shape, body = msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+    if dtype == "O":
+        return np.array(body, dtype=object).reshape(shape)
+    return np.frombuffer(body, dtype=dtype).reshape(shape)
+
+
+def _default(obj: Any, refs: bool = True) -> Any:
+    if isinstance(obj, np.ndarray):
+        if refs and not obj.dtype.hasobject and obj.nbytes >= settings.SERIALIZATION_REF_MIN_BYTES:
+            key = array_store.put(obj)
+            ref = [array_store.backend, key, obj.dtype.str, list(obj.shape)]
+            return msgpack.ExtType(EXT_ARRAY_REF, msgpack.packb(ref, use_bin_type=True))
+        return msgpack.ExtType(EXT_NDARRAY, _pack_array(obj, _default if refs else _inline))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, date):
+        return msgpack.ExtType(EXT_DATE, obj.isoformat().encode())
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    module = type(obj).__module__
+    if module.startswith("pandas") and type(obj).__name__ == "DataFrame":
+        # columnar: one typed array per column plus the index
+        columns = {
+            "index": obj.index.to_numpy(),
+            "index_name": obj.index.name,
+            "columns": [str(c) for c in obj.columns],
+            "data": [obj[c].to_numpy() for c in obj.columns],
+        }
+        default = _default if refs else _inline
+        return msgpack.ExtType(EXT_DATAFRAME, msgpack.packb(columns, default=default, use_bin_type=True))
+    if module.startswith("pyarrow") and type(obj).__name__ == "Table":
+        import pyarrow as pa
+
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, obj.schema) as writer:
+            writer.write_table(obj)
+        return msgpack.ExtType(EXT_ARROW, sink.getvalue().to_pybytes())
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+_inline = functools.partial(_default, refs=False)
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    if code == EXT_NDARRAY:
+        return _unpack_array(data)
+    if code == EXT_ARRAY_REF:
+        backend, key, dtype, shape = msgpack.unpackb(data, raw=False)
+        store = array_store if backend == array_store.backend else ArrayStore(backend)
+        return store.get(key, dtype, shape)
+    if code == EXT_DATAFRAME:
+        import pandas as pd
+
+        columns = msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+        index = pd.Index(columns["index"], name=columns["index_name"])
+        return pd.DataFrame(dict(zip(columns["columns"], columns["data"])), index=index)
+    if code == EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return date.fromisoformat(data.decode())
+    if code == EXT_ARROW:
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(data).read_all()
+    return msgpack.ExtType(code, data)
+
+
+def dumps(obj: Any, name: str = "payload", refs: bool = True) -> bytes:
+    """
+    Encode to msgpack with NumPy/pandas/Arrow extensions. Arrays above
+    SERIALIZATION_REF_MIN_BYTES go to the array store and travel as a
+    reference, unless `refs` is off (payloads that outlive the store's
+    TTL); payloads above SERIALIZATION_COMPRESS_MIN_BYTES are
+    zlib-compressed.
+    """
+    started = time.perf_counter()
+    body = msgpack.packb(obj, default=_default if refs else _inline, use_bin_type=True)
+    if len(body) >= settings.SERIALIZATION_COMPRESS_MIN_BYTES:
+        packed = ZLIB + zlib.compress(body, 1)
+    else:
+        packed = RAW + body
+    histogram(f"serialization.{name}.encode").record(time.perf_counter() - started)
+    size_stats(f"serialization.{name}").record(len(packed), len(body))
+    return packed
+
+
+def loads(data: bytes, name: str = "payload") -> Any:
+    started = time.perf_counter()
+    if isinstance(data, str):
+        data = data.encode("latin-1")
+    header, body = data[:1], data[1:]
+    if header == ZLIB:
+        body = zlib.decompress(body)
+    obj = msgpack.unpackb(body, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+    histogram(f"serialization.{name}.decode").record(time.perf_counter() - started)
+    return obj
+
+
+def register_kombu() -> None:
+    """
+    Register the codec with kombu twice, as "msgpack-task" and
+    "msgpack-result", so task and result sizes are reported separately.
+    """
+    from kombu.serialization import register
+
+    for name in ("task", "result"):
+        register(
+            f"msgpack-{name}",
+            lambda obj, name=name: dumps(obj, name),
+            lambda data, name=name: loads(data, name),
+            content_type=f"application/x-smarttrade-{name}",
+            content_encoding="binary",
+        )
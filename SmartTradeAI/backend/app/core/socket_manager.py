@@ -1,11 +1,13 @@
 import socketio
 
-sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+from app.core.config import settings
 
-@sio.event
-async def connect(sid, environ):
-    print("connect ", sid)
+# With several uvicorn workers, emits go through Redis so each worker
+# delivers them to its own connected clients
+client_manager = socketio.AsyncRedisManager(settings.REDIS_URL) if settings.SOCKETIO_REDIS_MANAGER else None
 
-@sio.event
-async def disconnect(sid):
-    print("disconnect ", sid)
+sio = socketio.AsyncServer(
+    async_mode="asgi",
+    cors_allowed_origins="*",
+    client_manager=client_manager,
+)
@@ -1,8 +1,14 @@
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, Dict, Generic, List, Optional, Sequence, Tuple, Type, TypeVar, Union
 
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy import func, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
 
 from app.db.base_class import Base
 
@@ -11,6 +17,119 @@ CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
 
 
+def _mappings(objs_in: Sequence[Union[BaseModel, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # unlike jsonable_encoder this keeps dates and enums as Python objects
+    return [obj.dict(exclude_unset=True) if isinstance(obj, BaseModel) else dict(obj) for obj in objs_in]
+
+
+def _batches(rows: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    # an executemany takes its columns from the first row, so rows are
+    # grouped by the set of keys they carry
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return list(groups.values())
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Opaque cursor for the sort key of the last row on a page"""
+    plain = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(plain).encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError("Invalid cursor")
+    decoded = []
+    for column, value in zip(columns, values):
+        python_type = column.type.python_type
+        if python_type is datetime and isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        elif python_type is date and isinstance(value, str):
+            value = date.fromisoformat(value)
+        decoded.append(value)
+    return decoded
+
+
+def keyset(
+    model, query: Select, order_by: Sequence[str], descending: bool, cursor: Optional[str], limit: int
+) -> Tuple[Select, List]:
+    """
+    Page `query` by the row value of its sort columns instead of OFFSET:
+    each page starts right after the cursor, so deep pages cost the same
+    as the first when the columns are indexed. `id` is appended as a
+    tie-breaker; one extra row is fetched to know whether there is a next
+    page.
+    """
+    columns = [getattr(model, name) for name in order_by]
+    if "id" not in order_by:
+        columns.append(model.id)
+    if cursor:
+        key, after = tuple_(*columns), tuple_(*decode_cursor(cursor, columns))
+        query = query.where(key < after if descending else key > after)
+    ordering = [c.desc() if descending else c.asc() for c in columns]
+    return query.order_by(*ordering).limit(limit + 1), columns
+
+
+def page_of(rows: List, columns: Sequence, limit: int) -> Tuple[List, Optional[str]]:
+    """(items, next cursor) from the limit + 1 rows a keyset query returned"""
+    items = rows[:limit]
+    if len(rows) <= limit or not items:
+        return items, None
+    last = items[-1]
+    return items, encode_cursor([getattr(last, c.key) for c in columns])
+
+
+def count_statement(dialect: str, query: Select, estimate: bool) -> Tuple[Any, bool]:
+    """
+    (statement, estimated) counting the rows of `query`. On PostgreSQL an
+    estimate comes from the planner (EXPLAIN) instead of a COUNT(*) over
+    every matching row; filters that cannot be inlined fall back to the
+    exact count.
+    """
+    if estimate and dialect == "postgresql":
+        from sqlalchemy import text
+        from sqlalchemy.dialects import postgresql
+        from sqlalchemy.exc import CompileError
+
+        try:
+            compiled = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+            return text(f"EXPLAIN (FORMAT JSON) {compiled}"), True
+        except CompileError:
+            pass
+    return select(func.count()).select_from(query.order_by(None).subquery()), False
+
+
+def read_count(result, estimated: bool) -> int:
+    if estimated:
+        plan = result.scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        return int(plan[0]["Plan"]["Plan Rows"])
+    return int(result.scalar())
+
+
+def upsert_statement(model, dialect: str, rows: List[Dict[str, Any]], index_elements: Sequence[str], update_columns: Optional[Sequence[str]]):
+    """INSERT ... ON CONFLICT (index_elements) DO UPDATE for PostgreSQL and SQLite"""
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise ValueError(f"upsert is not supported on {dialect}")
+    statement = dialect_insert(model.__table__)
+    columns = update_columns or [c for c in rows[0] if c not in index_elements]
+    assignments = {c: statement.excluded[c] for c in columns}
+    if "updated_at" in model.__table__.columns and "updated_at" not in assignments:
+        assignments["updated_at"] = func.now()
+    if not assignments:
+        return statement.on_conflict_do_nothing(index_elements=list(index_elements))
+    return statement.on_conflict_do_update(index_elements=list(index_elements), set_=assignments)
+
+
 class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     def __init__(self, model: Type[ModelType]):
         """
@@ -62,3 +181,178 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db.delete(obj)
         db.commit()
         return obj
+
+    def create_many(
+        self, db: Session, *, objs_in: Sequence[Union[CreateSchemaType, Dict[str, Any]]], commit: bool = True
+    ) -> int:
+        """Insert many rows as one executemany; returns how many"""
+        rows = _mappings(objs_in)
+        if rows:
+            for batch in _batches(rows):
+                db.execute(insert(self.model), batch)
+            if commit:
+                db.commit()
+        return len(rows)
+
+    def update_many(self, db: Session, *, rows: Sequence[Dict[str, Any]], commit: bool = True) -> int:
+        """Update many rows by primary key; every mapping needs an `id`"""
+        rows = _mappings(rows)
+        if rows:
+            db.bulk_update_mappings(self.model, rows)
+            if commit:
+                db.commit()
+        return len(rows)
+
+    def upsert_many(
+        self,
+        db: Session,
+        *,
+        objs_in: Sequence[Union[CreateSchemaType, Dict[str, Any]]],
+        index_elements: Sequence[str],
+        update_columns: Optional[Sequence[str]] = None,
+        commit: bool = True
+    ) -> int:
+        """Insert rows, updating those that collide on the unique `index_elements`"""
+        rows = _mappings(objs_in)
+        if rows:
+            for batch in _batches(rows):
+                statement = upsert_statement(self.model, db.bind.dialect.name, batch, index_elements, update_columns)
+                db.execute(statement, batch)
+            if commit:
+                db.commit()
+        return len(rows)
+
+    def get_page(
+        self,
+        db: Session,
+        *,
+        query: Optional[Select] = None,
+        order_by: Sequence[str] = ("id",),
+        descending: bool = True,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        count: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        One keyset page of `query` (default: all rows). `count` is None,
+        "estimate" or "exact"; only the first page is counted.
+        """
+        query = query if query is not None else select(self.model)
+        paged, columns = keyset(self.model, query, order_by, descending, cursor, limit)
+        items, next_cursor = page_of(db.execute(paged).scalars().all(), columns, limit)
+        total, estimated = None, False
+        if count and not cursor:
+            statement, estimated = count_statement(db.bind.dialect.name, query, count == "estimate")
+            total = read_count(db.execute(statement), estimated)
+        return {"items": items, "next_cursor": next_cursor, "limit": limit, "total": total, "estimated": estimated}
+
+
+class AsyncCRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
+    def __init__(self, model: Type[ModelType]):
+        """
+        CRUDBase for an AsyncSession, for code running on the event loop.
+        **Parameters**
+        * `model`: A SQLAlchemy model class
+        """
+        self.model = model
+
+    async def get(self, db: AsyncSession, id: Any) -> Optional[ModelType]:
+        return await db.get(self.model, id)
+
+    async def get_multi(
+        self, db: AsyncSession, *, skip: int = 0, limit: int = 100
+    ) -> List[ModelType]:
+        result = await db.execute(select(self.model).offset(skip).limit(limit))
+        return result.scalars().all()
+
+    async def create(self, db: AsyncSession, *, obj_in: CreateSchemaType) -> ModelType:
+        obj_in_data = jsonable_encoder(obj_in)
+        db_obj = self.model(**obj_in_data)  # type: ignore
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def update(
+        self,
+        db: AsyncSession,
+        *,
+        db_obj: ModelType,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]]
+    ) -> ModelType:
+        if isinstance(obj_in, dict):
+            update_data = obj_in
+        else:
+            update_data = obj_in.dict(exclude_unset=True)
+        columns = {c.key for c in self.model.__table__.columns}
+        for field, value in update_data.items():
+            if field in columns:
+                setattr(db_obj, field, value)
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def remove(self, db: AsyncSession, *, id: int) -> Optional[ModelType]:
+        obj = await db.get(self.model, id)
+        if obj is not None:
+            await db.delete(obj)
+            await db.commit()
+        return obj
+
+    async def create_many(
+        self, db: AsyncSession, *, objs_in: Sequence[Union[CreateSchemaType, Dict[str, Any]]], commit: bool = True
+    ) -> int:
+        rows = _mappings(objs_in)
+        if rows:
+            for batch in _batches(rows):
+                await db.execute(insert(self.model), batch)
+            if commit:
+                await db.commit()
+        return len(rows)
+
+    async def update_many(self, db: AsyncSession, *, rows: Sequence[Dict[str, Any]], commit: bool = True) -> int:
+        rows = _mappings(rows)
+        if rows:
+            await db.run_sync(lambda session: session.bulk_update_mappings(self.model, rows))
+            if commit:
+                await db.commit()
+        return len(rows)
+
+    async def upsert_many(
+        self,
+        db: AsyncSession,
+        *,
+        objs_in: Sequence[Union[CreateSchemaType, Dict[str, Any]]],
+        index_elements: Sequence[str],
+        update_columns: Optional[Sequence[str]] = None,
+        commit: bool = True
+    ) -> int:
+        rows = _mappings(objs_in)
+        if rows:
+            for batch in _batches(rows):
+                statement = upsert_statement(self.model, db.bind.dialect.name, batch, index_elements, update_columns)
+                await db.execute(statement, batch)
+            if commit:
+                await db.commit()
+        return len(rows)
+
+    async def get_page(
+        self,
+        db: AsyncSession,
+        *,
+        query: Optional[Select] = None,
+        order_by: Sequence[str] = ("id",),
+        descending: bool = True,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        count: Optional[str] = None
+    ) -> Dict[str, Any]:
+        query = query if query is not None else select(self.model)
+        paged, columns = keyset(self.model, query, order_by, descending, cursor, limit)
+        items, next_cursor = page_of((await db.execute(paged)).scalars().all(), columns, limit)
+        total, estimated = None, False
+        if count and not cursor:
+            statement, estimated = count_statement(db.bind.dialect.name, query, count == "estimate")
+            total = read_count(await db.execute(statement), estimated)
+        return {"items": items, "next_cursor": next_cursor, "limit": limit, "total": total, "estimated": estimated}
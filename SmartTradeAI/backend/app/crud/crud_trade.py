@@ -0,0 +1,42 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.base import AsyncCRUDBase
+from app.models.trade import Trade, TradeStatus
+from app.schemas.trade import TradeCreate, TradeUpdate
+
+
+class CRUDTrade(AsyncCRUDBase[Trade, TradeCreate, TradeUpdate]):
+    async def history(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: int,
+        portfolio_id: Optional[int] = None,
+        symbol: Optional[str] = None,
+        status: Optional[TradeStatus] = None,
+        since: Optional[datetime] = None,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        count: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """A user's trades, newest first, one keyset page at a time"""
+        query = select(Trade).where(Trade.user_id == user_id)
+        if portfolio_id is not None:
+            query = query.where(Trade.portfolio_id == portfolio_id)
+        if symbol:
+            query = query.where(Trade.symbol == symbol)
+        if status is not None:
+            query = query.where(Trade.status == status)
+        if since is not None:
+            query = query.where(Trade.entry_time >= since)
+        return await self.get_page(
+            db, query=query, order_by=("entry_time", "id"), descending=True,
+            cursor=cursor, limit=limit, count=count,
+        )
+
+
+trade = CRUDTrade(Trade)
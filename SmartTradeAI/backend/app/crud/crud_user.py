@@ -1,14 +1,40 @@
 from typing import Any, Dict, Optional, Union
 
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 
+from app.core.cache import default_cache
+from app.core.config import settings
 from app.crud.base import CRUDBase
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
 from app.core.security import get_password_hash
 
+# Columns kept in the shared cache; the password hash stays in the database
+CACHED_COLUMNS = ("id", "full_name", "email", "is_active", "is_superuser")
+
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
+    def _row(self, db: Session, id: Any) -> Optional[Dict[str, Any]]:
+        row = db.query(*(getattr(User, c) for c in CACHED_COLUMNS)).filter(User.id == id).first()
+        return dict(zip(CACHED_COLUMNS, row)) if row is not None else None
+
+    def get_cached(self, db: Session, id: Any) -> Optional[User]:
+        """
+        User by id through the shared cache, attached to `db` without a
+        query. Columns not cached are loaded on first access.
+        """
+        row = default_cache.get_or_load_sync(
+            f"user:{id}", lambda: self._row(db, id), settings.CACHE_USER_TTL, [f"user:{id}"]
+        )
+        if row is None:
+            return None
+        db_obj = User(**row)
+        make_transient_to_detached(db_obj)
+        return db.merge(db_obj, load=False)
+
+    def invalidate(self, id: Any) -> None:
+        default_cache.invalidate_sync(f"user:{id}")
+
     def get_by_email(self, db: Session, *, email: str) -> Optional[User]:
         return db.query(User).filter(User.email == email).first()
 
@@ -35,7 +61,14 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
             hashed_password = get_password_hash(update_data["password"])
             del update_data["password"]
             update_data["hashed_password"] = hashed_password
-        return super().update(db, db_obj=db_obj, obj_in=update_data)
+        db_obj = super().update(db, db_obj=db_obj, obj_in=update_data)
+        self.invalidate(db_obj.id)
+        return db_obj
+
+    def remove(self, db: Session, *, id: int) -> User:
+        db_obj = super().remove(db, id=id)
+        self.invalidate(id)
+        return db_obj
 
     def is_superuser(self, user: User) -> bool:
         return user.is_superuser
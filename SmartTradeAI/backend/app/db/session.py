@@ -1,7 +1,83 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from app.core.config import settings
+from app.utils.metrics import histogram
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            histogram("db.sync.pool_wait").record(time.perf_counter() - started)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            histogram("db.async.pool_wait").record(time.perf_counter() - started)
+
+
+def time_queries(engine, name: str) -> None:
+    """Record every statement's round trip in the "db.<name>.query" histogram"""
+    latency = histogram(f"db.{name}.query")
 
-engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, pool_pre_ping=True)
+    # the start lives on the statement's own context, so a failed statement leaves nothing behind
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is not None:
+            latency.record(time.perf_counter() - started)
+
+
+def async_url(url: str) -> str:
+    """The asyncpg form of a postgres URL, with asyncpg's prepared statement cache sized"""
+    parsed = make_url(url)
+    if parsed.drivername in ("postgresql", "postgres", "postgresql+psycopg2"):
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    if parsed.drivername == "postgresql+asyncpg":
+        parsed = parsed.update_query_dict(
+            {"prepared_statement_cache_size": str(settings.DB_STATEMENT_CACHE_SIZE)}
+        )
+    return str(parsed)
+
+
+pool_options = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+)
+
+# Sync engine, for Alembic, Celery tasks and sync endpoints
+engine = create_engine(settings.SQLALCHEMY_DATABASE_URI, poolclass=TimedQueuePool, **pool_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+time_queries(engine, "sync")
+
+# Async engine on asyncpg, for code running on the event loop. Its pool is
+# separate from the sync one, so size both against the server's limit.
+async_engine = create_async_engine(
+    async_url(settings.SQLALCHEMY_DATABASE_URI), poolclass=TimedAsyncQueuePool, **pool_options
+)
+AsyncSessionLocal = sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+time_queries(async_engine.sync_engine, "async")
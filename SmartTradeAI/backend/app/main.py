@@ -1,9 +1,28 @@
+import asyncio
+import socketio
 from app.telegram_bot import setup_telegram_bot
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
 from app.api.api_v1.api import api_router
+from app.core.cache import default_cache
 from app.core.config import settings
+from app.core.redis_pool import close_redis
 from app.core.socket_manager import sio
+from app.api import sockets  # noqa: F401  registers the socket event handlers
+from app.services.push import push_service
+from app.services.ticker import tick_service
+from app.services.instruments import instrument_registry
+from app.services.candles import candle_aggregator
+from app.services.scheduler import strategy_scheduler
+from app.services.position_book import position_books
+from app.services.risk import risk_engine
+from app.services.pretrade import pretrade_gate
+from app.services.orders import order_tracker
+from app.services.exits import exit_monitor
+from app.services.options import options_service
+from app.services.paper_broker import replay_source
+from app.services.zerodha import zerodha_service
+from app.db.session import SessionLocal
 
 app = FastAPI(
     title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json"
@@ -20,6 +39,59 @@ if settings.BACKEND_CORS_ORIGINS:
     )
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
+
+
+@app.on_event("startup")
+async def start_tick_ingestion():
+    def warm_pretrade_gate():
+        db = SessionLocal()
+        try:
+            pretrade_gate.warm(db)
+            order_tracker.load(db)
+        finally:
+            db.close()
+
+    await asyncio.get_running_loop().run_in_executor(None, warm_pretrade_gate)
+    default_cache.start()
+    order_tracker.start()
+    instrument_registry.start()
+    position_books.start()
+    risk_engine.start()
+    push_service.start_presence()
+    if settings.TICKER_ENABLED:
+        source = replay_source() if settings.PAPER_TRADING else None
+        candle_aggregator.attach(tick_service, realtime=source is None)
+        position_books.attach(tick_service)
+        order_tracker.attach(tick_service)
+        exit_monitor.attach(tick_service, order_tracker)
+        exit_monitor.start()
+        push_service.attach(tick_service)
+        push_service.start()
+        options_service.attach(tick_service)
+        options_service.start()
+        if settings.STRATEGY_SCHEDULER_ENABLED:
+            await strategy_scheduler.start(tick_service, candle_aggregator)
+        candle_aggregator.start()
+        if settings.PAPER_TRADING:
+            zerodha_service.attach(tick_service)
+        await tick_service.start(source)
+
+
+@app.on_event("shutdown")
+async def stop_tick_ingestion():
+    await strategy_scheduler.stop()
+    await tick_service.stop()
+    await candle_aggregator.stop()
+    await push_service.stop()
+    await exit_monitor.stop()
+    await options_service.stop()
+    await order_tracker.stop()
+    await risk_engine.stop()
+    await position_books.stop()
+    await instrument_registry.stop()
+    await default_cache.stop()
+    await close_redis()
+
 socket_app = socketio.ASGIApp(sio, app)
 
 setup_telegram_bot()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -9,13 +9,21 @@ class TradeType(enum.Enum):
     SELL = "SELL"
 
 class TradeStatus(enum.Enum):
-    PENDING = "PENDING"
+    PENDING = "PENDING"  # sent, not yet acknowledged by the exchange
+    OPEN = "OPEN"  # working at the exchange
+    PARTIALLY_FILLED = "PARTIALLY_FILLED"
     EXECUTED = "EXECUTED"
-    CANCELLED = "CANCELLED"
-    FAILED = "FAILED"
+    CANCELLED = "CANCELLED"  # may have filled in part; see filled_quantity
+    REJECTED = "REJECTED"  # refused by the broker or exchange
+    FAILED = "FAILED"  # never reached the broker
 
 class Trade(Base):
     __tablename__ = "trades"
+    # Keyset pagination of trade history walks these in order
+    __table_args__ = (
+        Index("ix_trades_user_entry_time", "user_id", "entry_time", "id"),
+        Index("ix_trades_portfolio_entry_time", "portfolio_id", "entry_time", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -25,7 +33,8 @@ class Trade(Base):
     symbol = Column(String, nullable=False)
     trade_type = Column(Enum(TradeType), nullable=False)
     quantity = Column(Integer, nullable=False)
-    price = Column(Float, nullable=False)
+    price = Column(Float, nullable=False)  # average fill price once filled
+    filled_quantity = Column(Integer, default=0)
     total_amount = Column(Float, nullable=False)
     status = Column(Enum(TradeStatus), default=TradeStatus.PENDING)
     
@@ -38,7 +47,8 @@ class Trade(Base):
     
     stop_loss = Column(Float, nullable=True)
     target = Column(Float, nullable=True)
-    trailing_sl = Column(Float, nullable=True)
+    trailing_sl = Column(Float, nullable=True)  # trailing distance in price points
+    exit_trade_id = Column(Integer, ForeignKey("trades.id"), nullable=True)  # the order that closed this one
     
     pnl = Column(Float, nullable=True)
     charges = Column(Float, default=0.0)
@@ -1,3 +1,5 @@
 from .token import Token, TokenPayload
 from .user import User, UserCreate, UserInDB, UserUpdate
-from .order import Order
+from .order import BasketLeg, BasketOrder, BasketOrderResult, Order, SquareOff
+from .optimization import OptimizationRequest
+from .trade import Trade, TradeCreate, TradeUpdate
@@ -0,0 +1,13 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+class OptimizationRequest(BaseModel):
+    tickers: List[str]
+    short_windows: List[int]
+    long_windows: List[int]
+    days: int = 730
+    interval: str = "1d"
+    train_bars: Optional[int] = None
+    test_bars: Optional[int] = None
+    step: Optional[int] = None
+    strategy_id: Optional[int] = None
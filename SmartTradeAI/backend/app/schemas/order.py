@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 
 class Order(BaseModel):
@@ -13,7 +13,43 @@ class Order(BaseModel):
     validity: Optional[str] = None
     disclosed_quantity: Optional[int] = None
     trigger_price: Optional[float] = None
-    squareoff: Optional[float] = None
-    stoploss: Optional[float] = None
-    trailing_stoploss: Optional[float] = None
+    # exit levels enforced by the server's exit monitor; trailing_sl is a distance in price points
+    stop_loss: Optional[float] = None
+    target: Optional[float] = None
+    trailing_sl: Optional[float] = None
     tag: Optional[str] = None
+    portfolio_id: Optional[int] = None  # defaults to the user's latest portfolio
+
+
+class BasketLeg(BaseModel):
+    tradingsymbol: str
+    transaction_type: str
+    quantity: int
+    exchange: str = "NSE"
+    product: str = "CNC"
+    order_type: str = "MARKET"
+    price: Optional[float] = None
+    trigger_price: Optional[float] = None
+    stop_loss: Optional[float] = None
+    target: Optional[float] = None
+    trailing_sl: Optional[float] = None
+    tag: Optional[str] = None
+
+
+class BasketOrder(BaseModel):
+    portfolio_id: int
+    orders: List[BasketLeg]
+
+
+class BasketOrderResult(BaseModel):
+    index: int
+    tradingsymbol: str
+    status: str
+    order_id: Optional[str] = None
+    trade_id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class SquareOff(BaseModel):
+    portfolio_id: int
+    product: Optional[str] = None
@@ -0,0 +1,59 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+from app.models.trade import TradeStatus, TradeType
+
+
+class TradeBase(BaseModel):
+    symbol: str
+    trade_type: TradeType
+    quantity: int
+    price: float
+    exchange: str
+    product: str
+    stop_loss: Optional[float] = None
+    target: Optional[float] = None
+    trailing_sl: Optional[float] = None
+    notes: Optional[str] = None
+
+
+class TradeCreate(TradeBase):
+    user_id: int
+    portfolio_id: int
+    strategy_id: Optional[int] = None
+    total_amount: float
+    status: TradeStatus = TradeStatus.PENDING
+    order_id: Optional[str] = None
+    meta_data: Optional[Dict[str, Any]] = None
+
+
+class TradeUpdate(BaseModel):
+    status: Optional[TradeStatus] = None
+    price: Optional[float] = None
+    filled_quantity: Optional[int] = None
+    execution_time: Optional[datetime] = None
+    stop_loss: Optional[float] = None
+    target: Optional[float] = None
+    trailing_sl: Optional[float] = None
+    pnl: Optional[float] = None
+    charges: Optional[float] = None
+    notes: Optional[str] = None
+
+
+class Trade(TradeBase):
+    id: int
+    portfolio_id: int
+    strategy_id: Optional[int] = None
+    total_amount: float
+    status: TradeStatus
+    filled_quantity: Optional[int] = None
+    order_id: Optional[str] = None
+    entry_time: Optional[datetime] = None
+    execution_time: Optional[datetime] = None
+    pnl: Optional[float] = None
+    charges: Optional[float] = None
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,474 @@
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.strategy import Strategy
+from app.services import charges
+from app.services.bar_store import INTERVAL_SECONDS, Bars, bar_store
+from app.services.instruments import instrument_registry
+from app.services.candles import TIMEFRAMES
+from app.services.rules import IST_OFFSET, CompiledPlan, get_plan
+from app.services.sizing import order_quantity, product_for
+
+PERIODS_PER_YEAR = 252
+SESSION_SECONDS = 22500  # 09:15-15:30 IST
+
+
+def rolling_means(
+    prices: np.ndarray, windows: Iterable[int], min_periods: Optional[int] = None
+) -> Dict[int, np.ndarray]:
+    """
+    Rolling means of a (symbols x bars) price matrix for every window,
+    computed from one cumulative sum of prices and one of valid-bar counts.
+
+    NaN bars (missing history, suspensions) are skipped rather than
+    poisoning every later window. A mean needs `window` valid bars, or
+    `min_periods` of them when given (pandas `rolling(min_periods=...)`
+    semantics); otherwise it is NaN.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.ndim == 1:
+        prices = prices[np.newaxis, :]
+    n_bars = prices.shape[1]
+    valid = np.isfinite(prices)
+
+    csum = np.zeros((prices.shape[0], n_bars + 1))
+    np.cumsum(np.where(valid, prices, 0.0), axis=1, out=csum[:, 1:])
+    ccount = np.zeros((prices.shape[0], n_bars + 1))
+    np.cumsum(valid, axis=1, out=ccount[:, 1:])
+    ends = np.arange(1, n_bars + 1)
+
+    means = {}
+    for window in sorted(set(int(w) for w in windows)):
+        if window < 1:
+            raise ValueError(f"Invalid window: {window}")
+        starts = np.maximum(ends - window, 0)
+        total = csum[:, ends] - csum[:, starts]
+        count = ccount[:, ends] - ccount[:, starts]
+        needed = window if min_periods is None else min(max(int(min_periods), 1), window)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means[window] = np.where(count >= needed, total / count, np.nan)
+    return means
+
+
+def crossover_signals(
+    prices: np.ndarray, window_pairs: Sequence[Tuple[int, int]], min_periods: Optional[int] = None
+) -> np.ndarray:
+    """
+    1 where the short SMA is above the long SMA, 0 otherwise.
+    Shape is (pairs x symbols x bars).
+    """
+    pairs = np.asarray(window_pairs, dtype=np.int64).reshape(-1, 2)
+    means = rolling_means(prices, pairs.ravel(), min_periods=min_periods)
+    windows = sorted(means)
+    stacked = np.stack([means[w] for w in windows])
+    index = {w: i for i, w in enumerate(windows)}
+    short = stacked[[index[w] for w in pairs[:, 0]]]
+    long = stacked[[index[w] for w in pairs[:, 1]]]
+    return (short > long).astype(np.int8)
+
+
+def run_sma_grid(
+    prices: np.ndarray,
+    window_pairs: Sequence[Tuple[int, int]],
+    periods_per_year: int = PERIODS_PER_YEAR,
+    chunk_size: int = 16,
+    warmup: int = 0,
+) -> Dict[str, np.ndarray]:
+    """
+    Backtest every (short, long) SMA crossover over every symbol at once.
+
+    `prices` is a (symbols x bars) close matrix; NaN bars (missing history,
+    suspensions) earn no return. The signal at a bar's close is held over the
+    next bar, so there is no lookahead. Window pairs are processed in chunks
+    of `chunk_size` to bound memory on large sweeps. The first `warmup` bars
+    only seed the moving averages and are left out of the metrics.
+
+    Returns (pairs x symbols) arrays of total_return, max_drawdown,
+    sharpe_ratio and trades.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    if prices.ndim == 1:
+        prices = prices[np.newaxis, :]
+    pairs = np.asarray(window_pairs, dtype=np.int64).reshape(-1, 2)
+    if np.any(pairs[:, 0] >= pairs[:, 1]):
+        raise ValueError("Short window must be smaller than long window")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = prices[:, 1:] / prices[:, :-1] - 1.0
+    returns = np.where(np.isfinite(returns), returns, 0.0)
+
+    shape = (len(pairs), prices.shape[0])
+    result = {
+        "total_return": np.zeros(shape),
+        "max_drawdown": np.zeros(shape),
+        "sharpe_ratio": np.zeros(shape),
+        "trades": np.zeros(shape, dtype=np.int64),
+    }
+    for start in range(0, len(pairs), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        signals = crossover_signals(prices, pairs[chunk])
+        held = signals[:, :, warmup:-1]
+        strategy_returns = held * returns[:, warmup:]
+        signals = signals[:, :, warmup:]
+
+        equity = np.cumprod(1.0 + strategy_returns, axis=2)
+        peaks = np.maximum.accumulate(equity, axis=2)
+        drawdown = 1.0 - equity / peaks
+
+        mean = strategy_returns.mean(axis=2)
+        std = strategy_returns.std(axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sharpe = np.where(std > 0, mean / std * np.sqrt(periods_per_year), 0.0)
+
+        result["total_return"][chunk] = equity[:, :, -1] - 1.0 if equity.shape[2] else 0.0
+        result["max_drawdown"][chunk] = drawdown.max(axis=2) if drawdown.shape[2] else 0.0
+        result["sharpe_ratio"][chunk] = sharpe
+        result["trades"][chunk] = (np.diff(signals, axis=2) == 1).sum(axis=2) + signals[:, :, 0]
+    return result
+
+
+def summarize_grid(
+    result: Dict[str, np.ndarray],
+    window_pairs: Sequence[Tuple[int, int]],
+    symbols: Sequence[str],
+) -> Dict:
+    """
+    JSON-friendly summary of a grid run: per-symbol best pair plus the pair
+    with the best mean Sharpe across all symbols.
+    """
+    pairs = [tuple(int(w) for w in pair) for pair in window_pairs]
+    sharpe = result["sharpe_ratio"]
+    best_pair = int(np.argmax(sharpe.mean(axis=1)))
+
+    per_symbol = {}
+    for col, symbol in enumerate(symbols):
+        row = int(np.argmax(sharpe[:, col]))
+        per_symbol[symbol] = {
+            "short_window": pairs[row][0],
+            "long_window": pairs[row][1],
+            "total_return": float(result["total_return"][row, col]),
+            "max_drawdown": float(result["max_drawdown"][row, col]),
+            "sharpe_ratio": float(sharpe[row, col]),
+            "trades": int(result["trades"][row, col]),
+        }
+
+    return {
+        "engine": "sma_grid",
+        "window_pairs": [list(pair) for pair in pairs],
+        "best_pair": list(pairs[best_pair]),
+        "best_pair_mean_sharpe": float(sharpe[best_pair].mean()),
+        "best_pair_max_drawdown": float(result["max_drawdown"][best_pair].max()),
+        "symbols": per_symbol,
+    }
+
+
+def save_backtest_results(db: Session, strategy: Strategy, summary: Dict) -> Strategy:
+    """Store a grid or event-driven summary on the strategy row"""
+    strategy.backtest_results = summary
+    if summary["engine"] == "event":
+        strategy.sharpe_ratio = summary["sharpe_ratio"]
+        strategy.max_drawdown = summary["max_drawdown"]
+    else:
+        strategy.sharpe_ratio = summary["best_pair_mean_sharpe"]
+        strategy.max_drawdown = summary["best_pair_max_drawdown"]
+    db.add(strategy)
+    db.commit()
+    db.refresh(strategy)
+    return strategy
+
+
+def window_grid(short_windows: Iterable[int], long_windows: Iterable[int]) -> List[Tuple[int, int]]:
+    """All (short, long) combinations with short < long"""
+    return [(s, l) for s in short_windows for l in long_windows if s < l]
+
+
+# Event-driven backtests. Signals come from the same compiled plan the live
+# scheduler evaluates; only the bars that produce an order become events, so
+# the Python loop runs per fill rather than per bar.
+
+_OPEN, _CLOSE = 0, 1  # fill at the bar's open, or at its close
+_EXIT, _ENTRY = 0, 1  # exits first, so their proceeds can fund entries on the same bar
+
+
+def periods_per_year(interval: str) -> float:
+    seconds = INTERVAL_SECONDS.get(interval, 86400)
+    if seconds >= 7 * 86400:
+        return 52.0
+    if seconds >= 86400:
+        return float(PERIODS_PER_YEAR)
+    return PERIODS_PER_YEAR * SESSION_SECONDS / seconds
+
+
+def _cutoff(squareoff: str) -> int:
+    hours, minutes = squareoff.split(":")
+    return int(hours) * 3600 + int(minutes) * 60
+
+
+def _events(plan: CompiledPlan, bars: Bars, product: str, cutoff: int) -> Tuple[np.ndarray, ...]:
+    """
+    (ts, phase, kind, bar, price) arrays of one symbol's orders. An order
+    signalled on a bar's close fills at the next bar's open; MIS positions
+    are squared off at the first bar at or after the cutoff (at its open),
+    or at the close of the session's last bar. Whatever is still open at the
+    end of the data is closed at the last close.
+    """
+    n = len(bars)
+    ts = np.asarray(bars.ts, dtype=np.int64)
+    opens = np.asarray(bars.open, dtype=np.float64)
+    closes = np.asarray(bars.close, dtype=np.float64)
+    entry, exit_ = plan.evaluate_batch(bars)
+    entry, exit_ = entry[:-1].copy(), exit_[:-1]
+
+    parts = [
+        (np.flatnonzero(exit_) + 1, _OPEN, _EXIT),
+    ]
+    if product == "MIS":
+        local = ts + IST_OFFSET
+        session = local // 86400
+        late = local % 86400 >= cutoff
+        same = session[1:] == session[:-1]
+        closing = late | np.append(~same, True)
+        # first closing bar of each session
+        squareoff = np.flatnonzero(closing & ~np.insert(closing[:-1] & same, 0, False))
+        entry &= same & ~closing[1:]
+        at_open = late[squareoff]
+        parts.append((squareoff[at_open], _OPEN, _EXIT))
+        parts.append((squareoff[~at_open], _CLOSE, _EXIT))
+    parts.append((np.flatnonzero(entry) + 1, _OPEN, _ENTRY))
+    parts.append((np.array([n - 1]), _CLOSE, _EXIT))
+
+    index = np.concatenate([p[0] for p in parts])
+    phase = np.concatenate([np.full(len(p[0]), p[1], dtype=np.int8) for p in parts])
+    kind = np.concatenate([np.full(len(p[0]), p[2], dtype=np.int8) for p in parts])
+    price = np.where(phase == _OPEN, opens[index], closes[index])
+    return ts[index], phase, kind, index, price
+
+
+def run_event_backtest(
+    plan: CompiledPlan,
+    bars: Dict[str, Bars],
+    capital: float,
+    risk_per_trade: float = 1.0,
+    position_size: Optional[float] = None,
+    slippage_bps: float = 0.0,
+    squareoff: str = "15:20",
+    product: Optional[str] = None,
+    max_trades: int = 500,
+) -> Dict:
+    """
+    Simulate a strategy's rules over {"EXCHANGE:SYMBOL": Bars}, long only
+    like the live scheduler, with one position per symbol.
+
+    Entries are sized like live ones (sizing.order_quantity) from equity
+    at the fill, and capped by what the cash covers. Fills pay `slippage_bps` and Zerodha's charges for the product
+    (MIS for intraday timeframes, CNC or NRML otherwise). Positions are
+    cash-funded; intraday leverage is not modelled.
+    """
+    names = [name for name, b in bars.items() if len(b) > 1]
+    if not names:
+        raise ValueError("No bars to backtest")
+    cutoff = _cutoff(squareoff)
+    slip = slippage_bps / 1e4
+
+    symbols, exchanges, products, lots = [], [], [], []
+    queues = []
+    for k, name in enumerate(names):
+        exchange, _, symbol = name.rpartition(":")
+        exchange = exchange or "NSE"
+        symbols.append(symbol)
+        exchanges.append(exchange)
+        products.append(product or product_for(exchange, bars[name].interval))
+        lots.append(max(instrument_registry.lot_size(name), 1))
+        ts, phase, kind, index, price = _events(plan, bars[name], products[k], cutoff)
+        queues.append((ts, phase, kind, np.full(len(ts), k, dtype=np.int32), index, price))
+
+    ts, phase, kind, sym, index, price = (np.concatenate(column) for column in zip(*queues))
+    order = np.lexsort((sym, kind, phase, ts))
+    ts, phase, kind, sym, index, price = (a[order] for a in (ts, phase, kind, sym, index, price))
+
+    ticks = [instrument_registry.tick_size(name) for name in names]
+    bar_ts = [np.asarray(bars[name].ts, dtype=np.int64) for name in names]
+    bar_close = [np.asarray(bars[name].close, dtype=np.float64) for name in names]
+
+    cash = float(capital)
+    held: Dict[int, Tuple[int, float, float, int]] = {}  # sym -> (qty, price, charges, ts)
+    fees = dict.fromkeys(("brokerage", "stt", "exchange", "sebi", "stamp", "gst", "total"), 0.0)
+    fills: List[Tuple[int, int, int, float]] = []  # (ts, sym, qty delta, cash delta)
+    trades: List[Tuple] = []
+    skipped = 0
+
+    def fill_price(k: int, raw: float, side: int) -> float:
+        value = raw * (1.0 + side * slip)
+        tick = ticks[k]
+        return round(round(value / tick) * tick, 2) if tick else value
+
+    for t, kd, k, px in zip(ts.tolist(), kind.tolist(), sym.tolist(), price.tolist()):
+        if kd == _ENTRY:
+            if k in held:
+                continue
+            fill = fill_price(k, px, 1)
+            equity = cash
+            if not position_size:
+                # entries fill at a bar's open, so held positions are marked at the last close before it
+                for j, (q, paid, _, _) in held.items():
+                    at = int(np.searchsorted(bar_ts[j], t, side="left")) - 1
+                    equity += q * (bar_close[j][at] if at >= 0 else paid)
+            quantity = order_quantity(fill, lots[k], position_size, risk_per_trade, equity, cash)
+            if quantity <= 0:
+                skipped += 1
+                continue
+            cost = charges.breakdown(exchanges[k], symbols[k], products[k], "BUY", quantity, fill)
+            cash -= quantity * fill + cost["total"]
+            held[k] = (quantity, fill, cost["total"], t)
+            fills.append((t, k, quantity, -(quantity * fill + cost["total"])))
+        else:
+            position = held.pop(k, None)
+            if position is None:
+                continue
+            quantity, entry_price, entry_cost, entry_ts = position
+            fill = fill_price(k, px, -1)
+            cost = charges.breakdown(exchanges[k], symbols[k], products[k], "SELL", quantity, fill)
+            cash += quantity * fill - cost["total"]
+            fills.append((t, k, -quantity, quantity * fill - cost["total"]))
+            gross = quantity * (fill - entry_price)
+            trades.append((k, entry_ts, t, quantity, entry_price, fill, gross, entry_cost + cost["total"]))
+        for component, value in cost.items():
+            fees[component] += value
+
+    return _summarize_events(
+        names, bar_ts, bar_close, capital, fills, trades, fees, skipped,
+        periods_per_year(bars[names[0]].interval), max_trades,
+    )
+
+
+def _summarize_events(names, bar_ts, bar_close, capital, fills, trades, fees, skipped, per_year, max_trades) -> Dict:
+    grid = np.unique(np.concatenate(bar_ts))
+    equity = np.full(len(grid), float(capital))
+    exposed = np.zeros(len(grid), dtype=bool)
+    if fills:
+        f_ts, f_sym, f_qty, f_cash = (np.asarray(c) for c in zip(*fills))
+        at = np.searchsorted(grid, f_ts)
+        flow = np.zeros(len(grid))
+        np.add.at(flow, at, f_cash)
+        equity += np.cumsum(flow)
+        for k in range(len(names)):
+            mine = f_sym == k
+            if not mine.any():
+                continue
+            delta = np.zeros(len(grid))
+            np.add.at(delta, at[mine], f_qty[mine])
+            position = np.cumsum(delta)
+            last = np.searchsorted(bar_ts[k], grid, side="right") - 1
+            mark = np.where(last >= 0, bar_close[k][np.maximum(last, 0)], 0.0)
+            equity += position * mark
+            exposed |= position != 0
+
+    returns = equity[1:] / equity[:-1] - 1.0 if len(equity) > 1 else np.zeros(0)
+    std = returns.std() if len(returns) else 0.0
+    drawdown = 1.0 - equity / np.maximum.accumulate(equity)
+    years = (grid[-1] - grid[0]) / (365.25 * 86400)
+    total_return = equity[-1] / capital - 1.0
+
+    net = np.array([t[6] - t[7] for t in trades])
+    wins, losses = net[net > 0], net[net <= 0]
+    per_symbol = {}
+    for k, name in enumerate(names):
+        mine = np.array([t[0] == k for t in trades], dtype=bool)
+        per_symbol[name] = {
+            "trades": int(mine.sum()),
+            "net_pnl": float(net[mine].sum()) if mine.any() else 0.0,
+            "win_rate": float((net[mine] > 0).mean()) if mine.any() else 0.0,
+        }
+
+    # evenly spaced points of the equity curve, ending on the last bar
+    points = np.unique(np.linspace(0, len(grid) - 1, min(len(grid), 500)).astype(np.int64))
+    return {
+        "engine": "event",
+        "capital": float(capital),
+        "final_equity": float(equity[-1]),
+        "total_return": float(total_return),
+        "cagr": float((1.0 + total_return) ** (1.0 / years) - 1.0) if years > 0 and total_return > -1 else None,
+        "sharpe_ratio": float(returns.mean() / std * np.sqrt(per_year)) if std > 0 else 0.0,
+        "max_drawdown": float(drawdown.max()),
+        "net_pnl": float(equity[-1] - capital),
+        "gross_pnl": float(sum(t[6] for t in trades)),
+        "charges": {component: round(value, 2) for component, value in fees.items()},
+        "total_trades": len(trades),
+        "winning_trades": int(len(wins)),
+        "losing_trades": int(len(losses)),
+        "win_rate": float(len(wins) / len(trades)) if trades else 0.0,
+        "profit_factor": float(wins.sum() / -losses.sum()) if losses.sum() < 0 else None,
+        "average_trade": float(net.mean()) if trades else 0.0,
+        "average_bars_held": float(np.mean([
+            np.searchsorted(bar_ts[t[0]], t[2]) - np.searchsorted(bar_ts[t[0]], t[1]) for t in trades
+        ])) if trades else 0.0,
+        "exposure": float(exposed.mean()),
+        "skipped_entries": skipped,
+        "bars": int(sum(len(b) for b in bar_ts)),
+        "start": int(grid[0]),
+        "end": int(grid[-1]),
+        "symbols": per_symbol,
+        "equity_curve": [[int(grid[i]), round(float(equity[i]), 2)] for i in points],
+        "trades": [
+            {
+                "symbol": names[t[0]], "entry_ts": int(t[1]), "exit_ts": int(t[2]), "quantity": int(t[3]),
+                "entry_price": float(t[4]), "exit_price": float(t[5]),
+                "gross_pnl": round(float(t[6]), 2), "charges": round(float(t[7]), 2),
+            }
+            for t in trades[-max_trades:]
+        ],
+    }
+
+
+def backtest_strategy(
+    db: Session,
+    strategy: Strategy,
+    start=None,
+    end=None,
+    capital: Optional[float] = None,
+    source: Optional[str] = None,
+) -> Strategy:
+    """
+    Backtest a strategy's own rules, symbols and timeframe on stored bars and
+    save the summary on it. Sizing follows risk_per_trade/position_size.
+
+    Timeframes the candle aggregator builds are read from its "kite" bars;
+    others (daily and up) from yfinance, topped up for the requested range.
+    """
+    plan = get_plan(strategy)
+    if not plan.symbols:
+        raise ValueError("Strategy has no symbols to backtest")
+    source = source or ("kite" if plan.timeframe in TIMEFRAMES else "yfinance")
+    bars = {}
+    for name in plan.symbols:
+        bars[name] = _strategy_bars(name, plan.timeframe, start, end, source)
+    summary = run_event_backtest(
+        plan,
+        bars,
+        capital=capital or settings.BACKTEST_CAPITAL,
+        risk_per_trade=strategy.risk_per_trade if strategy.risk_per_trade is not None else 1.0,
+        position_size=strategy.position_size,
+        slippage_bps=settings.BACKTEST_SLIPPAGE_BPS,
+        squareoff=settings.BACKTEST_SQUAREOFF,
+    )
+    summary["strategy_id"] = strategy.id
+    summary["timeframe"] = plan.timeframe
+    return save_backtest_results(db, strategy, summary)
+
+
+def _strategy_bars(name: str, timeframe: str, start, end, source: str) -> Bars:
+    if source != "yfinance":
+        return bar_store.load(name, timeframe, source=source).slice(start, end)
+    from app.services.market_data import get_stock_bars
+    from app.services.risk import yahoo_symbol
+
+    ticker = yahoo_symbol(name)
+    if ticker is None:
+        raise ValueError(f"No yfinance history for {name}")
+    end = end or datetime.utcnow()
+    start = start or datetime.utcnow() - timedelta(days=730)
+    return get_stock_bars(ticker, start, end, timeframe)
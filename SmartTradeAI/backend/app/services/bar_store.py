@@ -0,0 +1,294 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.utils.logging import logger
+
+COLUMNS = ("open", "high", "low", "close", "volume")
+INTERVAL_SECONDS = {
+    "1m": 60,
+    "3m": 180,
+    "5m": 300,
+    "15m": 900,
+    "30m": 1800,
+    "1h": 3600,
+    "1d": 86400,
+    "1wk": 7 * 86400,
+}
+
+# An empty fetch only marks its range covered once the range ended this long ago:
+# by then no bars means no trading, not an upstream hiccup
+EMPTY_SETTLE_SECONDS = 7 * 86400
+
+DateLike = Union[str, date, datetime, int, float, np.integer]
+Fetcher = Callable[[int, int], pd.DataFrame]
+
+
+def to_epoch(value: DateLike) -> int:
+    """Epoch seconds (UTC) for a date string, date, datetime or epoch value"""
+    if isinstance(value, (int, float, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = pd.Timestamp(value).to_pydatetime()
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    return int(datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp())
+
+
+def frame_to_columns(frame: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Convert a yfinance/nsepy OHLCV frame into store columns"""
+    if frame is None or frame.empty:
+        return {"ts": np.empty(0, dtype=np.int64), **{c: np.empty(0) for c in COLUMNS}}
+    index = pd.DatetimeIndex(pd.to_datetime(frame.index))
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None)
+    renamed = frame.rename(columns=lambda c: str(c).lower())
+    columns = {"ts": index.values.astype("datetime64[s]").astype(np.int64)}
+    for column in COLUMNS:
+        columns[column] = renamed[column].to_numpy(dtype=np.float64)
+    return columns
+
+
+class Bars:
+    """
+    Read-only OHLCV columns for one (symbol, interval), usually views over
+    the memory-mapped store files.
+    """
+
+    __slots__ = ("symbol", "interval", "ts", "open", "high", "low", "close", "volume")
+
+    def __init__(self, symbol: str, interval: str, columns: Dict[str, np.ndarray]):
+        self.symbol = symbol
+        self.interval = interval
+        self.ts = columns["ts"]
+        for column in COLUMNS:
+            setattr(self, column, columns[column])
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def slice(self, start: Optional[DateLike] = None, end: Optional[DateLike] = None) -> "Bars":
+        """Bars with start <= ts < end, without copying"""
+        lo = 0 if start is None else int(np.searchsorted(self.ts, to_epoch(start), side="left"))
+        hi = len(self.ts) if end is None else int(np.searchsorted(self.ts, to_epoch(end), side="left"))
+        return Bars(
+            self.symbol,
+            self.interval,
+            {"ts": self.ts[lo:hi], **{c: getattr(self, c)[lo:hi] for c in COLUMNS}},
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """Copy into a DataFrame shaped like yfinance output"""
+        index = pd.to_datetime(np.asarray(self.ts), unit="s")
+        index.name = "Date"
+        return pd.DataFrame(
+            {c.capitalize(): np.asarray(getattr(self, c)) for c in COLUMNS}, index=index
+        )
+
+
+class BarStore:
+    """
+    Append-only columnar bar store keyed by (symbol, interval).
+
+    Each series lives in `<root>/<source>/<interval>/<symbol>/` as one raw
+    little-endian file per column (`ts.i8`, `close.f8`, ...) plus a
+    `meta.json` recording the date ranges that have been fetched, so holidays
+    and empty ranges are not fetched again. Reads memory-map the column
+    files; appends take an exclusive file lock so API and Celery processes
+    can share one directory.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.BAR_STORE_DIR
+
+    def _path(self, source: str, symbol: str, interval: str) -> str:
+        return os.path.join(self.root, source, interval, symbol.replace("/", "_"))
+
+    @contextmanager
+    def _locked(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_meta(self, path: str) -> Dict:
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write_meta(self, path: str, meta: Dict) -> None:
+        tmp = os.path.join(path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+
+    def _map(self, path: str, name: str, dtype) -> np.ndarray:
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode="r")
+
+    def load(self, symbol: str, interval: str, source: str = "yfinance") -> Bars:
+        """Memory-map the full stored series"""
+        path = self._path(source, symbol, interval)
+        columns = {"ts": self._map(path, "ts.i8", "<i8")}
+        for column in COLUMNS:
+            columns[column] = self._map(path, f"{column}.f8", "<f8")
+        # ts is written last, so a concurrent append never exposes a
+        # timestamp whose values are not on disk yet
+        n = min(len(c) for c in columns.values())
+        return Bars(symbol, interval, {k: v[:n] for k, v in columns.items()})
+
+    def version(self, symbol: str, interval: str, source: str = "yfinance") -> Tuple[int, int]:
+        """(bar count, last timestamp); changes whenever the series changes"""
+        bars = self.load(symbol, interval, source)
+        return len(bars), int(bars.ts[-1]) if len(bars) else 0
+
+    def append(
+        self, symbol: str, interval: str, columns: Dict[str, np.ndarray], source: str = "yfinance"
+    ) -> int:
+        """
+        Append bars newer than the stored tail. A bar with the same timestamp
+        as the last stored bar replaces it (an in-progress bar being closed);
+        older bars are only merged in by rewriting the series.
+        """
+        ts = np.asarray(columns["ts"], dtype=np.int64)
+        if not len(ts):
+            return 0
+        order = np.argsort(ts, kind="stable")
+        ts = ts[order]
+        values = {c: np.asarray(columns[c], dtype=np.float64)[order] for c in COLUMNS}
+
+        path = self._path(source, symbol, interval)
+        with self._locked(path):
+            stored = self.load(symbol, interval, source)
+            if len(stored) and ts[0] < stored.ts[-1]:
+                return self._rewrite(path, stored, ts, values)
+
+            # drop values left behind by an append that died before its ts write
+            for name in [f"{c}.f8" for c in COLUMNS] + ["ts.i8"]:
+                file_path = os.path.join(path, name)
+                if os.path.exists(file_path) and os.path.getsize(file_path) > len(stored) * 8:
+                    os.truncate(file_path, len(stored) * 8)
+
+            start = 0
+            if len(stored) and ts[0] == stored.ts[-1]:
+                self._replace_last(path, values, len(stored) - 1)
+                start = 1
+            for column in COLUMNS:
+                with open(os.path.join(path, f"{column}.f8"), "ab") as f:
+                    f.write(values[column][start:].astype("<f8").tobytes())
+            with open(os.path.join(path, "ts.i8"), "ab") as f:
+                f.write(ts[start:].astype("<i8").tobytes())
+        return len(ts)
+
+    def _replace_last(self, path: str, values: Dict[str, np.ndarray], position: int) -> None:
+        for column in COLUMNS:
+            mapped = np.memmap(os.path.join(path, f"{column}.f8"), dtype="<f8", mode="r+")
+            mapped[position] = values[column][0]
+            mapped.flush()
+
+    def _rewrite(self, path: str, stored: Bars, ts: np.ndarray, values: Dict[str, np.ndarray]) -> int:
+        all_ts = np.concatenate([np.asarray(stored.ts), ts])
+        # later rows win for duplicate timestamps
+        order = np.argsort(all_ts, kind="stable")[::-1]
+        _, keep = np.unique(all_ts[order], return_index=True)
+        index = order[keep]
+        for column in COLUMNS:
+            merged = np.concatenate([np.asarray(getattr(stored, column)), values[column]])[index]
+            tmp = os.path.join(path, f"{column}.f8.tmp")
+            merged.astype("<f8").tofile(tmp)
+            os.replace(tmp, os.path.join(path, f"{column}.f8"))
+        tmp = os.path.join(path, "ts.i8.tmp")
+        all_ts[index].astype("<i8").tofile(tmp)
+        os.replace(tmp, os.path.join(path, "ts.i8"))
+        return len(ts)
+
+    @staticmethod
+    def _coverage(meta: Dict) -> List[List[int]]:
+        covered = meta.get("covered") or []
+        # older metadata held a single [lo, hi] pair
+        if len(covered) == 2 and not isinstance(covered[0], list):
+            return [list(covered)]
+        return [list(span) for span in covered]
+
+    def missing_ranges(
+        self, symbol: str, interval: str, start: int, end: int, source: str = "yfinance"
+    ) -> List[Tuple[int, int]]:
+        """Sub-ranges of [start, end) that have not been fetched yet, one per hole in the coverage"""
+        covered = self._coverage(self._read_meta(self._path(source, symbol, interval)))
+        ranges = []
+        cursor = start
+        for lo, hi in covered:
+            if hi <= cursor:
+                continue
+            if lo >= end:
+                break
+            if lo > cursor:
+                ranges.append((cursor, lo))
+            cursor = max(cursor, hi)
+        if cursor < end:
+            ranges.append((cursor, end))
+        return ranges
+
+    def read(
+        self,
+        symbol: str,
+        interval: str,
+        start: DateLike,
+        end: DateLike,
+        fetch: Optional[Fetcher] = None,
+        source: str = "yfinance",
+    ) -> Bars:
+        """
+        Bars in [start, end). With `fetch`, only the ranges not fetched
+        before are requested from upstream and appended first. A range that
+        came back empty is asked for again next time unless it is long past.
+        """
+        start_ts, end_ts = to_epoch(start), to_epoch(end)
+        if fetch is not None:
+            # never mark the still-forming current bar as covered
+            now = int(time.time())
+            horizon = now - INTERVAL_SECONDS.get(interval, 0)
+            for lo, hi in self.missing_ranges(symbol, interval, start_ts, end_ts, source):
+                logger.debug(f"Bar store top-up {source}:{symbol}:{interval} [{lo}, {hi})")
+                columns = frame_to_columns(fetch(lo, hi))
+                if not len(columns["ts"]) and hi > now - EMPTY_SETTLE_SECONDS:
+                    logger.debug(f"Bar store top-up {source}:{symbol}:{interval} [{lo}, {hi}) came back empty")
+                    continue
+                self.append(symbol, interval, columns, source)
+                self._extend_coverage(source, symbol, interval, lo, min(hi, horizon))
+        return self.load(symbol, interval, source).slice(start_ts, end_ts)
+
+    def _extend_coverage(self, source: str, symbol: str, interval: str, lo: int, hi: int) -> None:
+        if hi <= lo:
+            return
+        path = self._path(source, symbol, interval)
+        with self._locked(path):
+            meta = self._read_meta(path)
+            # keep coverage as sorted, disjoint intervals; only touching spans merge
+            merged = []
+            for span in sorted(self._coverage(meta) + [[lo, hi]]):
+                if merged and span[0] <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], span[1])
+                else:
+                    merged.append(span)
+            meta["covered"] = merged
+            self._write_meta(path, meta)
+
+bar_store = BarStore()
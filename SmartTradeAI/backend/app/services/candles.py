@@ -0,0 +1,210 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.bar_store import BarStore, bar_store
+from app.services.ticker import Tick, TickIngestionService
+from app.utils.logging import logger
+
+TIMEFRAMES = {"1m": 60, "3m": 180, "5m": 300, "15m": 900, "1h": 3600}
+
+# NSE opens at 09:15 IST (03:45 UTC); bars are aligned to the session open
+# so hourly candles run 09:15-10:15 like Kite's own
+SESSION_ANCHOR = 3 * 3600 + 45 * 60
+
+
+class Candle:
+    __slots__ = ("token", "timeframe", "start", "open", "high", "low", "close", "volume")
+
+    def __init__(self, token: int, timeframe: str, start: int, price: float, volume: float):
+        self.token = token
+        self.timeframe = timeframe
+        self.start = start
+        self.open = price
+        self.high = price
+        self.low = price
+        self.close = price
+        self.volume = volume
+
+    def update(self, price: float, volume: float) -> None:
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += volume
+
+    def to_dict(self) -> Dict:
+        return {
+            "token": self.token,
+            "timeframe": self.timeframe,
+            "start": self.start,
+            "open": self.open,
+            "high": self.high,
+            "low": self.low,
+            "close": self.close,
+            "volume": self.volume,
+        }
+
+
+def bucket_start(ts: float, seconds: int) -> int:
+    ts = int(ts)
+    return ts - (ts - SESSION_ANCHOR) % seconds
+
+
+CandleListener = Callable[[Candle], Awaitable[None]]
+
+
+class CandleAggregator:
+    """
+    Builds OHLCV candles for every configured timeframe directly from ticks.
+
+    Each tick touches one open candle per timeframe, so the cost per tick is
+    constant. Candles close when a tick lands in a later bucket, or on the
+    periodic sweep for instruments that stop trading. Closed candles are sent
+    to listeners straight away and written to the bar store in batches.
+
+    The sweep runs on market time: the latest tick seen, and while trading
+    live also the wall clock. A replayed session therefore closes candles as
+    the replay advances rather than all at once, and a bucket is never
+    reopened by a tick that arrives after it was closed.
+    """
+
+    def __init__(
+        self,
+        timeframes: Optional[Iterable[str]] = None,
+        store: Optional[BarStore] = None,
+        symbols: Optional[Dict[int, str]] = None,
+        realtime: bool = True,
+    ):
+        self.timeframes: List[Tuple[str, int]] = [
+            (tf, TIMEFRAMES[tf]) for tf in (timeframes or TIMEFRAMES)
+        ]
+        self.store = store or bar_store
+        self.symbols = symbols if symbols is not None else {}
+        self.realtime = realtime
+        self.clock = 0.0
+        self.open: Dict[int, Dict[str, Candle]] = {}
+        self._last_closed: Dict[Tuple[int, str], int] = {}
+        self.listeners: List[CandleListener] = []
+        self._last_volume: Dict[int, float] = {}
+        self._pending: Dict[Tuple[int, str], List[Candle]] = defaultdict(list)
+        self._closed: List[Candle] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def add_listener(self, listener: CandleListener) -> None:
+        self.listeners.append(listener)
+
+    def update(self, tick: Tick) -> None:
+        # volume_traded is cumulative for the day; a drop means a new session
+        last = self._last_volume.get(tick.token)
+        volume = tick.volume - last if last is not None and tick.volume >= last else 0.0
+        self._last_volume[tick.token] = tick.volume
+        if tick.ts > self.clock:
+            self.clock = tick.ts
+
+        candles = self.open.get(tick.token)
+        if candles is None:
+            candles = self.open[tick.token] = {}
+        for timeframe, seconds in self.timeframes:
+            start = bucket_start(tick.ts, seconds)
+            candle = candles.get(timeframe)
+            if candle is not None and candle.start == start:
+                candle.update(tick.ltp, volume)
+                continue
+            if start <= self._last_closed.get((tick.token, timeframe), -1):
+                # late tick for an already closed bucket
+                continue
+            if candle is not None:
+                if start < candle.start:
+                    continue
+                self._close(candle)
+            candles[timeframe] = Candle(tick.token, timeframe, start, tick.ltp, volume)
+
+    def now(self) -> float:
+        """Market time: the latest tick's timestamp, or the wall clock if later and trading live"""
+        return max(self.clock, time.time()) if self.realtime else self.clock
+
+    def sweep(self, now: Optional[float] = None) -> None:
+        """Close candles whose bucket has ended without a newer tick"""
+        now = self.now() if now is None else now
+        for candles in self.open.values():
+            for timeframe, seconds in self.timeframes:
+                candle = candles.get(timeframe)
+                if candle is not None and candle.start + seconds <= now:
+                    self._close(candle)
+                    del candles[timeframe]
+
+    def _close(self, candle: Candle) -> None:
+        self._last_closed[(candle.token, candle.timeframe)] = candle.start
+        self._closed.append(candle)
+        self._pending[(candle.token, candle.timeframe)].append(candle)
+
+    async def on_ticks(self, ticks: List[Tick]) -> None:
+        for tick in ticks:
+            self.update(tick)
+        await self.publish()
+
+    async def publish(self) -> None:
+        closed, self._closed = self._closed, []
+        for candle in closed:
+            for listener in self.listeners:
+                try:
+                    await listener(candle)
+                except Exception as e:
+                    logger.error(f"Candle listener failed: {str(e)}")
+
+    def flush_to_store(self) -> int:
+        """Append pending closed candles to the bar store, one write per series"""
+        pending, self._pending = self._pending, defaultdict(list)
+        return self._write(pending)
+
+    def _write(self, pending: Dict[Tuple[int, str], List[Candle]]) -> int:
+        written = 0
+        for (token, timeframe), candles in pending.items():
+            columns = {
+                "ts": np.array([c.start for c in candles], dtype=np.int64),
+                "open": np.array([c.open for c in candles]),
+                "high": np.array([c.high for c in candles]),
+                "low": np.array([c.low for c in candles]),
+                "close": np.array([c.close for c in candles]),
+                "volume": np.array([c.volume for c in candles]),
+            }
+            symbol = self.symbols.get(token, str(token))
+            try:
+                written += self.store.append(symbol, timeframe, columns, source="kite")
+            except Exception as e:
+                logger.error(f"Error storing {timeframe} candles for {symbol}: {str(e)}")
+        return written
+
+    def attach(self, ticks: TickIngestionService, realtime: bool = True) -> None:
+        """Consume `ticks`; pass realtime=False when they are replayed rather than live"""
+        self.symbols = ticks.symbols
+        self.realtime = realtime
+        ticks.add_consumer("candles", self.on_ticks, lossless=True)
+
+    async def run(self, interval: float = 1.0) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+            await self.publish()
+            # swap on the loop, write off it
+            pending, self._pending = self._pending, defaultdict(list)
+            await asyncio.get_running_loop().run_in_executor(None, self._write, pending)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush_to_store()
+
+
+candle_aggregator = CandleAggregator()
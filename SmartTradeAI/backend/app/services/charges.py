@@ -0,0 +1,68 @@
+from typing import Dict
+
+# Zerodha's published rates. Percentages are fractions of turnover
+# (quantity * price; premium for options); STT and stamp duty apply to one
+# side only where noted.
+RATES = {
+    "delivery": {
+        "brokerage": 0.0, "brokerage_cap": 0.0,
+        "stt_buy": 0.001, "stt_sell": 0.001,
+        "exchange": 0.0000297, "stamp": 0.00015,
+    },
+    "intraday": {
+        "brokerage": 0.0003, "brokerage_cap": 20.0,
+        "stt_buy": 0.0, "stt_sell": 0.00025,
+        "exchange": 0.0000297, "stamp": 0.00003,
+    },
+    "futures": {
+        "brokerage": 0.0003, "brokerage_cap": 20.0,
+        "stt_buy": 0.0, "stt_sell": 0.0002,
+        "exchange": 0.0000173, "stamp": 0.00002,
+    },
+    "options": {
+        "brokerage": None, "brokerage_cap": 20.0,
+        "stt_buy": 0.0, "stt_sell": 0.001,
+        "exchange": 0.0003503, "stamp": 0.00003,
+    },
+}
+SEBI_RATE = 10 / 1e7  # Rs 10 per crore
+GST_RATE = 0.18
+DERIVATIVE_EXCHANGES = ("NFO", "BFO", "CDS", "MCX")
+
+
+def segment(exchange: str, symbol: str, product: str) -> str:
+    """Which rate card applies to an order"""
+    if exchange in DERIVATIVE_EXCHANGES:
+        return "options" if symbol.endswith(("CE", "PE")) else "futures"
+    return "intraday" if product == "MIS" else "delivery"
+
+
+def breakdown(exchange: str, symbol: str, product: str, side: str, quantity: float, price: float) -> Dict[str, float]:
+    """Charges for one executed order, by component, in rupees"""
+    rates = RATES[segment(exchange, symbol, product)]
+    turnover = abs(quantity) * price
+    if rates["brokerage"] is None:
+        brokerage = rates["brokerage_cap"] if turnover else 0.0
+    else:
+        brokerage = turnover * rates["brokerage"]
+        if rates["brokerage_cap"]:
+            brokerage = min(brokerage, rates["brokerage_cap"])
+    buy = side == "BUY"
+    stt = turnover * (rates["stt_buy"] if buy else rates["stt_sell"])
+    exchange_charges = turnover * rates["exchange"]
+    sebi = turnover * SEBI_RATE
+    stamp = turnover * rates["stamp"] if buy else 0.0
+    gst = (brokerage + exchange_charges + sebi) * GST_RATE
+    return {
+        "brokerage": round(brokerage, 2),
+        "stt": round(stt, 2),
+        "exchange": round(exchange_charges, 2),
+        "sebi": round(sebi, 2),
+        "stamp": round(stamp, 2),
+        "gst": round(gst, 2),
+        "total": round(brokerage + stt + exchange_charges + sebi + stamp + gst, 2),
+    }
+
+
+def order_charges(exchange: str, symbol: str, product: str, side: str, quantity: float, price: float) -> float:
+    return breakdown(exchange, symbol, product, side, quantity, price)["total"]
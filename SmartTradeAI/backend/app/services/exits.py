@@ -0,0 +1,546 @@
+import asyncio
+import heapq
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from app.core import redis_pool
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, SessionLocal
+from app.models.trade import Trade, TradeStatus, TradeType
+from app.services.orders import Fill, OrderTracker
+from app.services.pretrade import RiskRejected
+from app.services.ticker import Tick, TickIngestionService
+from app.services.trading import trading_service
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+LEADER_KEY = "exits:leader"
+
+# Extend or release the lease only while this process still holds it
+_RENEW = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class _Trail:
+    """
+    Trailing exits on one side of one instrument that share the best price
+    seen since they were armed. A member with trailing distance d fires
+    once price is d away from `peak`, so members sit in a min-heap by d.
+    """
+
+    __slots__ = ("peak", "members", "seq")
+
+    def __init__(self, peak: float, seq: int):
+        self.peak = peak
+        self.members: List = []
+        self.seq = seq
+
+
+class _Exit:
+    """The exit levels of one filled entry"""
+
+    __slots__ = ("trade_id", "user_id", "portfolio_id", "name", "long", "quantity", "stop", "target", "trail", "group", "written")
+
+    def __init__(
+        self, trade_id: int, user_id: int, portfolio_id: int, name: str, long: bool, quantity: int,
+        stop: Optional[float], target: Optional[float], trail: Optional[float],
+    ):
+        self.trade_id = trade_id
+        self.user_id = user_id
+        self.portfolio_id = portfolio_id
+        self.name = name
+        self.long = long
+        self.quantity = quantity
+        self.stop = stop
+        self.target = target
+        self.trail = trail or None
+        self.group: Optional[_Trail] = None
+        self.written = stop
+
+    def current_stop(self) -> Optional[float]:
+        """The fixed stop, or the trailing one once it has moved past it"""
+        if self.group is None:
+            return self.stop
+        trailed = self.group.peak - self.trail if self.long else self.group.peak + self.trail
+        if self.stop is None:
+            return trailed
+        return max(self.stop, trailed) if self.long else min(self.stop, trailed)
+
+
+class _Levels:
+    """
+    Trigger heaps for one instrument. Long stops fire on the way down, so
+    they sit in a max-heap, long targets in a min-heap, and shorts mirror
+    them; fixed levels never move, so their entries are (level, trade_id).
+
+    Trailing exits live in _Trail groups. A new best price moves every
+    group it passes at once by merging them, smaller into larger, so
+    ratcheting never visits individual trades. Groups sit in a heap by
+    peak (for ratcheting) and in one by the level of their nearest member
+    (for firing), versioned by `seq` so superseded entries are skipped.
+    """
+
+    __slots__ = (
+        "long_stops", "long_targets", "short_stops", "short_targets",
+        "long_peaks", "short_peaks", "long_trails", "short_trails",
+    )
+
+    def __init__(self):
+        self.long_stops: List = []
+        self.long_targets: List = []
+        self.short_stops: List = []
+        self.short_targets: List = []
+        self.long_peaks: List = []
+        self.short_peaks: List = []
+        self.long_trails: List = []
+        self.short_trails: List = []
+
+    def heaps(self) -> List[List]:
+        return [
+            self.long_stops, self.long_targets, self.short_stops, self.short_targets,
+            self.long_peaks, self.short_peaks, self.long_trails, self.short_trails,
+        ]
+
+    def __len__(self) -> int:
+        return sum(len(h) for h in self.heaps())
+
+
+class ExitMonitor:
+    """
+    Enforces Trade.stop_loss, target and trailing_sl on the server.
+
+    Entries are armed as they fill (from order tracker fills) or on startup
+    for trades still open. Every instrument keeps its trigger levels in
+    heaps, so a tick costs O(log n) plus the exits it fires, however many
+    trades are open. Fired exits go out as market orders through
+    TradingService.close_position, which links the exit trade to its entry;
+    ratcheted stops are written back in batches every `persist_interval`.
+
+    Only one process watches exits: the holder of a Redis lease. It arms
+    from the database when it takes over and from fills booked by any
+    worker afterwards; the others keep the fills of the last few seconds,
+    which their rows may not have reached yet, for when they take over.
+    """
+
+    def __init__(
+        self,
+        persist_interval: Optional[float] = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+        async_session_factory=AsyncSessionLocal,
+    ):
+        self.persist_interval = persist_interval or settings.EXIT_PERSIST_INTERVAL
+        self.retries = settings.EXIT_RETRIES
+        self.retry_backoff = settings.EXIT_RETRY_BACKOFF
+        self.lease = settings.EXIT_LEADER_TTL
+        self.token = uuid.uuid4().hex
+        self.leader = False
+        self.session_factory = session_factory
+        self.async_session_factory = async_session_factory
+        self.exits: Dict[int, _Exit] = {}
+        self.levels: Dict[str, _Levels] = {}
+        self.symbols: Dict[int, str] = {}
+        self.ticks: Optional[TickIngestionService] = None
+        self.fired: Set[int] = set()
+        self.triggered = 0
+        self.ratchets = 0
+        self.failed = 0
+        self.latency = histogram("exits.tick")
+        self._seq = 0
+        self._pending: Set[asyncio.Task] = set()
+        self._recent: Deque[Tuple[float, Fill]] = deque()
+        self._lease_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._lead_task: Optional[asyncio.Task] = None
+
+    # Arming
+
+    def arm(self, exit: _Exit, price: float) -> None:
+        """Watch an exit; `price` is where its trailing stop starts from"""
+        if exit.stop is None and exit.target is None and not exit.trail:
+            return
+        self.exits[exit.trade_id] = exit
+        levels = self.levels.get(exit.name)
+        if levels is None:
+            levels = self.levels[exit.name] = _Levels()
+            if self.ticks is not None and self.ticks.running:
+                self.ticks.subscribe_symbols([exit.name])
+        if exit.long:
+            if exit.stop is not None:
+                heapq.heappush(levels.long_stops, (-exit.stop, exit.trade_id))
+            if exit.target is not None:
+                heapq.heappush(levels.long_targets, (exit.target, exit.trade_id))
+        else:
+            if exit.stop is not None:
+                heapq.heappush(levels.short_stops, (exit.stop, exit.trade_id))
+            if exit.target is not None:
+                heapq.heappush(levels.short_targets, (-exit.target, exit.trade_id))
+        if exit.trail:
+            group = exit.group = self._group(price)
+            group.members.append((exit.trail, exit.trade_id))
+            self._push_group(levels, group, exit.long)
+
+    def _group(self, peak: float) -> _Trail:
+        self._seq += 1
+        return _Trail(peak, self._seq)
+
+    def _push_group(self, levels: _Levels, group: _Trail, long: bool) -> None:
+        """(Re)index a group after its peak or nearest member changed"""
+        self._seq += 1
+        group.seq = self._seq
+        if not group.members:
+            return
+        distance = group.members[0][0]
+        if long:
+            heapq.heappush(levels.long_peaks, (group.peak, group.seq, group))
+            heapq.heappush(levels.long_trails, (-(group.peak - distance), group.seq, group))
+        else:
+            heapq.heappush(levels.short_peaks, (-group.peak, group.seq, group))
+            heapq.heappush(levels.short_trails, (group.peak + distance, group.seq, group))
+
+    def disarm(self, trade_id: int) -> Optional[_Exit]:
+        """Stop watching an entry that has been closed another way; later fills do not re-arm it"""
+        # heap entries of a disarmed exit are dropped as they surface
+        self.fired.add(trade_id)
+        return self.exits.pop(trade_id, None)
+
+    async def on_fill(self, fill: Fill) -> None:
+        """Arm an entry as it fills; later fills of the same entry add to its quantity"""
+        if not self.leader:
+            now = time.monotonic()
+            self._recent.append((now, fill))
+            # long enough for the fill's row to be written, after which load() sees it
+            horizon = now - 2 * max(self.lease, settings.ORDER_FLUSH_INTERVAL)
+            while self._recent and self._recent[0][0] < horizon:
+                self._recent.popleft()
+            return
+        if fill.trade_id is None:
+            # its row was never saved, so there is nothing to close it by
+            return
+        exit = self.exits.get(fill.trade_id)
+        if exit is not None:
+            exit.quantity += abs(fill.quantity)
+            return
+        if fill.trade_id in self.fired:
+            return
+        self.arm(_Exit(
+            fill.trade_id, fill.user_id, fill.portfolio_id, fill.name, fill.quantity > 0, abs(fill.quantity),
+            fill.stop_loss, fill.target, fill.trailing_sl,
+        ), fill.price)
+
+    def load(self, db: Session) -> int:
+        """Arm the filled, still open trades that have exit levels (run on taking the lease)"""
+        trades = db.query(Trade).filter(
+            Trade.exit_trade_id.is_(None),
+            or_(Trade.status == TradeStatus.EXECUTED, Trade.filled_quantity > 0),
+            or_(Trade.stop_loss.isnot(None), Trade.target.isnot(None), Trade.trailing_sl.isnot(None)),
+        )
+        for trade in trades:
+            long = trade.trade_type == TradeType.BUY
+            peak = trade.price
+            if trade.trailing_sl and trade.stop_loss is not None:
+                # a ratcheted stop was written back; resume trailing from the peak it implies
+                implied = trade.stop_loss + trade.trailing_sl if long else trade.stop_loss - trade.trailing_sl
+                peak = max(peak, implied) if long else min(peak, implied)
+            self.arm(_Exit(
+                trade.id, trade.user_id, trade.portfolio_id, f"{trade.exchange}:{trade.symbol}", long,
+                trade.filled_quantity or trade.quantity, trade.stop_loss, trade.target, trade.trailing_sl,
+            ), peak)
+        logger.info(f"Exit monitor armed {len(self.exits)} trades")
+        return len(self.exits)
+
+    # Ticks
+
+    def _take(self, trade_id: int, fired: List[_Exit]) -> None:
+        exit = self.exits.pop(trade_id, None)
+        if exit is not None:
+            self.fired.add(trade_id)
+            fired.append(exit)
+
+    def _ratchet(self, levels: _Levels, price: float, long: bool) -> None:
+        peaks = levels.long_peaks if long else levels.short_peaks
+        passed = []
+        while peaks and (peaks[0][0] < price if long else -peaks[0][0] > price):
+            _, seq, group = heapq.heappop(peaks)
+            if seq == group.seq and group.members:
+                passed.append(group)
+        if not passed:
+            return
+        # every group the price passed now shares it as peak
+        passed.sort(key=lambda g: len(g.members))
+        merged = passed.pop()
+        for group in passed:
+            for member in group.members:
+                heapq.heappush(merged.members, member)
+                exit = self.exits.get(member[1])
+                if exit is not None and exit.group is group:
+                    exit.group = merged
+            group.members = []
+        merged.peak = price
+        self.ratchets += 1
+        self._push_group(levels, merged, long)
+
+    def _fire_trails(self, levels: _Levels, price: float, long: bool, fired: List[_Exit]) -> None:
+        trails = levels.long_trails if long else levels.short_trails
+        while trails and (-trails[0][0] >= price if long else trails[0][0] <= price):
+            _, seq, group = heapq.heappop(trails)
+            if seq != group.seq:
+                continue
+            reach = group.peak - price if long else price - group.peak
+            members = group.members
+            while members:
+                distance, trade_id = members[0]
+                exit = self.exits.get(trade_id)
+                if exit is not None and exit.group is group and distance > reach:
+                    break
+                heapq.heappop(members)
+                if exit is not None and exit.group is group:
+                    self._take(trade_id, fired)
+            self._push_group(levels, group, long)
+
+    def check(self, name: str, price: float) -> List[_Exit]:
+        """Ratchet trailing stops for a new price and pop the exits it triggers"""
+        levels = self.levels.get(name)
+        if levels is None:
+            return []
+        self._ratchet(levels, price, True)
+        self._ratchet(levels, price, False)
+        fired: List[_Exit] = []
+        for heap, hit in (
+            (levels.long_stops, lambda key: -key >= price),
+            (levels.long_targets, lambda key: key <= price),
+            (levels.short_stops, lambda key: key <= price),
+            (levels.short_targets, lambda key: -key >= price),
+        ):
+            while heap and hit(heap[0][0]):
+                self._take(heapq.heappop(heap)[1], fired)
+        self._fire_trails(levels, price, True, fired)
+        self._fire_trails(levels, price, False, fired)
+        return fired
+
+    async def on_ticks(self, ticks: List[Tick]) -> None:
+        if not self.leader:
+            return
+        started = time.perf_counter()
+        fired = []
+        for tick in ticks:
+            name = self.symbols.get(tick.token)
+            if name is not None and name in self.levels:
+                fired.extend(self.check(name, tick.ltp))
+        self.latency.record(time.perf_counter() - started)
+        if fired:
+            self.triggered += len(fired)
+            task = asyncio.create_task(self.submit(fired))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _close(self, exit: _Exit) -> None:
+        """
+        Place one exit, retrying with backoff. Exits only shrink exposure, so
+        they skip the order-rate throttle. An exit that still cannot be placed
+        is re-armed, so the next tick at its level fires it again.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.async_session_factory() as db:
+                    await trading_service.close_position(
+                        db, exit.user_id, exit.portfolio_id, exit.trade_id, quantity=exit.quantity, throttle=False
+                    )
+                return
+            except RiskRejected as e:
+                error = e
+            except ValueError as e:
+                # unknown or already closed: there is nothing left to protect
+                logger.warning(f"Exit for trade {exit.trade_id} on {exit.name} dropped: {str(e)}")
+                return
+            except Exception as e:
+                error = e
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+        self.failed += 1
+        logger.error(f"Exit for trade {exit.trade_id} on {exit.name} was not placed, re-armed: {str(error)}")
+        self.rearm(exit)
+
+    def rearm(self, exit: _Exit) -> None:
+        """Watch a fired exit again, keeping the peak its trailing stop had reached"""
+        if not self.leader or exit.trade_id in self.exits:
+            return
+        self.fired.discard(exit.trade_id)
+        peak = exit.group.peak if exit.group is not None else 0.0
+        exit.group = None
+        self.arm(exit, peak)
+
+    async def submit(self, exits: List[_Exit]) -> None:
+        """Send the fired exits concurrently through the order path"""
+        await asyncio.gather(*(self._close(exit) for exit in exits))
+
+    # Upkeep
+
+    def _write(self, rows: List[Dict]) -> None:
+        db = self.session_factory()
+        try:
+            db.bulk_update_mappings(Trade, rows)
+            db.commit()
+        finally:
+            db.close()
+
+    async def persist(self) -> None:
+        """Write trailing stops that moved since they were last written"""
+        rows = []
+        for exit in self.exits.values():
+            stop = exit.current_stop()
+            if exit.group is not None and stop is not None and stop != exit.written:
+                exit.written = stop
+                rows.append({"id": exit.trade_id, "stop_loss": round(stop, 2)})
+        if rows:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+
+    def compact(self) -> None:
+        """Rebuild heaps that are mostly stale entries"""
+        for name, levels in list(self.levels.items()):
+            live = [e for e in self.exits.values() if e.name == name]
+            if not live:
+                del self.levels[name]
+                continue
+            if len(levels) <= 4 * len(live) + 32:
+                continue
+            for heap in (levels.long_stops, levels.long_targets, levels.short_stops, levels.short_targets):
+                heap[:] = [entry for entry in heap if entry[1] in self.exits]
+                heapq.heapify(heap)
+            for heap in (levels.long_peaks, levels.short_peaks, levels.long_trails, levels.short_trails):
+                heap[:] = [entry for entry in heap if entry[1] == entry[2].seq and entry[2].members]
+                heapq.heapify(heap)
+
+    # Leadership
+
+    def _reset(self) -> None:
+        self.exits.clear()
+        self.levels.clear()
+        self.fired.clear()
+
+    def _load(self) -> int:
+        db = self.session_factory()
+        try:
+            return self.load(db)
+        finally:
+            db.close()
+
+    async def _lead(self) -> None:
+        """Take over: arm what the database holds, then the recent fills it may not have yet"""
+        self._reset()
+        await asyncio.get_running_loop().run_in_executor(None, self._load)
+        recent, self._recent = list(self._recent), deque()
+        loaded = set(self.exits)
+        self.leader = True
+        for _, fill in recent:
+            if fill.trade_id not in loaded:
+                await self.on_fill(fill)
+        if self.ticks is not None and self.ticks.running:
+            self.ticks.subscribe_symbols(list(self.levels))
+        logger.info(f"Exit monitor took the lease with {len(self.exits)} trades armed")
+
+    async def _follow(self) -> None:
+        """Hand over: write back moved stops and stop watching"""
+        self.leader = False
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        try:
+            await self.persist()
+        finally:
+            self._reset()
+        logger.warning("Exit monitor lost the lease")
+
+    async def elect(self) -> None:
+        """Take or renew the lease; a process that cannot renew in time stops watching"""
+        redis = await redis_pool.get_redis()
+        if self.leader:
+            if not await redis.eval(_RENEW, 1, LEADER_KEY, self.token, self.lease):
+                await self._follow()
+                return
+        elif await redis.set(LEADER_KEY, self.token, nx=True, ex=self.lease):
+            try:
+                await self._lead()
+            except Exception:
+                await redis.eval(_RELEASE, 1, LEADER_KEY, self.token)
+                self.leader = False
+                raise
+        else:
+            return
+        self._lease_until = time.monotonic() + self.lease
+
+    async def _lead_loop(self) -> None:
+        while True:
+            try:
+                await self.elect()
+            except Exception as e:
+                logger.warning(f"Exit monitor lease check failed: {str(e)}")
+                if self.leader and time.monotonic() >= self._lease_until:
+                    await self._follow()
+            await asyncio.sleep(self.lease / 3)
+
+    async def _persist_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            if not self.leader:
+                continue
+            try:
+                await self.persist()
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error persisting trailing stops: {str(e)}")
+
+    def attach(self, ticks: TickIngestionService, orders: OrderTracker) -> None:
+        self.ticks = ticks
+        self.symbols = ticks.symbols
+        ticks.subscribe_symbols(list(self.levels))
+        # a dropped batch could skip the tick that crosses a stop
+        ticks.add_consumer("exits", self.on_ticks, lossless=True)
+        orders.add_listener(self.on_fill)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._persist_loop())
+            self._lead_task = asyncio.create_task(self._lead_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            for task in (self._task, self._lead_task):
+                task.cancel()
+            await asyncio.gather(self._task, self._lead_task, return_exceptions=True)
+            self._task = self._lead_task = None
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        if self.leader:
+            await self.persist()
+            self.leader = False
+            try:
+                redis = await redis_pool.get_redis()
+                await redis.eval(_RELEASE, 1, LEADER_KEY, self.token)
+            except Exception as e:
+                logger.warning(f"Could not release the exit monitor lease: {str(e)}")
+
+    def stats(self) -> Dict:
+        return {
+            "leader": self.leader,
+            "armed": len(self.exits),
+            "instruments": len(self.levels),
+            "triggered": self.triggered,
+            "ratchets": self.ratchets,
+            "failed": self.failed,
+            "tick": self.latency.snapshot(),
+        }
+
+
+exit_monitor = ExitMonitor()
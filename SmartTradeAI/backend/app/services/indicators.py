@@ -0,0 +1,329 @@
+"""
+Incremental technical indicators.
+
+Every indicator keeps just enough state to absorb one new bar in constant
+time and exposes its current reading as `value` (None until warmed up).
+Each has a batch counterpart for warm-up and backtests that returns NaN
+where the incremental value would be None and is bit-identical to feeding
+the same bars one at a time:
+
+* SMA, Bollinger and VWAP are windowed sums, so both paths difference a
+  sequential running total (np.cumsum is sequential, not pairwise).
+* EMA, RSI, ATR and MACD are recursive, so their batch path runs the same
+  recurrence over plain floats.
+"""
+import math
+from array import array
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class SMA:
+    __slots__ = ("period", "value", "_total", "_totals", "_i", "_count")
+
+    def __init__(self, period: int):
+        if period < 1:
+            raise ValueError(f"Invalid period: {period}")
+        self.period = period
+        self.value: Optional[float] = None
+        self._total = 0.0
+        # running totals of the last `period` bars; the oldest is subtracted
+        self._totals = array("d", bytes(8 * period))
+        self._i = 0
+        self._count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, x: float) -> Optional[float]:
+        self._total += x
+        oldest = self._totals[self._i]
+        self._totals[self._i] = self._total
+        self._i = (self._i + 1) % self.period
+        self._count += 1
+        if self._count >= self.period:
+            self.value = (self._total - oldest) / self.period
+        return self.value
+
+
+class EMA:
+    """Exponential moving average seeded with the SMA of the first `period` bars"""
+
+    __slots__ = ("period", "alpha", "value", "_seed", "_count")
+
+    def __init__(self, period: int, alpha: Optional[float] = None):
+        if period < 1:
+            raise ValueError(f"Invalid period: {period}")
+        self.period = period
+        self.alpha = alpha if alpha is not None else 2.0 / (period + 1)
+        self.value: Optional[float] = None
+        self._seed = 0.0
+        self._count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, x: float) -> Optional[float]:
+        if self.value is not None:
+            self.value = self.value + self.alpha * (x - self.value)
+            return self.value
+        self._seed += x
+        self._count += 1
+        if self._count == self.period:
+            self.value = self._seed / self.period
+        return self.value
+
+
+class RSI:
+    """Wilder's relative strength index"""
+
+    __slots__ = ("period", "value", "_prev", "_gain", "_loss", "_count")
+
+    def __init__(self, period: int = 14):
+        if period < 1:
+            raise ValueError(f"Invalid period: {period}")
+        self.period = period
+        self.value: Optional[float] = None
+        self._prev: Optional[float] = None
+        self._gain = 0.0
+        self._loss = 0.0
+        self._count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, close: float) -> Optional[float]:
+        prev, self._prev = self._prev, close
+        if prev is None:
+            return None
+        change = close - prev
+        gain = change if change > 0 else 0.0
+        loss = -change if change < 0 else 0.0
+        n = self.period
+        if self._count < n:
+            self._gain += gain
+            self._loss += loss
+            self._count += 1
+            if self._count < n:
+                return None
+            self._gain /= n
+            self._loss /= n
+        else:
+            self._gain = (self._gain * (n - 1) + gain) / n
+            self._loss = (self._loss * (n - 1) + loss) / n
+        if self._loss == 0.0:
+            self.value = 100.0
+        else:
+            self.value = 100.0 - 100.0 / (1.0 + self._gain / self._loss)
+        return self.value
+
+
+class ATR:
+    """Wilder's average true range"""
+
+    __slots__ = ("period", "value", "_prev_close", "_seed", "_count")
+
+    def __init__(self, period: int = 14):
+        if period < 1:
+            raise ValueError(f"Invalid period: {period}")
+        self.period = period
+        self.value: Optional[float] = None
+        self._prev_close: Optional[float] = None
+        self._seed = 0.0
+        self._count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, high: float, low: float, close: float) -> Optional[float]:
+        true_range = high - low
+        if self._prev_close is not None:
+            true_range = max(true_range, abs(high - self._prev_close), abs(low - self._prev_close))
+        self._prev_close = close
+        n = self.period
+        if self.value is not None:
+            self.value = (self.value * (n - 1) + true_range) / n
+            return self.value
+        self._seed += true_range
+        self._count += 1
+        if self._count == n:
+            self.value = self._seed / n
+        return self.value
+
+
+class VWAP:
+    """Volume-weighted average price; call reset() at each session open"""
+
+    __slots__ = ("value", "_pv", "_volume")
+
+    def __init__(self):
+        self.value: Optional[float] = None
+        self._pv = 0.0
+        self._volume = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def reset(self) -> None:
+        self.value = None
+        self._pv = 0.0
+        self._volume = 0.0
+
+    def update(self, price: float, volume: float) -> Optional[float]:
+        self._pv += price * volume
+        self._volume += volume
+        if self._volume > 0:
+            self.value = self._pv / self._volume
+        return self.value
+
+
+class Bollinger:
+    """Bollinger bands: `value` is the middle band, plus `upper` and `lower`"""
+
+    __slots__ = ("period", "k", "value", "upper", "lower", "_sum", "_sumsq", "_sums", "_sumsqs", "_i", "_count")
+
+    def __init__(self, period: int = 20, k: float = 2.0):
+        if period < 1:
+            raise ValueError(f"Invalid period: {period}")
+        self.period = period
+        self.k = k
+        self.value: Optional[float] = None
+        self.upper: Optional[float] = None
+        self.lower: Optional[float] = None
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._sums = array("d", bytes(8 * period))
+        self._sumsqs = array("d", bytes(8 * period))
+        self._i = 0
+        self._count = 0
+
+    @property
+    def ready(self) -> bool:
+        return self.value is not None
+
+    def update(self, x: float) -> Optional[float]:
+        self._sum += x
+        self._sumsq += x * x
+        i = self._i
+        oldest, oldest_sq = self._sums[i], self._sumsqs[i]
+        self._sums[i], self._sumsqs[i] = self._sum, self._sumsq
+        self._i = (i + 1) % self.period
+        self._count += 1
+        if self._count >= self.period:
+            n = self.period
+            mean = (self._sum - oldest) / n
+            variance = (self._sumsq - oldest_sq) / n - mean * mean
+            width = self.k * math.sqrt(variance if variance > 0.0 else 0.0)
+            self.value = mean
+            self.upper = mean + width
+            self.lower = mean - width
+        return self.value
+
+
+class MACD:
+    """MACD line as `value`, plus `signal` and `hist`"""
+
+    __slots__ = ("value", "signal", "hist", "_fast", "_slow", "_signal")
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        if fast >= slow:
+            raise ValueError("Fast period must be smaller than slow period")
+        self.value: Optional[float] = None
+        self.signal: Optional[float] = None
+        self.hist: Optional[float] = None
+        self._fast = EMA(fast)
+        self._slow = EMA(slow)
+        self._signal = EMA(signal)
+
+    @property
+    def ready(self) -> bool:
+        return self.signal is not None
+
+    def update(self, close: float) -> Optional[float]:
+        fast = self._fast.update(close)
+        slow = self._slow.update(close)
+        if slow is None:
+            return None
+        self.value = fast - slow
+        self.signal = self._signal.update(self.value)
+        if self.signal is not None:
+            self.hist = self.value - self.signal
+        return self.value
+
+
+def _windowed(totals: np.ndarray, period: int, n: int) -> np.ndarray:
+    out = np.full(n, np.nan)
+    if period <= n:
+        out[period - 1:] = totals[period:] - totals[:-period]
+    return out
+
+
+def _running(x: np.ndarray) -> np.ndarray:
+    totals = np.zeros(len(x) + 1)
+    np.cumsum(x, out=totals[1:])
+    return totals
+
+
+def sma(x: Sequence[float], period: int) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float64)
+    return _windowed(_running(x), period, len(x)) / period
+
+
+def bollinger(x: Sequence[float], period: int = 20, k: float = 2.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(middle, upper, lower)"""
+    x = np.asarray(x, dtype=np.float64)
+    mean = _windowed(_running(x), period, len(x)) / period
+    variance = _windowed(_running(x * x), period, len(x)) / period - mean * mean
+    width = k * np.sqrt(np.maximum(variance, 0.0))
+    return mean, mean + width, mean - width
+
+
+def vwap(price: Sequence[float], volume: Sequence[float]) -> np.ndarray:
+    """Single-session VWAP; split the arrays at session boundaries"""
+    price = np.asarray(price, dtype=np.float64)
+    volume = np.asarray(volume, dtype=np.float64)
+    pv = np.cumsum(price * volume)
+    total = np.cumsum(volume)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = pv / total
+    # before any volume there is no VWAP; after it, a zero-volume bar keeps the last value
+    out[total <= 0] = np.nan
+    return out
+
+
+def _replay(indicator, *columns: Sequence[float], outputs: Sequence[str] = ("value",)):
+    n = len(columns[0])
+    results = [np.full(n, np.nan) for _ in outputs]
+    rows = zip(*(np.asarray(c, dtype=np.float64).tolist() for c in columns))
+    for i, row in enumerate(rows):
+        indicator.update(*row)
+        for out, name in zip(results, outputs):
+            v = getattr(indicator, name)
+            if v is not None:
+                out[i] = v
+    return results[0] if len(results) == 1 else tuple(results)
+
+
+def ema(x: Sequence[float], period: int) -> np.ndarray:
+    return _replay(EMA(period), x)
+
+
+def rsi(close: Sequence[float], period: int = 14) -> np.ndarray:
+    return _replay(RSI(period), close)
+
+
+def atr(high: Sequence[float], low: Sequence[float], close: Sequence[float], period: int = 14) -> np.ndarray:
+    return _replay(ATR(period), high, low, close)
+
+
+def macd(
+    close: Sequence[float], fast: int = 12, slow: int = 26, signal: int = 9
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(macd, signal, hist)"""
+    return _replay(MACD(fast, slow, signal), close, outputs=("value", "signal", "hist"))
@@ -0,0 +1,365 @@
+import asyncio
+import fcntl
+import io
+import os
+import shutil
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.utils.logging import logger
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# Fixed-width byte columns (tradingsymbols are ASCII) and numeric columns
+STRING_COLUMNS = ("tradingsymbol", "name", "exchange", "segment", "instrument_type")
+NUMERIC_COLUMNS = {
+    "instrument_token": "<i8",
+    "exchange_token": "<i8",
+    "expiry": "<i4",  # days since 1970-01-01, 0 when there is none
+    "strike": "<f8",
+    "tick_size": "<f8",
+    "lot_size": "<i4",
+}
+OPTION_TYPES = (b"CE", b"PE")
+
+# Exchanges tried, in order, when a bare tradingsymbol is given
+DEFAULT_EXCHANGES = ("NSE", "BSE", "NFO", "BFO", "MCX", "CDS")
+
+EPOCH = date(1970, 1, 1)
+
+
+class Instrument(NamedTuple):
+    instrument_token: int
+    exchange_token: int
+    tradingsymbol: str
+    name: str
+    exchange: str
+    segment: str
+    instrument_type: str
+    expiry: Optional[date]
+    strike: float
+    tick_size: float
+    lot_size: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.exchange}:{self.tradingsymbol}"
+
+
+def ist_today() -> date:
+    return datetime.now(IST).date()
+
+
+def build_columns(csv_text: str) -> Dict[str, np.ndarray]:
+    """Columns from Kite's instruments CSV, with options ordered by (underlying, expiry, strike)"""
+    import pandas as pd
+
+    frame = pd.read_csv(io.StringIO(csv_text), dtype={"tradingsymbol": str, "name": str}, keep_default_na=False)
+    expiry = pd.to_datetime(frame["expiry"], errors="coerce")
+    columns = {
+        "instrument_token": frame["instrument_token"].to_numpy(dtype=np.int64),
+        "exchange_token": pd.to_numeric(frame["exchange_token"], errors="coerce").fillna(0).to_numpy(dtype=np.int64),
+        "expiry": ((expiry - pd.Timestamp(EPOCH)).dt.days.fillna(0)).to_numpy(dtype=np.int32),
+        "strike": pd.to_numeric(frame["strike"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float64),
+        "tick_size": pd.to_numeric(frame["tick_size"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float64),
+        "lot_size": pd.to_numeric(frame["lot_size"], errors="coerce").fillna(1).to_numpy(dtype=np.int32),
+    }
+    for column in STRING_COLUMNS:
+        columns[column] = np.array(frame[column].astype(str).tolist(), dtype=bytes)
+    # sorted by (name, options last, exchange, expiry, strike), every chain is one contiguous run
+    is_option = np.isin(columns["instrument_type"], OPTION_TYPES)
+    order = np.lexsort((columns["strike"], columns["expiry"], columns["exchange"], is_option, columns["name"]))
+    return {k: v[order] for k, v in columns.items()}
+
+
+class InstrumentTable:
+    """
+    One day's instrument master: memory-mapped columns plus the in-memory
+    indexes built over them. Immutable; a new day is a new table.
+    """
+
+    def __init__(self, day: str, columns: Dict[str, np.ndarray]):
+        self.day = day
+        self.columns = columns
+        tokens = columns["instrument_token"].tolist()
+        self.by_token: Dict[int, int] = dict(zip(tokens, range(len(tokens))))
+        # b"EXCHANGE:SYMBOL" keys: joining and hashing bytes is several times
+        # cheaper than decoding 100k strings first
+        keys = np.char.add(np.char.add(columns["exchange"], b":"), columns["tradingsymbol"]).tolist()
+        self.by_key: Dict[bytes, int] = dict(zip(keys, range(len(keys))))
+
+        # option rows are contiguous per underlying because of the build order
+        is_option = np.isin(columns["instrument_type"], OPTION_TYPES)
+        option_rows = np.flatnonzero(is_option)
+        # keyed by "EXCHANGE:UNDERLYING" and by the bare underlying, preferring NFO
+        self.chains: Dict[str, Tuple[int, int]] = {}
+        if len(option_rows):
+            names = columns["name"][option_rows]
+            exchanges = columns["exchange"][option_rows]
+            boundaries = np.flatnonzero((names[1:] != names[:-1]) | (exchanges[1:] != exchanges[:-1])) + 1
+            starts = np.concatenate(([0], boundaries))
+            ends = np.concatenate((boundaries, [len(option_rows)]))
+            for s, e in zip(starts, ends):
+                name, exchange = names[s].decode(), exchanges[s].decode()
+                span = (int(option_rows[s]), int(option_rows[e - 1]) + 1)
+                self.chains[f"{exchange}:{name}"] = span
+                if exchange == "NFO" or name not in self.chains:
+                    self.chains[name] = span
+
+    def __len__(self) -> int:
+        return len(self.by_token)
+
+    def find(self, exchange: str, tradingsymbol: str) -> Optional[int]:
+        return self.by_key.get(f"{exchange}:{tradingsymbol}".encode())
+
+    @classmethod
+    def load(cls, path: str) -> "InstrumentTable":
+        columns = {}
+        for column in (*STRING_COLUMNS, *NUMERIC_COLUMNS):
+            columns[column] = np.load(os.path.join(path, f"{column}.npy"), mmap_mode="r")
+        return cls(os.path.basename(path), columns)
+
+    @staticmethod
+    def save(path: str, columns: Dict[str, np.ndarray]) -> None:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for column, values in columns.items():
+            np.save(os.path.join(tmp, f"{column}.npy"), values)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+
+    def row(self, row: int) -> Instrument:
+        c = self.columns
+        expiry = int(c["expiry"][row])
+        return Instrument(
+            instrument_token=int(c["instrument_token"][row]),
+            exchange_token=int(c["exchange_token"][row]),
+            tradingsymbol=c["tradingsymbol"][row].decode(),
+            name=c["name"][row].decode(),
+            exchange=c["exchange"][row].decode(),
+            segment=c["segment"][row].decode(),
+            instrument_type=c["instrument_type"][row].decode(),
+            expiry=EPOCH + timedelta(days=expiry) if expiry else None,
+            strike=float(c["strike"][row]),
+            tick_size=float(c["tick_size"][row]),
+            lot_size=int(c["lot_size"][row]),
+        )
+
+
+class InstrumentRegistry:
+    """
+    Kite's instrument master, downloaded once a day and shared by every
+    process on the host.
+
+    Each day's dump is stored under `<root>/<YYYY-MM-DD>/` as one .npy file
+    per column and `<root>/current` names the latest one. Loading maps the
+    columns and builds dict indexes over them; a refresh builds the new
+    table off to the side and swaps it in with a single assignment, so
+    lookups never see a half-loaded registry.
+    """
+
+    def __init__(self, root: Optional[str] = None, refresh_hour: Optional[int] = None):
+        self.root = root or settings.INSTRUMENTS_DIR
+        self.refresh_hour = refresh_hour if refresh_hour is not None else settings.INSTRUMENTS_REFRESH_HOUR
+        self._table: Optional[InstrumentTable] = None
+        self._checked = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    # Storage
+
+    def _current(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, "current")) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _set_current(self, day: str) -> None:
+        tmp = os.path.join(self.root, f"current.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            f.write(day)
+        os.replace(tmp, os.path.join(self.root, "current"))
+
+    def load(self) -> bool:
+        """Swap in the latest stored dump if it is newer than the loaded one"""
+        day = self._current()
+        if day is None or (self._table is not None and self._table.day == day):
+            return False
+        started = time.perf_counter()
+        self._table = InstrumentTable.load(os.path.join(self.root, day))
+        logger.info(
+            f"Loaded {len(self._table)} instruments for {day} in {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+        return True
+
+    @property
+    def table(self) -> Optional[InstrumentTable]:
+        # processes that never run the refresh loop (Celery workers) pick
+        # up a new day's dump at most once a minute
+        now = time.monotonic()
+        if now - self._checked > 60.0:
+            self._checked = now
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Error loading instruments: {str(e)}")
+        return self._table
+
+    @property
+    def loaded(self) -> bool:
+        return self.table is not None
+
+    def stale(self) -> bool:
+        now = datetime.now(IST)
+        day = self._current()
+        return day is None or (now.hour >= self.refresh_hour and day < now.date().isoformat())
+
+    def store(self, csv_text: str, day: Optional[str] = None, keep: int = 3) -> str:
+        """Build and store a dump, mark it current and drop all but the newest `keep` days"""
+        day = day or ist_today().isoformat()
+        columns = build_columns(csv_text)
+        os.makedirs(self.root, exist_ok=True)
+        InstrumentTable.save(os.path.join(self.root, day), columns)
+        self._set_current(day)
+        days = sorted(d for d in os.listdir(self.root) if len(d) == 10 and d[4] == "-")
+        for old in days[:-keep]:
+            shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+        return day
+
+    async def refresh(self, force: bool = False) -> bool:
+        """
+        Download today's dump unless it is already stored; only one process
+        per host downloads, the rest wait for its result.
+        """
+        from app.core.cache import default_cache
+        from app.services.zerodha import zerodha_service
+
+        loop = asyncio.get_running_loop()
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, ".lock"), "w") as lock:
+            await loop.run_in_executor(None, fcntl.flock, lock, fcntl.LOCK_EX)
+            try:
+                if force or self.stale():
+                    csv_text = await zerodha_service.instruments()
+                    day = await loop.run_in_executor(None, self.store, csv_text)
+                    logger.info(f"Stored instrument dump for {day}")
+                    await default_cache.invalidate("instruments")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return await loop.run_in_executor(None, self.load)
+
+    async def run(self, interval: Optional[float] = None) -> None:
+        interval = interval or settings.INSTRUMENTS_CHECK_INTERVAL
+        while True:
+            try:
+                if self.stale():
+                    await self.refresh()
+                else:
+                    self.load()
+            except Exception as e:
+                logger.error(f"Error refreshing instruments: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            try:
+                self.load()
+            except Exception as e:
+                logger.error(f"Error loading instruments: {str(e)}")
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # Lookups
+
+    def get(self, token: int) -> Optional[Instrument]:
+        table = self.table
+        row = table.by_token.get(token) if table is not None else None
+        return table.row(row) if row is not None else None
+
+    def token(self, exchange: str, tradingsymbol: str) -> Optional[int]:
+        table = self.table
+        row = table.find(exchange, tradingsymbol) if table is not None else None
+        return int(table.columns["instrument_token"][row]) if row is not None else None
+
+    def lookup(self, name: str) -> Optional[Instrument]:
+        """Instrument for "EXCHANGE:SYMBOL", or a bare symbol on the first exchange listing it"""
+        table = self.table
+        if table is None:
+            return None
+        exchange, _, symbol = name.rpartition(":")
+        for candidate in (exchange,) if exchange else DEFAULT_EXCHANGES:
+            row = table.find(candidate, symbol)
+            if row is not None:
+                return table.row(row)
+        return None
+
+    def exchange_for(self, tradingsymbol: str, default: str = "NSE") -> str:
+        table = self.table
+        if table is not None:
+            for exchange in DEFAULT_EXCHANGES:
+                if table.find(exchange, tradingsymbol) is not None:
+                    return exchange
+        return default
+
+    def tokens(self, names: Iterable[str]) -> Dict[int, str]:
+        """{instrument_token: name} for the "EXCHANGE:SYMBOL" names that are known"""
+        table = self.table
+        found = {}
+        if table is None:
+            return found
+        for name in names:
+            exchange, _, symbol = name.rpartition(":")
+            row = table.find(exchange or "NSE", symbol)
+            if row is not None:
+                found[int(table.columns["instrument_token"][row])] = name
+        return found
+
+    def lot_size(self, name: str) -> int:
+        instrument = self.lookup(name)
+        return instrument.lot_size if instrument is not None else 1
+
+    def tick_size(self, name: str) -> float:
+        instrument = self.lookup(name)
+        return instrument.tick_size if instrument is not None else 0.05
+
+    def round_to_tick(self, name: str, price: float) -> float:
+        tick = self.tick_size(name)
+        return round(round(price / tick) * tick, 2) if tick else price
+
+    def expiries(self, underlying: str) -> List[date]:
+        table = self.table
+        span = table.chains.get(underlying) if table is not None else None
+        if span is None:
+            return []
+        days = np.unique(table.columns["expiry"][span[0]:span[1]])
+        return [EPOCH + timedelta(days=int(d)) for d in days]
+
+    def chain_rows(self, underlying: str, expiry: Optional[date] = None) -> np.ndarray:
+        """Table rows of the option chain, ordered by expiry then strike"""
+        table = self.table
+        span = table.chains.get(underlying) if table is not None else None
+        if span is None:
+            return np.empty(0, dtype=np.int64)
+        lo, hi = span
+        if expiry is not None:
+            days = table.columns["expiry"][lo:hi]
+            target = (expiry - EPOCH).days
+            lo, hi = lo + int(np.searchsorted(days, target, "left")), lo + int(np.searchsorted(days, target, "right"))
+        return np.arange(lo, hi)
+
+    def chain(self, underlying: str, expiry: Optional[date] = None) -> List[Instrument]:
+        table = self.table
+        return [table.row(int(row)) for row in self.chain_rows(underlying, expiry)]
+
+
+instrument_registry = InstrumentRegistry()
@@ -0,0 +1,341 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import httpx
+
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+# Lower runs first: orders pre-empt portfolio reads, which pre-empt quote polls
+PRIORITY_ORDER = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_QUOTE = 2
+
+# Kite Connect per-endpoint limits, requests per second
+RATE_LIMITS = {
+    "order": 10.0,
+    "quote": 1.0,
+    "historical": 3.0,
+    "default": 10.0,
+}
+
+RETRY_STATUS = (429, 502, 503, 504)
+
+
+class KiteError(Exception):
+    def __init__(self, message: str, status_code: int = 0, error_type: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_type = error_type
+
+
+class _PriorityWaiters:
+    """Futures waiting for a resource, released lowest priority value first"""
+
+    def __init__(self):
+        self._heap: List = []
+        self._seq = itertools.count()
+
+    def push(self, priority: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        return future
+
+    def pop(self) -> Optional[asyncio.Future]:
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                return future
+        return None
+
+    def __bool__(self) -> bool:
+        # drop waiters that were cancelled while queued
+        while self._heap and self._heap[0][2].done():
+            heapq.heappop(self._heap)
+        return bool(self._heap)
+
+
+class TokenBucket:
+    """Async token bucket; waiters are granted tokens in priority order"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._waiters = _PriorityWaiters()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT) -> None:
+        self._refill()
+        if self.tokens >= 1 and not self._waiters:
+            self.tokens -= 1
+            return
+        future = self._waiters.push(priority)
+        self._release()
+        await future
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._release()
+
+    def _release(self) -> None:
+        self._refill()
+        while self.tokens >= 1:
+            future = self._waiters.pop()
+            if future is None:
+                return
+            self.tokens -= 1
+            future.set_result(None)
+        if self._waiters and self._timer is None:
+            delay = (1 - self.tokens) / self.rate
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+
+class PrioritySemaphore:
+    """Connection slots handed out in priority order"""
+
+    def __init__(self, slots: int):
+        self.free = slots
+        self._waiters = _PriorityWaiters()
+
+    async def acquire(self, priority: int = PRIORITY_DEFAULT) -> None:
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+            return
+        future = self._waiters.push(priority)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        future = self._waiters.pop()
+        if future is not None:
+            future.set_result(None)
+        else:
+            self.free += 1
+
+
+class AsyncKiteClient:
+    """
+    Async Kite Connect REST client over one shared HTTP connection pool.
+
+    Every request passes a per-endpoint token bucket matching Kite's rate
+    limits and then a prioritized connection slot, so order placement is
+    never queued behind quote polling. Idempotent requests are retried on
+    429/5xx and transport errors with full-jitter backoff; order placement
+    is only retried when Kite rejected it with 429 or the connection was
+    never established.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        access_token: str,
+        root: str = "https://api.kite.trade",
+        max_connections: int = 10,
+        timeout: float = 7.0,
+        retries: int = 3,
+        backoff: float = 0.2,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.api_key = api_key
+        self.access_token = access_token
+        self.root = root
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.transport = transport
+        self.buckets = {name: TokenBucket(rate) for name, rate in RATE_LIMITS.items()}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots: Optional[PrioritySemaphore] = None
+
+    def set_access_token(self, access_token: str) -> None:
+        self.access_token = access_token
+        if self._client is not None:
+            self._client.headers["Authorization"] = f"token {self.api_key}:{access_token}"
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created on first use so it binds to the running loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.root,
+                headers={
+                    "X-Kite-Version": "3",
+                    "Authorization": f"token {self.api_key}:{self.access_token}",
+                },
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                timeout=self.timeout,
+                transport=self.transport,
+            )
+            self._slots = PrioritySemaphore(self.max_connections)
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        limit: str = "default",
+        priority: int = PRIORITY_DEFAULT,
+        params: Optional[Any] = None,
+        data: Optional[Dict] = None,
+        idempotent: bool = True,
+        raw: bool = False,
+    ) -> Any:
+        client = self.client
+        latency = histogram(f"kite.{limit}")
+        attempt = 0
+        while True:
+            await self.buckets[limit].acquire(priority)
+            await self._slots.acquire(priority)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, params=params, data=data)
+            except httpx.TransportError as e:
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= self.retries:
+                    raise KiteError(f"{method} {path} failed: {str(e)}") from e
+            else:
+                latency.record(time.perf_counter() - started)
+                retryable = response.status_code in RETRY_STATUS and (
+                    idempotent or response.status_code == 429
+                )
+                if not retryable or attempt >= self.retries:
+                    return self._parse(response, raw)
+            finally:
+                self._slots.release()
+            attempt += 1
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            logger.warning(f"Retrying {method} {path} in {delay:.2f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    def _parse(self, response: httpx.Response, raw: bool) -> Any:
+        if raw and response.status_code == 200:
+            return response.text
+        try:
+            body = response.json()
+        except ValueError:
+            raise KiteError(f"Unexpected response: {response.text[:200]}", response.status_code)
+        if response.status_code != 200 or body.get("status") == "error":
+            raise KiteError(
+                body.get("message", "Unknown error"), response.status_code, body.get("error_type")
+            )
+        return body["data"]
+
+    # Orders
+
+    async def place_order(
+        self,
+        tradingsymbol: str,
+        exchange: str,
+        transaction_type: str,
+        quantity: int,
+        product: str,
+        order_type: str,
+        variety: str = "regular",
+        **params,
+    ) -> str:
+        data = {
+            "tradingsymbol": tradingsymbol,
+            "exchange": exchange,
+            "transaction_type": transaction_type,
+            "quantity": quantity,
+            "product": product,
+            "order_type": order_type,
+        }
+        data.update({k: v for k, v in params.items() if v is not None})
+        result = await self.request(
+            "POST", f"/orders/{variety}", limit="order", priority=PRIORITY_ORDER,
+            data=data, idempotent=False,
+        )
+        return result["order_id"]
+
+    async def cancel_order(self, order_id: str, variety: str = "regular") -> str:
+        result = await self.request(
+            "DELETE", f"/orders/{variety}/{order_id}", limit="order",
+            priority=PRIORITY_ORDER, idempotent=False,
+        )
+        return result["order_id"]
+
+    async def orders(self) -> List[Dict]:
+        return await self.request("GET", "/orders")
+
+    async def order_history(self, order_id: str) -> List[Dict]:
+        return await self.request("GET", f"/orders/{order_id}")
+
+    # Portfolio
+
+    async def profile(self) -> Dict:
+        return await self.request("GET", "/user/profile")
+
+    async def margins(self, segment: Optional[str] = None) -> Dict:
+        return await self.request("GET", f"/user/margins/{segment}" if segment else "/user/margins")
+
+    async def positions(self) -> Dict[str, List[Dict]]:
+        return await self.request("GET", "/portfolio/positions")
+
+    async def get_positions(self) -> List[Dict]:
+        return (await self.positions()).get("net", [])
+
+    async def get_holdings(self) -> List[Dict]:
+        return await self.request("GET", "/portfolio/holdings")
+
+    # Market data
+
+    async def ltp(self, instruments: Union[str, Iterable[str]]) -> Dict[str, Dict]:
+        return await self.request(
+            "GET", "/quote/ltp", limit="quote", priority=PRIORITY_QUOTE,
+            params=[("i", i) for i in _instrument_list(instruments)],
+        )
+
+    async def quote(self, instruments: Union[str, Iterable[str]]) -> Dict[str, Dict]:
+        return await self.request(
+            "GET", "/quote", limit="quote", priority=PRIORITY_QUOTE,
+            params=[("i", i) for i in _instrument_list(instruments)],
+        )
+
+    async def ohlc(self, instruments: Union[str, Iterable[str]]) -> Dict[str, Dict]:
+        return await self.request(
+            "GET", "/quote/ohlc", limit="quote", priority=PRIORITY_QUOTE,
+            params=[("i", i) for i in _instrument_list(instruments)],
+        )
+
+    async def historical_data(
+        self, instrument_token: int, from_date: str, to_date: str, interval: str, continuous: bool = False, oi: bool = False
+    ) -> Dict:
+        return await self.request(
+            "GET", f"/instruments/historical/{instrument_token}/{interval}", limit="historical",
+            params={"from": from_date, "to": to_date, "continuous": int(continuous), "oi": int(oi)},
+        )
+
+    async def instruments(self, exchange: Optional[str] = None) -> str:
+        """Instrument dump as CSV text"""
+        return await self.request(
+            "GET", f"/instruments/{exchange}" if exchange else "/instruments", raw=True
+        )
+
+
+def _instrument_list(instruments: Union[str, Iterable[str]]) -> List[str]:
+    return [instruments] if isinstance(instruments, str) else list(instruments)
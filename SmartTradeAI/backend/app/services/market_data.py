@@ -1,23 +1,64 @@
 import yfinance as yf
 import nsepy
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 from newsapi import NewsApiClient
+from app.core.cache import cached
 from app.core.config import settings
+from app.services.bar_store import bar_store
 
+def _utc_date(ts: int) -> date:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).date()
+
+def fetch_yfinance(ticker: str, interval: str = "1d"):
+    """
+    Build a bar store fetcher for a yfinance ticker
+    """
+    def fetch(start: int, end: int):
+        return yf.download(
+            ticker,
+            start=datetime.fromtimestamp(start, tz=timezone.utc).strftime("%Y-%m-%d"),
+            end=datetime.fromtimestamp(end, tz=timezone.utc).strftime("%Y-%m-%d"),
+            interval=interval,
+            progress=False,
+        )
+    return fetch
+
+def fetch_nsepy(symbol: str):
+    """
+    Build a bar store fetcher for an nsepy symbol
+    """
+    def fetch(start: int, end: int):
+        # nsepy's end date is inclusive
+        return nsepy.get_history(symbol=symbol, start=_utc_date(start), end=_utc_date(end - 1))
+    return fetch
+
+def get_stock_bars(ticker: str, start_date, end_date, interval: str = "1d"):
+    """
+    Get stock bars from the local bar store, topping up from yfinance
+    """
+    return bar_store.read(
+        ticker, interval, start_date, end_date, fetch=fetch_yfinance(ticker, interval)
+    )
+
+@cached(settings.CACHE_MARKET_DATA_TTL, tags=lambda ticker, *args, **kwargs: [f"ticker:{ticker}"])
 def get_stock_data(ticker: str, start_date: str, end_date: str):
     """
     Get stock data from yfinance
     """
-    data = yf.download(ticker, start=start_date, end=end_date)
-    return data
+    return get_stock_bars(ticker, start_date, end_date).to_frame()
 
+@cached(settings.CACHE_MARKET_DATA_TTL, tags=lambda symbol, *args, **kwargs: [f"ticker:{symbol}"])
 def get_nse_data(symbol: str, start_date: date, end_date: date):
     """
     Get stock data from nsepy
     """
-    data = nsepy.get_history(symbol=symbol, start=start_date, end=end_date)
-    return data
+    bars = bar_store.read(
+        symbol, "1d", start_date, end_date + timedelta(days=1),
+        fetch=fetch_nsepy(symbol), source="nsepy",
+    )
+    return bars.to_frame()
 
+@cached(settings.CACHE_NEWS_TTL, key=lambda: "news:top", tags=["news"])
 def get_top_news():
     """
     Get top news from NewsAPI
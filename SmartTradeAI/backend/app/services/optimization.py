@@ -0,0 +1,330 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services import backtest, market_data
+from app.services.bar_store import bar_store, to_epoch
+from app.utils.logging import logger
+
+METRICS = ("total_return", "max_drawdown", "sharpe_ratio", "trades")
+
+
+def walk_forward_folds(
+    n_bars: int, train_bars: Optional[int], test_bars: Optional[int], step: Optional[int] = None
+) -> List[Tuple[int, int, int]]:
+    """
+    (train_start, train_end, test_end) bar indices for each fold. Without a
+    walk-forward split there is one fold covering everything, with no test
+    segment.
+    """
+    if not train_bars or not test_bars:
+        return [(0, n_bars, n_bars)]
+    step = step or test_bars
+    folds = []
+    start = 0
+    while start + train_bars + test_bars <= n_bars:
+        folds.append((start, start + train_bars, start + train_bars + test_bars))
+        start += step
+    if not folds:
+        raise ValueError(f"{n_bars} bars is too short for {train_bars} train + {test_bars} test bars")
+    return folds
+
+
+@lru_cache(maxsize=4)
+def close_matrix(tickers: Tuple[str, ...], interval: str, start: int, end: int, data_key: str) -> np.ndarray:
+    """
+    (symbols x bars) closes on the union of the tickers' timestamps within
+    [start, end], read straight from the local bar store. A symbol's close
+    is carried forward over bars it has no row for (another exchange's
+    calendar, a suspension), so only bars before its first one stay NaN.
+    `data_key` only keys the per-process cache so a changed series is re-read.
+    """
+    series = [bar_store.load(ticker, interval).slice(start, end + 1) for ticker in tickers]
+    ts = np.unique(np.concatenate([bars.ts for bars in series])) if series else np.empty(0, dtype=np.int64)
+    closes = np.full((len(tickers), len(ts)), np.nan)
+    positions = np.arange(len(ts))
+    for row, bars in enumerate(series):
+        closes[row, np.searchsorted(ts, bars.ts)] = bars.close
+        last = np.maximum.accumulate(np.where(np.isnan(closes[row]), -1, positions))
+        closes[row] = np.where(last >= 0, closes[row, np.maximum(last, 0)], np.nan)
+    return closes
+
+
+def job_hash(spec: Dict, versions: Dict[str, Sequence[int]]) -> str:
+    """Identity of a job: its parameters plus the version of every input series"""
+    key = {k: spec[k] for k in sorted(spec) if k != "strategy_id"}
+    payload = json.dumps([key, sorted((t, list(v)) for t, v in versions.items())], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def request_id(
+    tickers: Sequence[str],
+    window_pairs: Sequence[Tuple[int, int]],
+    days: int = 730,
+    interval: str = "1d",
+    train_bars: Optional[int] = None,
+    test_bars: Optional[int] = None,
+    step: Optional[int] = None,
+) -> str:
+    """
+    Handle for a job before its data is fetched: its parameters and the
+    day it was asked on. The result is stored under it as well as under
+    the job hash.
+    """
+    params = [list(tickers), [[int(s), int(l)] for s, l in window_pairs], days, interval,
+              train_bars, test_bars, step, date.today().isoformat()]
+    return hashlib.sha1(json.dumps(params).encode()).hexdigest()
+
+
+def prepare(
+    tickers: Sequence[str],
+    window_pairs: Sequence[Tuple[int, int]],
+    days: int = 730,
+    interval: str = "1d",
+    train_bars: Optional[int] = None,
+    test_bars: Optional[int] = None,
+    step: Optional[int] = None,
+    chunk_pairs: Optional[int] = None,
+    strategy_id: Optional[int] = None,
+    request: Optional[str] = None,
+) -> Tuple[Dict, List[Dict]]:
+    """
+    Top up the bar store once, pin the data range and split the job into
+    (fold, pair chunk) tasks. Returns the job spec and its chunks. This
+    downloads history, so it runs in a worker, never in a request.
+    """
+    today = date.today()
+    start_date, end_date = today - timedelta(days=days), today + timedelta(days=1)
+    for ticker in tickers:
+        market_data.get_stock_bars(ticker, start_date, end_date, interval=interval)
+    versions = {ticker: bar_store.version(ticker, interval) for ticker in tickers}
+    start = to_epoch(start_date)
+    end = max((v[1] for v in versions.values()), default=start)
+
+    pairs = [[int(s), int(l)] for s, l in window_pairs]
+    spec = {
+        "engine": "sma_walk_forward",
+        "tickers": list(tickers),
+        "interval": interval,
+        "start": start,
+        "end": end,
+        "window_pairs": pairs,
+        "train_bars": train_bars,
+        "test_bars": test_bars,
+        "step": step,
+        "strategy_id": strategy_id,
+    }
+    spec["job_hash"] = job_hash(spec, versions)
+    spec["request_id"] = request
+
+    n_bars = close_matrix(tuple(tickers), interval, start, end, spec["job_hash"]).shape[1]
+    folds = walk_forward_folds(n_bars, train_bars, test_bars, step)
+    spec["folds"] = [list(f) for f in folds]
+    size = chunk_pairs or settings.OPTIMIZATION_CHUNK_PAIRS
+    chunks = [
+        {
+            "job_hash": spec["job_hash"],
+            "tickers": spec["tickers"],
+            "interval": interval,
+            "start": start,
+            "end": end,
+            "fold": k,
+            "bounds": list(fold),
+            "offset": offset,
+            "pairs": pairs[offset:offset + size],
+        }
+        for k, fold in enumerate(folds)
+        for offset in range(0, len(pairs), size)
+    ]
+    return spec, chunks
+
+
+def _metrics(result: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    # float32 halves the payload; metrics need nowhere near double precision
+    return {name: result[name].astype(np.float32 if name != "trades" else np.int32) for name in METRICS}
+
+
+def evaluate_chunk(chunk: Dict) -> Dict:
+    """
+    Run one (fold, pair chunk) in a worker. Only per-pair, per-symbol
+    metrics come back, never price data.
+    """
+    closes = close_matrix(
+        tuple(chunk["tickers"]), chunk["interval"], chunk["start"], chunk["end"], chunk["job_hash"]
+    )
+    lo, mid, hi = chunk["bounds"]
+    pairs = [tuple(p) for p in chunk["pairs"]]
+    result = {"fold": chunk["fold"], "offset": chunk["offset"]}
+    result["train"] = _metrics(backtest.run_sma_grid(closes[:, lo:mid], pairs))
+    if hi > mid:
+        # the test segment is preceded by enough bars to seed the longest window
+        longest = max(l for _, l in pairs)
+        seed = max(lo, mid - longest)
+        result["test"] = _metrics(backtest.run_sma_grid(closes[:, seed:hi], pairs, warmup=mid - seed))
+    return result
+
+
+def combine(spec: Dict, results: List[Dict]) -> Dict:
+    """
+    Merge chunk results into one summary. For each fold the pair with the
+    best in-sample Sharpe is picked per symbol and scored out of sample.
+    """
+    pairs = spec["window_pairs"]
+    tickers = spec["tickers"]
+    folds = len(spec["folds"])
+    shape = (folds, len(pairs), len(tickers))
+    train = {name: np.zeros(shape) for name in METRICS}
+    test = {name: np.full(shape, np.nan) for name in METRICS}
+    for r in results:
+        rows = slice(r["offset"], r["offset"] + len(r["train"]["sharpe_ratio"]))
+        for name in METRICS:
+            train[name][r["fold"], rows] = r["train"][name]
+            if "test" in r:
+                test[name][r["fold"], rows] = r["test"][name]
+
+    walk_forward = bool(spec.get("train_bars") and spec.get("test_bars"))
+    best = train["sharpe_ratio"].argmax(axis=1)  # folds x symbols
+    fold_index = np.arange(folds)[:, None]
+    symbol_index = np.arange(len(tickers))[None, :]
+    scored = test if walk_forward else train
+    chosen = {name: scored[name][fold_index, best, symbol_index] for name in METRICS}
+
+    mean_sharpe = train["sharpe_ratio"].mean(axis=(0, 2))
+    best_pair = int(np.argmax(mean_sharpe))
+    per_symbol = {}
+    for col, ticker in enumerate(tickers):
+        per_symbol[ticker] = {
+            "pairs": [pairs[int(b)] for b in best[:, col]],
+            "total_return": float(np.prod(1 + chosen["total_return"][:, col]) - 1),
+            "max_drawdown": float(chosen["max_drawdown"][:, col].max()),
+            "sharpe_ratio": float(chosen["sharpe_ratio"][:, col].mean()),
+            "trades": int(chosen["trades"][:, col].sum()),
+        }
+
+    in_sample = float(train["sharpe_ratio"][fold_index, best, symbol_index].mean())
+    out_of_sample = float(chosen["sharpe_ratio"].mean())
+    return {
+        "engine": spec["engine"],
+        "job_hash": spec["job_hash"],
+        "window_pairs": pairs,
+        "folds": spec["folds"],
+        "best_pair": pairs[best_pair],
+        "best_pair_mean_sharpe": out_of_sample if walk_forward else float(mean_sharpe[best_pair]),
+        "best_pair_max_drawdown": float(chosen["max_drawdown"].max()),
+        "in_sample_sharpe": in_sample,
+        "out_of_sample_sharpe": out_of_sample if walk_forward else None,
+        "walk_forward_efficiency": out_of_sample / in_sample if walk_forward and in_sample else None,
+        "symbols": per_symbol,
+    }
+
+
+# Memoized results, shared by every process that sees the same directory
+
+def _result_path(job: str) -> str:
+    return os.path.join(settings.OPTIMIZATION_CACHE_DIR, f"{job}.json")
+
+
+def cached_result(job: str) -> Optional[Dict]:
+    path = _result_path(job)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def store_result(summary: Dict, job: Optional[str] = None) -> None:
+    os.makedirs(settings.OPTIMIZATION_CACHE_DIR, exist_ok=True)
+    path = _result_path(job or summary["job_hash"])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(summary, f)
+    os.replace(tmp, path)
+
+
+def discard_result(job: str) -> None:
+    try:
+        os.remove(_result_path(job))
+    except FileNotFoundError:
+        pass
+
+
+def save_on_strategy(strategy_id: int, summary: Dict) -> None:
+    from app.db.session import SessionLocal
+    from app.models.strategy import Strategy
+
+    db = SessionLocal()
+    try:
+        strategy = db.query(Strategy).filter(Strategy.id == strategy_id).first()
+        if strategy is not None:
+            backtest.save_backtest_results(db, strategy, summary)
+    finally:
+        db.close()
+
+
+def finish(spec: Dict, results: List[Dict]) -> Dict:
+    """Combine, memoize and, if the job belongs to a strategy, save on it"""
+    summary = combine(spec, results)
+    store_result(summary)
+    if spec.get("request_id"):
+        store_result(summary, spec["request_id"])
+    if spec.get("strategy_id"):
+        save_on_strategy(spec["strategy_id"], summary)
+    return summary
+
+
+def use_celery() -> bool:
+    return settings.OPTIMIZATION_BACKEND == "celery" and bool(settings.CELERY_BROKER_URL)
+
+
+def run_local(spec: Dict, chunks: List[Dict], workers: Optional[int] = None) -> Dict:
+    """Evaluate chunks on a local process pool"""
+    with ProcessPoolExecutor(max_workers=workers or settings.OPTIMIZATION_WORKERS or None) as pool:
+        results = list(pool.map(evaluate_chunk, chunks))
+    return finish(spec, results)
+
+
+def submit(spec: Dict, chunks: List[Dict]) -> Optional[Dict]:
+    """
+    Start a job unless an identical one (same parameters and data versions)
+    already finished. Returns the memoized summary, the local result, or
+    None when the chunks were handed to Celery.
+    """
+    cached = cached_result(spec["job_hash"])
+    if cached is not None:
+        logger.info(f"Optimization {spec['job_hash']} served from cache")
+        if spec.get("request_id"):
+            store_result(cached, spec["request_id"])
+        if spec.get("strategy_id"):
+            save_on_strategy(spec["strategy_id"], cached)
+        return cached
+    logger.info(f"Optimization {spec['job_hash']}: {len(chunks)} chunks")
+    if not use_celery():
+        return run_local(spec, chunks)
+
+    from celery import chord
+    from app.worker.tasks import optimization_chunk_task, optimization_finish_task
+
+    chord(optimization_chunk_task.s(chunk) for chunk in chunks)(optimization_finish_task.s(spec))
+    return None
+
+
+def run(request: str, tickers: Sequence[str], window_pairs: Sequence[Tuple[int, int]], **params) -> Optional[Dict]:
+    """
+    Prepare and submit a job asked for as `request` (see request_id). A job
+    that cannot be prepared leaves its error as the request's result.
+    """
+    discard_result(request)
+    try:
+        spec, chunks = prepare(tickers, window_pairs, request=request, **params)
+    except ValueError as e:
+        logger.warning(f"Optimization {request} rejected: {str(e)}")
+        store_result({"job_hash": None, "request_id": request, "error": str(e)}, request)
+        return None
+    return submit(spec, chunks)
@@ -0,0 +1,477 @@
+"""
+Option chain analytics.
+
+A chain is one (underlying, expiry) run of the instrument master held as
+parallel arrays, so pricing, implied volatility and Greeks are computed for
+every contract in one NumPy pass. Options are priced with Black-76 on the
+forward implied by put-call parity at the most at-the-money strike, which
+needs no spot mapping for indices and absorbs dividends and futures basis.
+Ticks only write prices into the arrays and mark the chain dirty; dirty
+chains are recomputed together on a short interval, warm-started from the
+previous implied volatilities.
+"""
+import asyncio
+import math
+import time
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.instruments import EPOCH, InstrumentRegistry, instrument_registry, ist_today
+from app.services.ticker import Tick, TickIngestionService
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+YEAR_SECONDS = 365.0 * 86400
+EXPIRY_SECONDS = 15 * 3600 + 30 * 60 - 19800  # 15:30 IST, in UTC seconds of the expiry day
+QUOTE_BATCH = 500  # Kite's limit of instruments per quote call
+MIN_VOL, MAX_VOL = 1e-4, 5.0
+SQRT_2PI = math.sqrt(2.0 * math.pi)
+
+
+# Pricing
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """
+    Standard normal CDF from a Chebyshev fit of erfc (Numerical Recipes
+    erfcc). Its error is relative, under 1.2e-7, so far out-of-the-money
+    prices stay accurate.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    z = np.abs(x) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.5 * z)
+    poly = -1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (
+        -0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+            -0.82215223 + t * 0.17087277))))))))
+    tail = 0.5 * t * np.exp(-z * z + poly)
+    return np.where(x >= 0, 1.0 - tail, tail)
+
+
+def _d1_d2(forward, strike, t, sigma):
+    root = sigma * np.sqrt(t)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1 = (np.log(forward / strike) + 0.5 * root * root) / root
+    return d1, d1 - root
+
+
+def black_price(forward, strike, t, rate, sigma, is_call) -> np.ndarray:
+    """Black-76 price of calls (is_call True) and puts on a forward"""
+    discount = np.exp(-rate * t)
+    d1, d2 = _d1_d2(forward, strike, t, sigma)
+    call = discount * (forward * norm_cdf(d1) - strike * norm_cdf(d2))
+    put = discount * (strike * norm_cdf(-d2) - forward * norm_cdf(-d1))
+    return np.where(is_call, call, put)
+
+
+def greeks(forward, strike, t, rate, sigma, is_call) -> Dict[str, np.ndarray]:
+    """
+    Delta, gamma, vega per volatility point and theta per calendar day.
+    Delta and gamma are with respect to the forward.
+    """
+    discount = np.exp(-rate * t)
+    d1, d2 = _d1_d2(forward, strike, t, sigma)
+    pdf = norm_pdf(d1)
+    root_t = np.sqrt(t)
+    price = black_price(forward, strike, t, rate, sigma, is_call)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gamma = discount * pdf / (forward * sigma * root_t)
+        theta = rate * price - discount * forward * pdf * sigma / (2.0 * root_t)
+    return {
+        "delta": discount * np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0),
+        "gamma": gamma,
+        "vega": discount * forward * pdf * root_t / 100.0,
+        "theta": theta / 365.0,
+    }
+
+
+def implied_volatility(
+    price, forward, strike, t, rate, is_call, guess=None, tol: float = 1e-8, max_iter: int = 50
+) -> np.ndarray:
+    """
+    Implied volatility of every contract at once. Newton steps are taken
+    while they stay inside a bracket that each iteration narrows; a step
+    that leaves it (or has no vega) falls back to bisection, so far
+    out-of-the-money strikes converge too. `tol` is relative to the
+    price, and to sigma for the last step. Prices outside the no-arbitrage
+    bounds give NaN.
+    """
+    price, forward, strike, t, is_call = np.broadcast_arrays(
+        *(np.asarray(a, dtype=np.float64) for a in (price, forward, strike, t, is_call))
+    )
+    is_call = is_call.astype(bool)
+    discount = np.exp(-rate * t)
+    intrinsic = discount * np.maximum(np.where(is_call, forward - strike, strike - forward), 0.0)
+    upper = discount * np.where(is_call, forward, strike)
+    with np.errstate(invalid="ignore"):
+        valid = np.isfinite(price) & (t > 0) & (price > intrinsic) & (price < upper)
+    # an in-the-money price is mostly intrinsic value; solve its out-of-the-money
+    # parity twin instead, which has the same volatility and a well-conditioned vega
+    itm = np.where(is_call, strike < forward, strike > forward)
+    price = np.where(itm, price - discount * np.where(is_call, forward - strike, strike - forward), price)
+    is_call = is_call ^ itm
+
+    # Brenner-Subrahmanyam, unless the last solution is a better start
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = np.sqrt(2.0 * math.pi / t) * price / (discount * forward)
+    if guess is not None:
+        guess = np.broadcast_to(np.asarray(guess, dtype=np.float64), price.shape)
+        sigma = np.where(np.isfinite(guess) & (guess > MIN_VOL), guess, sigma)
+    sigma = np.clip(np.nan_to_num(sigma, nan=0.3), MIN_VOL * 2, MAX_VOL / 2)
+    lo = np.full(price.shape, MIN_VOL)
+    hi = np.full(price.shape, MAX_VOL)
+
+    active = np.flatnonzero(valid)
+    for _ in range(max_iter):
+        if not active.size:
+            break
+        s, f, k, tt, c = sigma[active], forward[active], strike[active], t[active], is_call[active]
+        d1, _ = _d1_d2(f, k, tt, s)
+        diff = black_price(f, k, tt, rate, s, c) - price[active]
+        vega = np.exp(-rate * tt) * f * norm_pdf(d1) * np.sqrt(tt)
+        high = diff > 0
+        hi[active] = np.where(high, s, hi[active])
+        lo[active] = np.where(high, lo[active], s)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            step = s - diff / vega
+        inside = np.isfinite(step) & (step > lo[active]) & (step < hi[active])
+        new = np.where(inside, step, 0.5 * (lo[active] + hi[active]))
+        done = (np.abs(diff) <= tol * price[active]) | (np.abs(new - s) <= tol * s) \
+            | (hi[active] - lo[active] <= tol * s)
+        sigma[active] = np.where(done, s, new)
+        active = active[~done]
+    return np.where(valid, sigma, np.nan)
+
+
+# Chains
+
+class OptionChain:
+    """Calls and puts of one (underlying, expiry), ordered by strike"""
+
+    def __init__(self, underlying: str, expiry: date, registry: InstrumentRegistry, rows: np.ndarray):
+        columns = registry.table.columns
+        self.underlying = underlying
+        self.expiry = expiry
+        self.expiry_ts = (expiry - EPOCH).days * 86400 + EXPIRY_SECONDS
+        self.tokens = columns["instrument_token"][rows].astype(np.int64)
+        self.names = [
+            f"{exchange.decode()}:{symbol.decode()}"
+            for exchange, symbol in zip(columns["exchange"][rows], columns["tradingsymbol"][rows])
+        ]
+        self.strike = columns["strike"][rows].astype(np.float64)
+        self.is_call = columns["instrument_type"][rows] == b"CE"
+        self.lot_size = int(columns["lot_size"][rows[0]]) if len(rows) else 1
+        self.position = {int(token): i for i, token in enumerate(self.tokens)}
+
+        # per-strike view for parity, max pain and the table
+        self.strikes, slot = np.unique(self.strike, return_inverse=True)
+        self.call_at = np.full(len(self.strikes), -1)
+        self.put_at = np.full(len(self.strikes), -1)
+        self.call_at[slot[self.is_call]] = np.flatnonzero(self.is_call)
+        self.put_at[slot[~self.is_call]] = np.flatnonzero(~self.is_call)
+
+        n = len(rows)
+        self.ltp = np.full(n, np.nan)
+        self.oi = np.zeros(n)
+        self.volume = np.zeros(n)
+        self.iv = np.full(n, np.nan)
+        self.greeks = {name: np.full(n, np.nan) for name in ("delta", "gamma", "vega", "theta")}
+        self.changed = np.zeros(n, dtype=bool)
+        self.forward = math.nan
+        self.t = math.nan
+        self.refreshed = 0.0
+        self.seeded = 0.0
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def update(self, i: int, ltp: float, oi: float = 0.0, volume: float = 0.0) -> None:
+        self.ltp[i] = ltp
+        if oi:
+            self.oi[i] = oi
+        if volume:
+            self.volume[i] = volume
+        self.changed[i] = True
+
+    def implied_forward(self, rate: float, t: float) -> float:
+        """Put-call parity forward at the strike where call and put are closest in price"""
+        both = (self.call_at >= 0) & (self.put_at >= 0)
+        call = np.where(both, self.ltp[self.call_at], np.nan)
+        put = np.where(both, self.ltp[self.put_at], np.nan)
+        gap = call - put
+        if not np.isfinite(gap).any():
+            return math.nan
+        k = int(np.nanargmin(np.abs(gap)))
+        return float(self.strikes[k] + gap[k] * math.exp(rate * t))
+
+    def refresh(self, rate: float, now: Optional[float] = None) -> int:
+        """
+        Recompute IV and Greeks; returns how many contracts were solved.
+        Only contracts with new prices are solved unless the forward or
+        time to expiry moved enough to shift the rest.
+        """
+        now = time.time() if now is None else now
+        t = (self.expiry_ts - now) / YEAR_SECONDS
+        if t <= 0:
+            return 0
+        forward = self.implied_forward(rate, t)
+        if not math.isfinite(forward):
+            return 0
+        moved = not math.isfinite(self.forward) or abs(forward / self.forward - 1.0) > 1e-4 \
+            or abs(t - self.t) * YEAR_SECONDS > 60.0
+        index = np.arange(len(self)) if moved else np.flatnonzero(self.changed)
+        if moved:
+            self.forward, self.t = forward, t
+        if index.size:
+            strike, is_call = self.strike[index], self.is_call[index]
+            iv = implied_volatility(
+                self.ltp[index], self.forward, strike, self.t, rate, is_call, guess=self.iv[index]
+            )
+            self.iv[index] = iv
+            for name, values in greeks(self.forward, strike, self.t, rate, iv, is_call).items():
+                self.greeks[name][index] = values
+        self.changed[:] = False
+        self.refreshed = now
+        return int(index.size)
+
+    # Analytics
+
+    def pcr(self) -> Dict[str, Optional[float]]:
+        """Put-call ratio by open interest and by volume"""
+        calls, puts = self.is_call, ~self.is_call
+        call_oi, put_oi = self.oi[calls].sum(), self.oi[puts].sum()
+        call_volume, put_volume = self.volume[calls].sum(), self.volume[puts].sum()
+        return {
+            "oi": float(put_oi / call_oi) if call_oi else None,
+            "volume": float(put_volume / call_volume) if call_volume else None,
+        }
+
+    def max_pain(self) -> Optional[float]:
+        """Settlement strike at which option writers pay out the least"""
+        if not self.oi.any():
+            return None
+        call_oi = np.where(self.call_at >= 0, self.oi[self.call_at], 0.0)
+        put_oi = np.where(self.put_at >= 0, self.oi[self.put_at], 0.0)
+        settle = self.strikes[:, None]
+        payout = (np.maximum(settle - self.strikes, 0.0) * call_oi).sum(axis=1) \
+            + (np.maximum(self.strikes - settle, 0.0) * put_oi).sum(axis=1)
+        return float(self.strikes[int(np.argmin(payout))])
+
+    def otm_iv(self) -> np.ndarray:
+        """Per-strike IV from the out-of-the-money side (puts below the forward, calls above)"""
+        call = np.where(self.call_at >= 0, self.iv[self.call_at], np.nan)
+        put = np.where(self.put_at >= 0, self.iv[self.put_at], np.nan)
+        otm = np.where(self.strikes < self.forward, put, call)
+        return np.where(np.isfinite(otm), otm, np.where(self.strikes < self.forward, call, put))
+
+    def atm_strike(self) -> Optional[float]:
+        if not math.isfinite(self.forward):
+            return None
+        return float(self.strikes[int(np.argmin(np.abs(self.strikes - self.forward)))])
+
+    def _leg(self, i: int) -> Optional[Dict]:
+        if i < 0:
+            return None
+        return {
+            "tradingsymbol": self.names[i],
+            "ltp": _number(self.ltp[i]),
+            "oi": float(self.oi[i]),
+            "volume": float(self.volume[i]),
+            "iv": _number(self.iv[i]),
+            **{name: _number(values[i]) for name, values in self.greeks.items()},
+        }
+
+    def snapshot(self) -> Dict:
+        atm = self.atm_strike()
+        iv = self.otm_iv() if atm is not None else None
+        return {
+            "underlying": self.underlying,
+            "expiry": self.expiry.isoformat(),
+            "lot_size": self.lot_size,
+            "forward": _number(self.forward),
+            "years_to_expiry": _number(self.t),
+            "atm_strike": atm,
+            "atm_iv": _number(iv[int(np.searchsorted(self.strikes, atm))]) if atm is not None else None,
+            "pcr": self.pcr(),
+            "max_pain": self.max_pain(),
+            "refreshed": self.refreshed,
+            "strikes": [
+                {"strike": float(k), "call": self._leg(int(c)), "put": self._leg(int(p))}
+                for k, c, p in zip(self.strikes, self.call_at, self.put_at)
+            ],
+        }
+
+
+def _number(value) -> Optional[float]:
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+class OptionChainService:
+    """
+    Live option chains per underlying. Chains are built from the
+    instrument master on first use, seeded from quotes, then kept current
+    from ticks; the refresh loop solves every dirty chain each interval.
+    A process without a tick feed re-seeds a chain from quotes instead,
+    when it is asked for one older than the refresh interval.
+    """
+
+    def __init__(
+        self,
+        registry: Optional[InstrumentRegistry] = None,
+        rate: Optional[float] = None,
+        refresh_interval: Optional[float] = None,
+    ):
+        self.registry = registry or instrument_registry
+        self.rate = rate if rate is not None else settings.OPTIONS_RISK_FREE_RATE
+        self.refresh_interval = refresh_interval or settings.OPTIONS_REFRESH_INTERVAL
+        self.chains: Dict[Tuple[str, date], OptionChain] = {}
+        self.by_token: Dict[int, OptionChain] = {}
+        self.dirty: Dict[Tuple[str, date], OptionChain] = {}
+        self.ticks: Optional[TickIngestionService] = None
+        self.solved = 0
+        self.latency = histogram("options.refresh")
+        self._task: Optional[asyncio.Task] = None
+
+    def expiries(self, underlying: str, count: int = 1) -> List[date]:
+        today = ist_today()
+        return [d for d in self.registry.expiries(underlying) if d >= today][:count]
+
+    async def watch(self, underlying: str, expiry: Optional[date] = None, count: int = 1) -> List[OptionChain]:
+        """Build, subscribe and seed the chains of an underlying: one expiry, or the nearest `count`"""
+        underlying = underlying.upper()
+        chains = []
+        for day in [expiry] if expiry is not None else self.expiries(underlying, count):
+            key = (underlying, day)
+            chain = self.chains.get(key)
+            if chain is None:
+                rows = self.registry.chain_rows(underlying, day)
+                if not rows.size:
+                    continue
+                chain = OptionChain(underlying, day, self.registry, rows)
+                self.chains[key] = chain
+                for token in chain.position:
+                    self.by_token[token] = chain
+                if self.ticks is not None:
+                    self.ticks.subscribe(dict(zip(chain.position, chain.names)))
+                await self._seed(chain)
+                self.dirty[key] = chain
+            elif self.ticks is None and time.time() - chain.seeded >= self.refresh_interval:
+                await self._seed(chain)
+                self.dirty[key] = chain
+            chains.append(chain)
+        return chains
+
+    async def _seed(self, chain: OptionChain) -> None:
+        from app.services.zerodha import zerodha_service
+
+        for start in range(0, len(chain), QUOTE_BATCH):
+            names = chain.names[start:start + QUOTE_BATCH]
+            try:
+                quotes = await zerodha_service.quote(names)
+            except Exception as e:
+                logger.warning(f"Could not seed {chain.underlying} {chain.expiry} quotes: {str(e)}")
+                return
+            for i, name in enumerate(names, start):
+                quote = quotes.get(name)
+                if quote and quote.get("last_price"):
+                    chain.update(i, float(quote["last_price"]), float(quote.get("oi") or 0.0),
+                                 float(quote.get("volume") or 0.0))
+        chain.seeded = time.time()
+
+    async def get(self, underlying: str, expiry: Optional[date] = None) -> Optional[OptionChain]:
+        """A chain, watched on first request and solved if it has unsolved prices"""
+        chains = await self.watch(underlying, expiry)
+        if not chains:
+            return None
+        return self._solve(chains[0])
+
+    def _solve(self, chain: OptionChain) -> OptionChain:
+        if chain.changed.any() or not chain.refreshed:
+            self.solved += chain.refresh(self.rate)
+            self.dirty.pop((chain.underlying, chain.expiry), None)
+        return chain
+
+    async def surface(self, underlying: str, count: int = 4) -> Dict:
+        """Out-of-the-money IV by expiry and strike, on the union of the chains' strikes"""
+        chains = [self._solve(c) for c in await self.watch(underlying, count=count)]
+        chains = [c for c in chains if math.isfinite(c.forward)]
+        if not chains:
+            return {"underlying": underlying.upper(), "expiries": [], "strikes": [], "iv": []}
+        strikes = np.unique(np.concatenate([c.strikes for c in chains]))
+        grid = np.full((len(chains), len(strikes)), np.nan)
+        for row, chain in enumerate(chains):
+            grid[row, np.searchsorted(strikes, chain.strikes)] = chain.otm_iv()
+        return {
+            "underlying": underlying.upper(),
+            "expiries": [c.expiry.isoformat() for c in chains],
+            "years_to_expiry": [c.t for c in chains],
+            "forwards": [c.forward for c in chains],
+            "strikes": strikes.tolist(),
+            "iv": [[_number(v) for v in row] for row in grid],
+        }
+
+    async def on_ticks(self, ticks: List[Tick]) -> None:
+        for tick in ticks:
+            chain = self.by_token.get(tick.token)
+            if chain is not None:
+                chain.update(chain.position[tick.token], tick.ltp, tick.oi, tick.volume)
+                self.dirty[(chain.underlying, chain.expiry)] = chain
+
+    def refresh(self, now: Optional[float] = None) -> int:
+        dirty, self.dirty = self.dirty, {}
+        solved = 0
+        for chain in dirty.values():
+            solved += chain.refresh(self.rate, now)
+        self.solved += solved
+        return solved
+
+    async def run(self, watch: Iterable[str] = ()) -> None:
+        for underlying in watch:
+            try:
+                await self.watch(underlying, count=settings.OPTIONS_WATCH_EXPIRIES)
+            except Exception as e:
+                logger.error(f"Error watching {underlying} options: {str(e)}")
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            if not self.dirty:
+                continue
+            started = time.perf_counter()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing option chains: {str(e)}")
+            self.latency.record(time.perf_counter() - started)
+
+    def attach(self, ticks: TickIngestionService) -> None:
+        self.ticks = ticks
+        # a dropped batch only delays prices until the contract's next tick
+        ticks.add_consumer("options", self.on_ticks)
+
+    def start(self) -> None:
+        if self._task is None:
+            watch = [u.strip() for u in settings.OPTIONS_WATCH.split(",") if u.strip()]
+            self._task = asyncio.create_task(self.run(watch))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {
+            "chains": len(self.chains),
+            "contracts": sum(len(c) for c in self.chains.values()),
+            "dirty": len(self.dirty),
+            "solved": self.solved,
+            "refresh": self.latency.snapshot(),
+        }
+
+
+options_service = OptionChainService()
@@ -0,0 +1,488 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import socket
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core import redis_pool
+from app.core.config import settings
+from app.core.serialization import dumps, loads
+from app.db.session import SessionLocal
+from app.models.trade import Trade, TradeStatus, TradeType
+from app.services.charges import order_charges
+from app.services.instruments import IST
+from app.services.position_book import PositionBookService, position_books
+from app.services.pretrade import PreTradeRiskGate, pretrade_gate
+from app.services.ticker import TickIngestionService
+from app.services.zerodha import zerodha_service
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+# Order updates received by any worker are fanned out to all of them here
+CHANNEL = "orders:updates"
+# and so are the fills a worker books, for workers not tracking that order
+FILLS_CHANNEL = "orders:fills"
+
+TERMINAL = (TradeStatus.EXECUTED, TradeStatus.CANCELLED, TradeStatus.REJECTED)
+KITE_TERMINAL = {"COMPLETE": TradeStatus.EXECUTED, "CANCELLED": TradeStatus.CANCELLED, "REJECTED": TradeStatus.REJECTED}
+
+# Updates for orders not tracked (yet) are kept this long, for postbacks that beat place_order's return
+EARLY_LIMIT = 1000
+# Cumulative fills booked per order, remembered this long so no fill is booked twice
+BOOKED_LIMIT = 10000
+
+
+class Fill(NamedTuple):
+    """One increment of filled quantity; `quantity` is signed (sells negative)"""
+
+    trade_id: int
+    order_id: str
+    user_id: int
+    portfolio_id: int
+    name: str
+    quantity: int
+    price: float
+    status: TradeStatus
+    product: str
+    # the entry's exit levels, for the exit monitor
+    stop_loss: Optional[float] = None
+    target: Optional[float] = None
+    trailing_sl: Optional[float] = None
+
+
+FillListener = Callable[[Fill], Awaitable[None]]
+
+
+class _Order:
+    __slots__ = (
+        "trade_id", "order_id", "user_id", "portfolio_id", "exchange", "symbol", "product",
+        "sign", "quantity", "filled", "average", "status", "reserved", "placed", "updated",
+        "stop_loss", "target", "trailing_sl",
+    )
+
+    def __init__(self, trade: Trade, reserved: bool):
+        self.trade_id = trade.id
+        self.order_id = trade.order_id
+        self.user_id = trade.user_id
+        self.portfolio_id = trade.portfolio_id
+        self.exchange = trade.exchange
+        self.symbol = trade.symbol
+        self.product = trade.product
+        self.sign = 1 if trade.trade_type == TradeType.BUY else -1
+        self.quantity = trade.quantity
+        self.filled = trade.filled_quantity or 0
+        self.average = trade.price if self.filled else 0.0
+        self.status = trade.status
+        self.reserved = reserved
+        self.placed = trade.entry_time or datetime.utcnow()
+        self.updated = time.monotonic()
+        self.stop_loss = trade.stop_loss
+        self.target = trade.target
+        self.trailing_sl = trade.trailing_sl
+
+    @property
+    def name(self) -> str:
+        return f"{self.exchange}:{self.symbol}"
+
+
+def kite_status(data: Dict) -> TradeStatus:
+    """TradeStatus for a Kite order status; every non-final Kite status is OPEN or PARTIALLY_FILLED"""
+    status = KITE_TERMINAL.get(data.get("status"))
+    if status is not None:
+        return status
+    return TradeStatus.PARTIALLY_FILLED if data.get("filled_quantity") else TradeStatus.OPEN
+
+
+def exchange_time(data: Dict) -> datetime:
+    """The update's exchange timestamp (IST) as naive UTC, like the other Trade times"""
+    stamp = data.get("exchange_update_timestamp") or data.get("exchange_timestamp")
+    if isinstance(stamp, str):
+        try:
+            stamp = datetime.fromisoformat(stamp)
+        except ValueError:
+            stamp = None
+    if not isinstance(stamp, datetime):
+        return datetime.utcnow()
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=IST)
+    return stamp.astimezone(IST).replace(tzinfo=None) - IST.utcoffset(None)
+
+
+def verify_postback(data: Dict, api_secret: Optional[str] = None) -> bool:
+    """Kite signs postbacks with sha256(order_id + order_timestamp + api_secret)"""
+    secret = api_secret or settings.KITE_API_SECRET
+    payload = f"{data.get('order_id', '')}{data.get('order_timestamp', '')}{secret}"
+    expected = hashlib.sha256(payload.encode()).hexdigest()
+    return hmac.compare_digest(expected, str(data.get("checksum", "")))
+
+
+class OrderTracker:
+    """
+    Order state machine fed by broker updates instead of assuming that an
+    order fills when it is accepted.
+
+    Trades start PENDING and move to OPEN, PARTIALLY_FILLED and a final
+    EXECUTED, CANCELLED or REJECTED as KiteTicker order updates and
+    postbacks arrive. Updates are idempotent and only ever move an order
+    forward, so duplicates and late arrivals are harmless. Each new fill
+    is booked into the position books and the pre-trade gate straight
+    away and published to listeners. Booked fills are shared with the
+    other workers, which book those of orders they do not track; every
+    worker books each trade's cumulative fill once, whichever path it
+    came by. Trade rows are written in one batch per `flush_interval`. Orders that have gone quiet for `poll_interval`
+    are backfilled from a single orders() call, never one request per
+    order.
+    """
+
+    def __init__(
+        self,
+        flush_interval: Optional[float] = None,
+        poll_interval: Optional[float] = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+        books: Optional[PositionBookService] = None,
+        gate: Optional[PreTradeRiskGate] = None,
+    ):
+        self.flush_interval = flush_interval or settings.ORDER_FLUSH_INTERVAL
+        self.poll_interval = poll_interval or settings.ORDER_POLL_INTERVAL
+        self.session_factory = session_factory
+        self.books = books or position_books
+        self.gate = gate or pretrade_gate
+        self.orders: Dict[str, _Order] = {}
+        self.early: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self.booked: "OrderedDict[str, tuple]" = OrderedDict()
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.listeners: List[FillListener] = []
+        self.updates = 0
+        self.stale = 0
+        self.fills = 0
+        self.shared = 0
+        self.backfills = 0
+        self.write_latency = histogram("orders.write")
+        self._rows: Dict = {}
+        self._fills: List[Fill] = []
+        self._publishing: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def add_listener(self, listener: FillListener) -> None:
+        self.listeners.append(listener)
+
+    # Tracking
+
+    def track(self, trade: Trade, reserved: bool = True) -> None:
+        """
+        Follow a placed order. With `reserved` its quantity is held in the
+        pre-trade gate until it fills or dies.
+        """
+        if not trade.order_id or trade.status in TERMINAL or trade.status == TradeStatus.FAILED:
+            return
+        order = self.orders[trade.order_id] = _Order(trade, reserved)
+        if order.filled and order.order_id not in self.booked:
+            self._remember(order.order_id, order.filled, order.average)
+        for data in self.early.pop(trade.order_id, ()):
+            self._apply(order, data)
+
+    def load(self, db: Session) -> int:
+        """Resume tracking orders left open by a previous run (run once at startup)"""
+        trades = db.query(Trade).filter(
+            Trade.status.in_([TradeStatus.PENDING, TradeStatus.OPEN, TradeStatus.PARTIALLY_FILLED]),
+            Trade.order_id.isnot(None),
+        )
+        count = 0
+        for trade in trades:
+            # the gate was warmed from fills only, so these hold no reservation
+            self.track(trade, reserved=False)
+            count += 1
+        logger.info(f"Order tracker resumed {count} open orders")
+        return count
+
+    # Updates
+
+    def on_update(self, data: Dict) -> None:
+        """Apply one Kite order update (websocket, postback or orders() row)"""
+        order_id = str(data.get("order_id") or "")
+        if not order_id:
+            return
+        self.updates += 1
+        order = self.orders.get(order_id)
+        if order is None:
+            self.early.setdefault(order_id, []).append(data)
+            self.early.move_to_end(order_id)
+            while len(self.early) > EARLY_LIMIT:
+                self.early.popitem(last=False)
+            return
+        self._apply(order, data)
+
+    def receive(self, data: Dict) -> None:
+        """An update from outside (ticker or postback): apply here and share with the other workers"""
+        self.on_update(data)
+        self._spawn(self._share(data))
+
+    async def _share(self, data: Dict) -> None:
+        try:
+            redis = await redis_pool.get_redis()
+            await redis.publish(CHANNEL, dumps(data, "orders"))
+        except Exception as e:
+            logger.warning(f"Could not share order update {data.get('order_id')}: {str(e)}")
+
+    def _apply(self, order: _Order, data: Dict) -> None:
+        if order.status in TERMINAL:
+            self.stale += 1
+            return
+        status = kite_status(data)
+        filled = int(data.get("filled_quantity") or 0)
+        average = float(data.get("average_price") or 0.0)
+        order.updated = time.monotonic()
+
+        if filled > order.filled:
+            order.filled, order.average = filled, average or order.average
+            if status not in TERMINAL:
+                status = TradeStatus.PARTIALLY_FILLED
+            fill = self._book(
+                order.trade_id, order.order_id, order.user_id, order.portfolio_id, order.name, order.sign,
+                order.filled, order.average, status, order.product, order.stop_loss, order.target,
+                order.trailing_sl, order.reserved,
+            )
+            if fill is not None:
+                self._spawn(self._share_fill(fill, order.filled, order.average))
+        elif status not in TERMINAL:
+            # nothing new filled, so a live update can only repeat or lag what is known
+            if filled < order.filled:
+                self.stale += 1
+                return
+            status = TradeStatus.PARTIALLY_FILLED if order.filled else TradeStatus.OPEN
+            if status == order.status:
+                return
+
+        order.status = status
+        # a trade whose row could not be saved when it was placed is written by order id
+        if order.trade_id is not None:
+            row = self._rows.setdefault(order.trade_id, {"id": order.trade_id})
+        else:
+            row = self._rows.setdefault(order.order_id, {"order_id": order.order_id})
+        row["status"] = status
+        if order.filled:
+            side = "BUY" if order.sign > 0 else "SELL"
+            row.update(
+                filled_quantity=order.filled,
+                price=order.average,
+                total_amount=order.filled * order.average,
+                execution_time=exchange_time(data),
+                charges=order_charges(order.exchange, order.symbol, order.product, side, order.filled, order.average),
+            )
+        if status == TradeStatus.REJECTED and data.get("status_message"):
+            row["notes"] = str(data["status_message"])[:500]
+
+        if status in TERMINAL:
+            remaining = order.quantity - order.filled
+            if order.reserved and remaining > 0:
+                self.gate.release(order.user_id, order.name, order.sign * remaining)
+            self.orders.pop(order.order_id, None)
+
+    def _remember(self, order_id: str, filled: int, average: float) -> None:
+        self.booked[order_id] = (filled, average)
+        self.booked.move_to_end(order_id)
+        while len(self.booked) > BOOKED_LIMIT:
+            self.booked.popitem(last=False)
+
+    def _book(
+        self, trade_id: int, order_id: str, user_id: int, portfolio_id: int, name: str, sign: int,
+        filled: int, average: float, status: TradeStatus, product: str,
+        stop_loss: Optional[float], target: Optional[float], trailing_sl: Optional[float], reserved: bool,
+    ) -> Optional[Fill]:
+        """Book an order's cumulative fill past what this worker has booked; returns the new Fill"""
+        done, paid = self.booked.get(order_id, (0, 0.0))
+        if filled <= done:
+            return None
+        # the price of just this increment, from the change in average
+        increment = filled - done
+        price = (average * filled - paid * done) / increment if average else paid
+        self._remember(order_id, filled, average or paid)
+        signed = sign * increment
+        self.gate.on_fill(user_id, name, signed, price, reserved=reserved)
+        self.books.on_fill(portfolio_id, name, signed, price)
+        self.fills += 1
+        fill = Fill(
+            trade_id, order_id, user_id, portfolio_id, name, signed, price, status, product,
+            stop_loss, target, trailing_sl,
+        )
+        self._fills.append(fill)
+        if self.listeners and (self._publishing is None or self._publishing.done()):
+            self._publishing = self._spawn(self.publish())
+        return fill
+
+    def _spawn(self, coro) -> Optional[asyncio.Task]:
+        try:
+            return asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            return None
+
+    async def _share_fill(self, fill: Fill, filled: int, average: float) -> None:
+        data = fill._asdict()
+        data.update(status=fill.status.value, filled=filled, average=average, worker=self.worker)
+        try:
+            redis = await redis_pool.get_redis()
+            await redis.publish(FILLS_CHANNEL, dumps(data, "orders"))
+        except Exception as e:
+            logger.warning(f"Could not share fill of trade {fill.trade_id}: {str(e)}")
+
+    def on_shared_fill(self, data: Dict) -> None:
+        """Book a fill another worker booked, unless this worker already has it"""
+        if data.get("worker") == self.worker:
+            return
+        order = self.orders.get(data["order_id"])
+        self.shared += 1
+        self._book(
+            data["trade_id"], data["order_id"], data["user_id"], data["portfolio_id"], data["name"],
+            1 if data["quantity"] > 0 else -1, data["filled"], data["average"], TradeStatus(data["status"]),
+            data["product"], data.get("stop_loss"), data.get("target"), data.get("trailing_sl"),
+            order.reserved if order is not None else False,
+        )
+
+    async def publish(self) -> None:
+        while self._fills:
+            fills, self._fills = self._fills, []
+            for fill in fills:
+                for listener in self.listeners:
+                    try:
+                        await listener(fill)
+                    except Exception as e:
+                        logger.error(f"Fill listener failed: {str(e)}")
+
+    # Writes and backfill
+
+    def _write(self, rows: List[Dict]) -> None:
+        db = self.session_factory()
+        try:
+            db.bulk_update_mappings(Trade, [row for row in rows if "id" in row])
+            for row in rows:
+                if "id" not in row:
+                    values = {k: v for k, v in row.items() if k != "order_id"}
+                    db.query(Trade).filter(Trade.order_id == row["order_id"]).update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def flush(self) -> int:
+        """Write every changed Trade row in one batch; returns how many"""
+        rows, self._rows = list(self._rows.values()), {}
+        if not rows:
+            return 0
+        started = time.perf_counter()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+        except Exception:
+            # keep them for the next flush unless newer values arrived meanwhile
+            for row in rows:
+                self._rows.setdefault(row.get("id", row.get("order_id")), row)
+            raise
+        self.write_latency.record(time.perf_counter() - started)
+        return len(rows)
+
+    async def backfill(self, force: bool = False) -> int:
+        """Catch up orders without a recent update from one orders() call; returns how many changed"""
+        cutoff = time.monotonic() - self.poll_interval
+        if not force and not any(o.updated < cutoff for o in self.orders.values()):
+            return 0
+        self.backfills += 1
+        before = {order_id: (o.status, o.filled) for order_id, o in self.orders.items()}
+        rows = await zerodha_service.orders()
+        seen = set()
+        for data in rows:
+            order_id = str(data.get("order_id") or "")
+            if order_id in self.orders:
+                seen.add(order_id)
+                self._apply(self.orders[order_id], data)
+        # orders() only lists today's orders; older ones still open have expired
+        today = datetime.now(IST).date()
+        for order_id, order in list(self.orders.items()):
+            if order_id not in seen and (order.placed + IST.utcoffset(None)).date() < today:
+                self._apply(order, {"order_id": order_id, "status": "CANCELLED", "filled_quantity": order.filled,
+                                    "average_price": order.average, "status_message": "Expired"})
+        return sum(
+            1 for order_id, state in before.items()
+            if order_id not in self.orders or (self.orders[order_id].status, self.orders[order_id].filled) != state
+        )
+
+    async def listen(self) -> None:
+        """Apply updates that other workers received and book the fills they booked"""
+        while True:
+            try:
+                pubsub = (await redis_pool.get_redis()).pubsub()
+                await pubsub.subscribe(CHANNEL, FILLS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    if channel == FILLS_CHANNEL:
+                        self.on_shared_fill(loads(message["data"], "orders"))
+                    else:
+                        self.on_update(loads(message["data"], "orders"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Order update channel failed: {str(e)}")
+                await asyncio.sleep(5.0)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error writing order updates: {str(e)}")
+
+    async def _backfill_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.backfill()
+            except Exception as e:
+                logger.error(f"Error backfilling orders: {str(e)}")
+
+    def attach(self, ticks: TickIngestionService) -> None:
+        ticks.order_update_handlers.append(self.receive)
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self.listen()),
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._backfill_loop()),
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._publishing is not None:
+            await asyncio.gather(self._publishing, return_exceptions=True)
+        await self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            "open": len(self.orders),
+            "updates": self.updates,
+            "stale": self.stale,
+            "fills": self.fills,
+            "shared": self.shared,
+            "backfills": self.backfills,
+            "unwritten": len(self._rows),
+            "write": self.write_latency.snapshot(),
+        }
+
+
+order_tracker = OrderTracker()
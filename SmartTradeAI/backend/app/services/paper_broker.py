@@ -0,0 +1,367 @@
+import asyncio
+import itertools
+import math
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from app.core.config import settings
+from app.services.instruments import IST
+from app.services.kite_client import KiteError, _instrument_list
+from app.services.ticker import BarReplaySource, ReplayTickSource, Tick, TickIngestionService
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+ORDER_TYPES = ("MARKET", "LIMIT", "SL", "SL-M")
+
+
+def _stamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts, IST).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SimulatedBroker:
+    """
+    Paper-trading broker with the interface of AsyncKiteClient, so it can
+    stand in for `zerodha_service` without any caller changing.
+
+    Orders rest in a matching engine driven by the tick stream (live,
+    recorded or replayed from bars). An order may match from the first
+    tick at least `latency` seconds of market time after it was placed.
+    Market orders, and limit orders once marketable, fill at the tick
+    price moved against the order by `slippage_bps` (never through a
+    limit); SL and SL-M orders wait for their trigger. Each tick offers
+    `participation` of the volume traded since the previous tick, so large
+    orders fill in parts; with 0, or without volume, they fill at once.
+    Every state change is sent to the ticker's order update handlers, as
+    Kite's websocket would, so the order tracker sees paper orders like
+    real ones.
+    """
+
+    def __init__(
+        self,
+        capital: Optional[float] = None,
+        slippage_bps: Optional[float] = None,
+        latency: Optional[float] = None,
+        participation: Optional[float] = None,
+        api_latency: float = 0.0,
+        prices: Optional[Dict[str, float]] = None,
+        instruments_path: Optional[str] = None,
+    ):
+        self.capital = settings.PAPER_CAPITAL if capital is None else capital
+        self.slippage = (settings.PAPER_SLIPPAGE_BPS if slippage_bps is None else slippage_bps) / 1e4
+        self.latency = settings.PAPER_LATENCY if latency is None else latency
+        self.participation = settings.PAPER_PARTICIPATION if participation is None else participation
+        self.api_latency = api_latency
+        self.instruments_path = instruments_path if instruments_path is not None else settings.PAPER_INSTRUMENTS_CSV
+        self.prices: Dict[str, float] = dict(prices or {})
+        self.ohlc: Dict[str, List[float]] = {}
+        self.volumes: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {}
+        self.clock = 0.0
+        self.orders: Dict[str, Dict] = {}
+        self.working: Dict[str, List[str]] = {}
+        self.net: Dict[Tuple[str, str], Dict] = {}
+        self.ticks: Optional[TickIngestionService] = None
+        self.fills = 0
+        self.match_latency = histogram("paper.match")
+        self._active_at: Dict[str, float] = {}
+        self._ids = itertools.count(1)
+
+    # Session, like AsyncKiteClient
+
+    def set_access_token(self, access_token: str) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def now(self) -> float:
+        """Market time: the latest tick's timestamp, or the wall clock before any tick"""
+        return self.clock or time.time()
+
+    # Orders
+
+    async def place_order(
+        self,
+        tradingsymbol: str,
+        exchange: str,
+        transaction_type: str,
+        quantity: int,
+        product: str,
+        order_type: str,
+        variety: str = "regular",
+        **params,
+    ) -> str:
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        quantity = int(quantity)
+        price = float(params.get("price") or 0.0)
+        trigger = float(params.get("trigger_price") or 0.0)
+        if transaction_type not in ("BUY", "SELL"):
+            raise KiteError("Invalid transaction type", 400, "InputException")
+        if order_type not in ORDER_TYPES:
+            raise KiteError(f"Invalid order type {order_type}", 400, "InputException")
+        if quantity <= 0:
+            raise KiteError("Invalid quantity", 400, "InputException")
+        if order_type in ("LIMIT", "SL") and price <= 0:
+            raise KiteError("Invalid price", 400, "InputException")
+        if order_type in ("SL", "SL-M") and trigger <= 0:
+            raise KiteError("Invalid trigger price", 400, "InputException")
+
+        order_id = f"PAPER{next(self._ids):012d}"
+        name = f"{exchange}:{tradingsymbol}"
+        now = self.now()
+        order = self.orders[order_id] = {
+            "order_id": order_id,
+            "variety": variety,
+            "status": "TRIGGER PENDING" if order_type in ("SL", "SL-M") else "OPEN",
+            "tradingsymbol": tradingsymbol,
+            "exchange": exchange,
+            "instrument_token": self.tokens.get(name, 0),
+            "transaction_type": transaction_type,
+            "order_type": order_type,
+            "product": product,
+            "quantity": quantity,
+            "filled_quantity": 0,
+            "pending_quantity": quantity,
+            "cancelled_quantity": 0,
+            "price": price,
+            "trigger_price": trigger,
+            "average_price": 0.0,
+            "tag": params.get("tag"),
+            "status_message": None,
+            "order_timestamp": _stamp(now),
+            "exchange_timestamp": _stamp(now),
+        }
+        self.working.setdefault(name, []).append(order_id)
+        self._active_at[order_id] = now + self.latency
+        self._notify(order)
+        if not self.latency and name in self.prices:
+            # nothing to wait for: try the last price straight away
+            self._match(name, self.prices[name], None)
+        return order_id
+
+    async def cancel_order(self, order_id: str, variety: str = "regular") -> str:
+        order = self.orders.get(order_id)
+        if order is None:
+            raise KiteError("Order not found", 400, "InputException")
+        if order["status"] in ("OPEN", "TRIGGER PENDING"):
+            self._close(order, "CANCELLED")
+        return order_id
+
+    async def orders(self) -> List[Dict]:
+        return [dict(o) for o in self.orders.values()]
+
+    async def order_history(self, order_id: str) -> List[Dict]:
+        order = self.orders.get(order_id)
+        if order is None:
+            raise KiteError("Order not found", 400, "InputException")
+        return [dict(order)]
+
+    # Portfolio
+
+    async def profile(self) -> Dict:
+        return {"user_id": "PAPER", "user_name": "Paper trading", "broker": "PAPER"}
+
+    async def margins(self, segment: Optional[str] = None) -> Dict:
+        realised = sum(p["realised"] for p in self.net.values())
+        used = sum(abs(p["quantity"]) * p["average_price"] for p in self.net.values())
+        equity = {"net": self.capital + realised - used, "utilised": {"debits": used}}
+        return equity if segment == "equity" else {"equity": equity}
+
+    async def positions(self) -> Dict[str, List[Dict]]:
+        net = []
+        for (name, _), position in self.net.items():
+            ltp = self.prices.get(name, position["average_price"])
+            unrealised = position["quantity"] * (ltp - position["average_price"])
+            net.append({
+                **position,
+                "last_price": ltp,
+                "value": position["quantity"] * ltp,
+                "pnl": position["realised"] + unrealised,
+                "unrealised": unrealised,
+            })
+        return {"net": net, "day": net}
+
+    async def get_positions(self) -> List[Dict]:
+        return (await self.positions()).get("net", [])
+
+    async def get_holdings(self) -> List[Dict]:
+        # a paper account starts flat; delivery buys show in positions
+        return []
+
+    # Market data, from the ticks seen so far
+
+    async def ltp(self, instruments: Union[str, Iterable[str]]) -> Dict[str, Dict]:
+        return {
+            name: {"instrument_token": self.tokens.get(name, 0), "last_price": self.prices[name]}
+            for name in _instrument_list(instruments) if name in self.prices
+        }
+
+    async def ohlc(self, instruments: Union[str, Iterable[str]]) -> Dict[str, Dict]:
+        data = await self.ltp(instruments)
+        for name, quote in data.items():
+            o, h, l, c = self.ohlc.get(name, [quote["last_price"]] * 4)
+            quote["ohlc"] = {"open": o, "high": h, "low": l, "close": c}
+        return data
+
+    async def quote(self, instruments: Union[str, Iterable[str]]) -> Dict[str, Dict]:
+        data = await self.ohlc(instruments)
+        for name, quote in data.items():
+            quote["volume"] = self.volumes.get(name, 0.0)
+        return data
+
+    async def historical_data(self, instrument_token: int, from_date: str, to_date: str, interval: str, **kwargs) -> Dict:
+        raise KiteError("Historical data is not available in paper trading", 400, "GeneralException")
+
+    async def instruments(self, exchange: Optional[str] = None) -> str:
+        """The instrument dump from PAPER_INSTRUMENTS_CSV, e.g. one saved from a live session"""
+        if not self.instruments_path:
+            raise KiteError("No instrument dump configured for paper trading", 400, "GeneralException")
+        with open(self.instruments_path) as f:
+            return f.read()
+
+    # Matching
+
+    def _notify(self, order: Dict) -> None:
+        if self.ticks is None:
+            return
+        update = dict(order)
+        for handler in self.ticks.order_update_handlers:
+            try:
+                handler(update)
+            except Exception as e:
+                logger.error(f"Error handling paper order update: {str(e)}")
+
+    def _close(self, order: Dict, status: str, message: Optional[str] = None) -> None:
+        order["status"] = status
+        if status != "COMPLETE":
+            order["cancelled_quantity"] = order["pending_quantity"]
+        order["pending_quantity"] = 0
+        order["status_message"] = message
+        order["exchange_timestamp"] = _stamp(self.now())
+        name = f"{order['exchange']}:{order['tradingsymbol']}"
+        working = self.working.get(name)
+        if working and order["order_id"] in working:
+            working.remove(order["order_id"])
+        self._active_at.pop(order["order_id"], None)
+        self._notify(order)
+
+    def _book(self, order: Dict, quantity: int, price: float) -> None:
+        name = f"{order['exchange']}:{order['tradingsymbol']}"
+        key = (name, order["product"])
+        position = self.net.get(key)
+        if position is None:
+            position = self.net[key] = {
+                "tradingsymbol": order["tradingsymbol"], "exchange": order["exchange"],
+                "product": order["product"], "quantity": 0, "average_price": 0.0, "realised": 0.0,
+                "buy_quantity": 0, "sell_quantity": 0, "buy_value": 0.0, "sell_value": 0.0,
+            }
+        signed = quantity if order["transaction_type"] == "BUY" else -quantity
+        side = "buy" if signed > 0 else "sell"
+        position[f"{side}_quantity"] += quantity
+        position[f"{side}_value"] += quantity * price
+        held = position["quantity"]
+        if held and (held > 0) != (signed > 0):
+            closed = min(abs(held), quantity)
+            position["realised"] += closed * (price - position["average_price"]) * (1 if held > 0 else -1)
+            if quantity > abs(held):
+                position["average_price"] = price
+            elif quantity == abs(held):
+                position["average_price"] = 0.0
+        else:
+            position["average_price"] = (held * position["average_price"] + signed * price) / (held + signed)
+        position["quantity"] = held + signed
+
+    def _fill(self, order: Dict, quantity: int, price: float) -> None:
+        filled = order["filled_quantity"]
+        order["average_price"] = (order["average_price"] * filled + price * quantity) / (filled + quantity)
+        order["filled_quantity"] = filled + quantity
+        order["pending_quantity"] -= quantity
+        self._book(order, quantity, price)
+        self.fills += 1
+        if order["pending_quantity"] <= 0:
+            self._close(order, "COMPLETE")
+        else:
+            order["exchange_timestamp"] = _stamp(self.now())
+            self._notify(order)
+
+    def _match(self, name: str, ltp: float, available: Optional[float]) -> None:
+        """Match the working orders of one instrument against a trade at `ltp`"""
+        for order_id in list(self.working.get(name, ())):
+            order = self.orders[order_id]
+            if self._active_at.get(order_id, 0.0) > self.now():
+                continue
+            buy = order["transaction_type"] == "BUY"
+            if order["status"] == "TRIGGER PENDING":
+                if (ltp >= order["trigger_price"]) if buy else (ltp <= order["trigger_price"]):
+                    order["status"] = "OPEN"
+                    self._notify(order)
+                else:
+                    continue
+            price = ltp * (1 + self.slippage) if buy else ltp * (1 - self.slippage)
+            if order["order_type"] in ("LIMIT", "SL"):
+                limit = order["price"]
+                if (ltp > limit) if buy else (ltp < limit):
+                    continue
+                price = min(price, limit) if buy else max(price, limit)
+            quantity = order["pending_quantity"]
+            if available is not None:
+                quantity = min(quantity, int(available))
+                if quantity <= 0:
+                    break
+                available -= quantity
+            self._fill(order, quantity, round(price, 2))
+
+    async def on_ticks(self, ticks: List[Tick]) -> None:
+        started = time.perf_counter()
+        for tick in ticks:
+            name = self.ticks.symbols.get(tick.token) if self.ticks is not None else None
+            if name is None:
+                continue
+            self.tokens[name] = tick.token
+            self.clock = max(self.clock, tick.ts)
+            self.prices[name] = tick.ltp
+            bar = self.ohlc.get(name)
+            if bar is None:
+                self.ohlc[name] = [tick.ltp] * 4
+            else:
+                bar[1], bar[2], bar[3] = max(bar[1], tick.ltp), min(bar[2], tick.ltp), tick.ltp
+            traded = tick.volume - self.volumes.get(name, tick.volume)
+            self.volumes[name] = tick.volume
+            if self.working.get(name):
+                available = None
+                if self.participation and traded > 0:
+                    available = max(1, math.floor(traded * self.participation))
+                self._match(name, tick.ltp, available)
+        self.match_latency.record(time.perf_counter() - started)
+
+    def attach(self, ticks: TickIngestionService) -> None:
+        self.ticks = ticks
+        # a dropped batch would lose fills the strategies are waiting on
+        ticks.add_consumer("paper", self.on_ticks, lossless=True)
+
+    def stats(self) -> Dict:
+        return {
+            "orders": len(self.orders),
+            "working": sum(len(ids) for ids in self.working.values()),
+            "fills": self.fills,
+            "positions": sum(1 for p in self.net.values() if p["quantity"]),
+            "clock": _stamp(self.now()),
+            "match": self.match_latency.snapshot(),
+        }
+
+
+def replay_source():
+    """The tick source for a paper session: a recording, stored bars, or (None) the live ticker"""
+    if settings.PAPER_REPLAY_PATH:
+        return ReplayTickSource.from_file(settings.PAPER_REPLAY_PATH, speed=settings.PAPER_REPLAY_SPEED)
+    if settings.PAPER_REPLAY_SYMBOLS:
+        return BarReplaySource(
+            [s.strip() for s in settings.PAPER_REPLAY_SYMBOLS.split(",") if s.strip()],
+            interval=settings.PAPER_REPLAY_INTERVAL,
+            speed=settings.PAPER_REPLAY_SPEED,
+            start=settings.PAPER_REPLAY_START or None,
+            end=settings.PAPER_REPLAY_END or None,
+        )
+    return None
@@ -0,0 +1,294 @@
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.portfolio import Portfolio
+from app.services.prices import price_service
+from app.services.ticker import Tick, TickIngestionService
+from app.services.zerodha import zerodha_service
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+
+class PositionBook:
+    """
+    Net positions of one portfolio as parallel NumPy vectors.
+
+    Each instrument owns a slot in `qty` (signed), `avg` (average cost) and
+    `ltp`. Fills and price marks touch one slot; valuation is a dot product
+    over all of them.
+    """
+
+    def __init__(self, portfolio_id: int, capacity: int = 64):
+        self.portfolio_id = portfolio_id
+        self.index: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.qty = np.zeros(capacity)
+        self.avg = np.zeros(capacity)
+        self.ltp = np.zeros(capacity)
+        self.realized = 0.0
+        self.risk: Dict = {}
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def slot(self, name: str) -> int:
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+            if i == len(self.qty):
+                self.qty, self.avg, self.ltp = (
+                    np.concatenate([a, np.zeros(len(a))]) for a in (self.qty, self.avg, self.ltp)
+                )
+        return i
+
+    def apply_fill(self, name: str, quantity: float, price: float) -> None:
+        """Book a fill; `quantity` is positive for buys and negative for sells"""
+        i = self.slot(name)
+        held = self.qty[i]
+        if held == 0 or (held > 0) == (quantity > 0):
+            total = held + quantity
+            self.avg[i] = (held * self.avg[i] + quantity * price) / total
+            self.qty[i] = total
+        else:
+            closed = min(abs(held), abs(quantity))
+            self.realized += float(closed * (price - self.avg[i]) * (1 if held > 0 else -1))
+            total = held + quantity
+            if total == 0:
+                self.avg[i] = 0.0
+            elif (total > 0) != (held > 0):
+                # flipped through flat; the remainder opens at the fill price
+                self.avg[i] = price
+            self.qty[i] = total
+        self.ltp[i] = price
+        self.dirty = True
+
+    def mark(self, name: str, price: float) -> None:
+        i = self.index.get(name)
+        if i is not None and self.ltp[i] != price:
+            self.ltp[i] = price
+            if self.qty[i]:
+                self.dirty = True
+
+    def load(self, positions: Iterable[Dict]) -> None:
+        """Replace the book with a broker snapshot of positions and holdings"""
+        self.index, self.names = {}, []
+        self.qty[:] = 0.0
+        self.avg[:] = 0.0
+        self.ltp[:] = 0.0
+        realized = 0.0
+        for p in positions:
+            quantity = float(p.get("quantity", 0) or 0) + float(p.get("t1_quantity", 0) or 0)
+            i = self.slot(f"{p.get('exchange', 'NSE')}:{p['tradingsymbol']}")
+            total = self.qty[i] + quantity
+            if total:
+                self.avg[i] = (self.qty[i] * self.avg[i] + quantity * float(p.get("average_price", 0) or 0)) / total
+            self.qty[i] = total
+            self.ltp[i] = float(p.get("last_price", 0) or 0) or self.ltp[i]
+            realized += float(p.get("realised", 0) or 0)
+        self.realized = realized
+        self.dirty = True
+
+    def valuation(self) -> Dict[str, float]:
+        n = len(self.names)
+        qty, avg, ltp = self.qty[:n], self.avg[:n], self.ltp[:n]
+        value = float(qty @ ltp)
+        return {
+            "total_value": value,
+            "unrealized_pnl": value - float(qty @ avg),
+            "realized_pnl": self.realized,
+        }
+
+    def exposures(self) -> np.ndarray:
+        n = len(self.names)
+        return np.abs(self.qty[:n] * self.ltp[:n])
+
+    def risk_summary(self) -> Dict:
+        exposures = self.exposures()
+        total = float(exposures.sum())
+        largest = float(exposures.max()) if len(exposures) else 0.0
+        return {
+            "total_exposure": total,
+            "largest_position": largest,
+            "position_count": int(np.count_nonzero(self.qty[:len(self.names)])),
+            "concentration": largest / total if total else 0,
+            **self.risk,
+        }
+
+    def positions(self) -> List[Dict]:
+        return [
+            {
+                "symbol": name,
+                "quantity": float(self.qty[i]),
+                "average_price": float(self.avg[i]),
+                "last_price": float(self.ltp[i]),
+                "value": float(self.qty[i] * self.ltp[i]),
+                "unrealized_pnl": float(self.qty[i] * (self.ltp[i] - self.avg[i])),
+            }
+            for i, name in enumerate(self.names)
+            if self.qty[i]
+        ]
+
+
+class PositionBookService:
+    """
+    In-memory position books for every active portfolio.
+
+    Fills and ticks update the books as they happen. Dirty books are written
+    to their Portfolio rows every `persist_interval` seconds in one batch,
+    and the broker's positions and holdings are pulled only every
+    `reconcile_interval` seconds to correct any drift.
+    """
+
+    def __init__(
+        self,
+        persist_interval: Optional[float] = None,
+        reconcile_interval: Optional[float] = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ):
+        self.persist_interval = persist_interval or settings.PORTFOLIO_PERSIST_INTERVAL
+        self.reconcile_interval = reconcile_interval or settings.PORTFOLIO_RECONCILE_INTERVAL
+        self.session_factory = session_factory
+        self.books: Dict[int, PositionBook] = {}
+        self.holders: Dict[str, List[PositionBook]] = {}
+        self.symbols: Dict[int, str] = {}
+        self.mtm_latency = histogram("portfolio.mark_to_market")
+        self._unreconciled: set = set()
+        self._tasks: List[asyncio.Task] = []
+
+    def book(self, portfolio_id: int) -> PositionBook:
+        book = self.books.get(portfolio_id)
+        if book is None:
+            book = self.books[portfolio_id] = PositionBook(portfolio_id)
+            self._unreconciled.add(portfolio_id)
+        return book
+
+    def _index(self, book: PositionBook) -> None:
+        for name in book.names:
+            holders = self.holders.setdefault(name, [])
+            if book not in holders:
+                holders.append(book)
+
+    def on_fill(self, portfolio_id: int, name: str, quantity: float, price: float) -> None:
+        """Book an executed order; `quantity` is signed (sells negative)"""
+        book = self.book(portfolio_id)
+        book.apply_fill(name, quantity, price)
+        holders = self.holders.setdefault(name, [])
+        if book not in holders:
+            holders.append(book)
+
+    def mark(self, name: str, price: float) -> None:
+        for book in self.holders.get(name, ()):
+            book.mark(name, price)
+
+    async def on_ticks(self, ticks: List[Tick]) -> None:
+        for tick in ticks:
+            name = self.symbols.get(tick.token)
+            if name is not None:
+                self.mark(name, tick.ltp)
+
+    def attach(self, ticks: TickIngestionService) -> None:
+        self.symbols = ticks.symbols
+        # only the latest price matters, so this consumer may shed load
+        ticks.add_consumer("positions", self.on_ticks)
+
+    def snapshot(self, portfolio_id: int) -> Dict:
+        book = self.book(portfolio_id)
+        with self.mtm_latency.time():
+            valuation = book.valuation()
+        valuation["positions"] = book.positions()
+        return valuation
+
+    async def refresh_prices(self) -> None:
+        """Mark names that are not streaming; one batched LTP call at most"""
+        names = [name for name, holders in self.holders.items() if holders]
+        if not names:
+            return
+        for name, price in (await price_service.get_ltp(names)).items():
+            self.mark(name, price)
+
+    async def reconcile(self, portfolio_ids: Optional[Iterable[int]] = None) -> None:
+        """Reload books from the broker; one positions+holdings pull covers every book"""
+        ids = list(self.books if portfolio_ids is None else portfolio_ids)
+        if not ids:
+            return
+        positions, holdings = await asyncio.gather(
+            zerodha_service.get_positions(), zerodha_service.get_holdings()
+        )
+        for portfolio_id in ids:
+            book = self.book(portfolio_id)
+            book.load(holdings + positions)
+            self._unreconciled.discard(portfolio_id)
+        self.holders = {}
+        for book in self.books.values():
+            self._index(book)
+
+    def _rows(self) -> List[Dict]:
+        rows = []
+        with self.mtm_latency.time():
+            for book in self.books.values():
+                if book.dirty:
+                    book.dirty = False
+                    row = book.valuation()
+                    row["id"] = book.portfolio_id
+                    row["risk_metrics"] = book.risk_summary()
+                    rows.append(row)
+        return rows
+
+    def _write(self, rows: List[Dict]) -> None:
+        db = self.session_factory()
+        try:
+            db.bulk_update_mappings(Portfolio, rows)
+            db.commit()
+        finally:
+            db.close()
+
+    async def persist(self) -> None:
+        rows = self._rows()
+        if rows:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, rows)
+
+    async def _persist_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            try:
+                if self._unreconciled:
+                    await self.reconcile(list(self._unreconciled))
+                await self.refresh_prices()
+                await self.persist()
+            except Exception as e:
+                logger.error(f"Error persisting portfolios: {str(e)}")
+
+    async def _reconcile_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            try:
+                started = time.perf_counter()
+                await self.reconcile()
+                logger.debug(f"Reconciled {len(self.books)} portfolios in {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                logger.error(f"Error reconciling portfolios: {str(e)}")
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.create_task(self._persist_loop()),
+                asyncio.create_task(self._reconcile_loop()),
+            ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.persist()
+
+
+position_books = PositionBookService()
@@ -0,0 +1,266 @@
+import time
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.trade import Trade, TradeStatus, TradeType
+from app.services.prices import PriceService, price_service
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+
+class RiskRejected(ValueError):
+    def __init__(self, code: str, message: str):
+        super().__init__(message)
+        self.code = code
+
+
+class RiskLimits:
+    """Per-user pre-trade limits; zero disables a limit"""
+
+    __slots__ = (
+        "max_position_qty", "max_order_notional", "max_gross_notional",
+        "max_concentration", "concentration_floor", "max_daily_loss",
+        "price_band", "orders_per_second",
+    )
+
+    def __init__(self, **overrides):
+        self.max_position_qty = settings.PRETRADE_MAX_POSITION_QTY
+        self.max_order_notional = settings.PRETRADE_MAX_ORDER_NOTIONAL
+        self.max_gross_notional = settings.PRETRADE_MAX_GROSS_NOTIONAL
+        self.max_concentration = settings.PRETRADE_MAX_CONCENTRATION
+        self.concentration_floor = settings.PRETRADE_CONCENTRATION_FLOOR
+        self.max_daily_loss = settings.PRETRADE_MAX_DAILY_LOSS
+        self.price_band = settings.PRETRADE_PRICE_BAND
+        self.orders_per_second = settings.PRETRADE_ORDERS_PER_SECOND
+        for name, value in overrides.items():
+            setattr(self, name, value)
+
+
+class _Position:
+    __slots__ = ("qty", "pending", "avg", "notional")
+
+    def __init__(self):
+        self.qty = 0.0
+        self.pending = 0.0
+        self.avg = 0.0
+        self.notional = 0.0
+
+
+class _UserState:
+    __slots__ = ("positions", "gross", "realized", "day", "tokens", "refilled")
+
+    def __init__(self, burst: float):
+        self.positions: Dict[str, _Position] = {}
+        self.gross = 0.0
+        self.realized = 0.0
+        self.day = date.today()
+        self.tokens = burst
+        self.refilled = time.monotonic()
+
+
+class PreTradeRiskGate:
+    """
+    Limit checks in front of the broker.
+
+    Everything a check needs lives in memory: net and in-flight quantity per
+    symbol, gross notional and today's realized P&L per user, plus a token
+    bucket for the order rate. Prices come from the price cache without any
+    I/O. A passing check reserves its quantity until the order fills
+    (`on_fill`) or fails (`release`), so concurrent orders cannot jointly
+    breach a limit.
+    """
+
+    def __init__(self, prices: Optional[PriceService] = None):
+        self.prices = prices or price_service
+        self.default_limits = RiskLimits()
+        self.limits: Dict[int, RiskLimits] = {}
+        self.users: Dict[int, _UserState] = {}
+        self.rejections: Dict[str, int] = defaultdict(int)
+        self.latency = histogram("pretrade.check")
+
+    def set_limits(self, user_id: int, **overrides) -> RiskLimits:
+        limits = self.limits[user_id] = RiskLimits(**overrides)
+        return limits
+
+    def _state(self, user_id: int, limits: RiskLimits) -> _UserState:
+        state = self.users.get(user_id)
+        if state is None:
+            state = self.users[user_id] = _UserState(max(1.0, limits.orders_per_second))
+        elif state.day != date.today():
+            state.day = date.today()
+            state.realized = 0.0
+        return state
+
+    def _reject(self, code: str, message: str) -> None:
+        self.rejections[code] += 1
+        raise RiskRejected(code, message)
+
+    def check(
+        self,
+        user_id: int,
+        name: str,
+        quantity: float,
+        price: Optional[float] = None,
+        order_type: str = "MARKET",
+        throttle: bool = True,
+    ) -> None:
+        """
+        Raise RiskRejected if the order breaches a limit, otherwise reserve it.
+        `quantity` is signed (sells negative); `name` is "EXCHANGE:SYMBOL".
+        With `throttle` off the order does not count against the order rate,
+        for the later legs of a basket.
+        """
+        started = time.perf_counter()
+        try:
+            self._check(user_id, name, quantity, price, order_type, throttle)
+        finally:
+            self.latency.record(time.perf_counter() - started)
+
+    def _check(
+        self, user_id: int, name: str, quantity: float, price: Optional[float], order_type: str, throttle: bool
+    ) -> None:
+        limits = self.limits.get(user_id, self.default_limits)
+        state = self._state(user_id, limits)
+        throttle = throttle and bool(limits.orders_per_second)
+
+        if throttle:
+            now = time.monotonic()
+            burst = max(1.0, limits.orders_per_second)
+            state.tokens = min(burst, state.tokens + (now - state.refilled) * limits.orders_per_second)
+            state.refilled = now
+            if state.tokens < 1:
+                self._reject("rate", f"More than {limits.orders_per_second:g} orders per second")
+
+        ltp = self.prices.cached_ltp(name)
+        if price and ltp and order_type != "MARKET" and limits.price_band:
+            if abs(price / ltp - 1) > limits.price_band:
+                self._reject(
+                    "price_band",
+                    f"{name} price {price:g} is more than {limits.price_band:.0%} away from LTP {ltp:g}",
+                )
+        reference = ltp or price or 0.0
+        # without a price notional limits would pass anything
+        if not reference and (limits.max_order_notional or limits.max_gross_notional):
+            self._reject("no_price", f"No price for {name} to check notional limits against")
+
+        notional = abs(quantity) * reference
+        if limits.max_order_notional and notional > limits.max_order_notional:
+            self._reject("order_notional", f"Order value {notional:,.0f} exceeds {limits.max_order_notional:,.0f}")
+
+        position = state.positions.get(name)
+        held = position.qty + position.pending if position is not None else 0.0
+        after = held + quantity
+        # orders that only shrink a position are never blocked by exposure limits
+        if abs(after) > abs(held) or (after and (after > 0) != (held > 0)):
+            if limits.max_position_qty and abs(after) > limits.max_position_qty:
+                self._reject("position", f"{name} position {after:g} exceeds {limits.max_position_qty:g}")
+            exposure = abs(after) * reference
+            gross = state.gross - (position.notional if position is not None else 0.0) + exposure
+            if limits.max_gross_notional and gross > limits.max_gross_notional:
+                self._reject("gross_notional", f"Gross exposure {gross:,.0f} exceeds {limits.max_gross_notional:,.0f}")
+            if (
+                limits.max_concentration
+                and gross > 0
+                and gross >= limits.concentration_floor
+                and exposure / gross > limits.max_concentration
+            ):
+                self._reject(
+                    "concentration",
+                    f"{name} would be {exposure / gross:.0%} of exposure, above {limits.max_concentration:.0%}",
+                )
+            if limits.max_daily_loss:
+                pnl = state.realized + self._unrealized(state)
+                if pnl <= -limits.max_daily_loss:
+                    self._reject("daily_loss", f"Daily loss {-pnl:,.0f} has reached {limits.max_daily_loss:,.0f}")
+
+        if throttle:
+            state.tokens -= 1
+        if position is None:
+            position = state.positions[name] = _Position()
+        position.pending += quantity
+        self._set_notional(state, position, reference)
+
+    def _unrealized(self, state: _UserState) -> float:
+        pnl = 0.0
+        for name, position in state.positions.items():
+            if position.qty:
+                ltp = self.prices.cached_ltp(name)
+                if ltp:
+                    pnl += position.qty * (ltp - position.avg)
+        return pnl
+
+    def _set_notional(self, state: _UserState, position: _Position, price: float) -> None:
+        notional = abs(position.qty + position.pending) * price
+        state.gross += notional - position.notional
+        position.notional = notional
+
+    def release(self, user_id: int, name: str, quantity: float) -> None:
+        """Drop the reservation of an order that was not placed"""
+        state = self.users.get(user_id)
+        position = state.positions.get(name) if state is not None else None
+        if position is not None:
+            position.pending -= quantity
+            self._set_notional(state, position, self.prices.cached_ltp(name) or position.avg)
+
+    def on_fill(self, user_id: int, name: str, quantity: float, price: float, reserved: bool = True) -> None:
+        """Move a filled order from reserved into the net position, booking realized P&L"""
+        if not quantity:
+            return
+        limits = self.limits.get(user_id, self.default_limits)
+        state = self._state(user_id, limits)
+        position = state.positions.get(name)
+        if position is None:
+            position = state.positions[name] = _Position()
+        if reserved:
+            position.pending -= quantity
+        held = position.qty
+        if held and (held > 0) != (quantity > 0):
+            closed = min(abs(held), abs(quantity))
+            state.realized += closed * (price - position.avg) * (1 if held > 0 else -1)
+            if abs(quantity) > abs(held):
+                position.avg = price
+            elif abs(quantity) == abs(held):
+                position.avg = 0.0
+        else:
+            position.avg = (held * position.avg + quantity * price) / (held + quantity)
+        position.qty = held + quantity
+        self._set_notional(state, position, price)
+
+    def warm(self, db: Session) -> None:
+        """Load net positions per user from filled trades at approximate cost (run once at startup)"""
+        # rows from before fills were tracked have no filled_quantity but are EXECUTED in full
+        filled = func.coalesce(Trade.filled_quantity, Trade.quantity)
+        rows = (
+            db.query(
+                Trade.user_id, Trade.exchange, Trade.symbol, Trade.trade_type,
+                func.sum(filled), func.sum(filled * Trade.price),
+            )
+            .filter(or_(Trade.status == TradeStatus.EXECUTED, Trade.filled_quantity > 0))
+            .group_by(Trade.user_id, Trade.exchange, Trade.symbol, Trade.trade_type)
+        )
+        totals: Dict = defaultdict(lambda: [0.0, 0.0])
+        for user_id, exchange, symbol, trade_type, quantity, amount in rows:
+            total = totals[(user_id, f"{exchange}:{symbol}")]
+            if trade_type == TradeType.BUY:
+                total[0] += quantity or 0
+                total[1] += amount or 0.0
+            else:
+                total[0] -= quantity or 0
+                total[1] -= amount or 0.0
+        for (user_id, name), (quantity, amount) in totals.items():
+            if quantity:
+                self.on_fill(user_id, name, quantity, amount / quantity, reserved=False)
+        for state in self.users.values():
+            state.realized = 0.0
+        logger.info(f"Pre-trade gate loaded positions for {len(self.users)} users")
+
+    def stats(self) -> Dict:
+        return {"rejections": dict(self.rejections), "latency": self.latency.snapshot()}
+
+
+pretrade_gate = PreTradeRiskGate()
@@ -0,0 +1,199 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.core.cache import Cache, default_cache
+from app.core.config import settings
+from app.services.ticker import TickIngestionService, tick_service
+from app.services.zerodha import zerodha_service
+from app.utils.logging import logger
+
+# Kite accepts up to 1000 instruments per LTP call and 500 per full quote
+MAX_LTP_BATCH = 1000
+MAX_QUOTE_BATCH = 500
+
+
+class _Batcher:
+    """
+    Coalesces lookups for individual instruments into batched upstream calls.
+
+    Requests arriving within `window` seconds share one call (split at
+    `max_batch`), an instrument already being fetched is awaited rather than
+    requested again, and results are cached for `ttl` seconds. With a
+    `shared` cache, a batch first takes whatever another worker fetched
+    within the TTL and only asks upstream for the rest.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+        max_batch: int,
+        ttl: float,
+        window: float,
+        shared: Optional[Cache] = None,
+        prefix: str = "",
+    ):
+        self.fetch = fetch
+        self.shared = shared
+        self.prefix = prefix
+        self.max_batch = max_batch
+        self.ttl = ttl
+        self.window = window
+        self.cache: Dict[str, Tuple[Any, float]] = {}
+        self.calls = 0
+        self._purge_at = 1024
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: List[str] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def get(self, names: Iterable[str]) -> Dict[str, Any]:
+        now = time.monotonic()
+        result: Dict[str, Any] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        loop = asyncio.get_running_loop()
+        for name in names:
+            cached = self.cache.get(name)
+            if cached is not None:
+                if cached[1] > now:
+                    result[name] = cached[0]
+                    continue
+                del self.cache[name]
+            future = self._inflight.get(name)
+            if future is None:
+                future = self._inflight[name] = loop.create_future()
+                self._pending.append(name)
+            waiting[name] = future
+
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._pending and self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        if waiting:
+            values = await asyncio.gather(*waiting.values())
+            for name, value in zip(waiting, values):
+                if value is not None:
+                    result[name] = value
+        return result
+
+    def peek(self, name: str) -> Any:
+        """Cached value if it is still within the TTL, without any I/O"""
+        cached = self.cache.get(name)
+        if cached is None:
+            return None
+        if cached[1] <= time.monotonic():
+            del self.cache[name]
+            return None
+        return cached[0]
+
+    def purge(self) -> int:
+        """Drop expired entries; returns how many"""
+        now = time.monotonic()
+        expired = [name for name, (_, expires) in self.cache.items() if expires <= now]
+        for name in expired:
+            del self.cache[name]
+        return len(expired)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        for start in range(0, len(pending), self.max_batch):
+            asyncio.create_task(self._fetch(pending[start:start + self.max_batch]))
+
+    async def _fetch(self, names: List[str]) -> None:
+        try:
+            data = await self._fetch_shared(names) if self.shared is not None else await self._fetch_upstream(names)
+        except Exception as e:
+            logger.error(f"Batched price fetch for {len(names)} instruments failed: {str(e)}")
+            for name in names:
+                future = self._inflight.pop(name, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        expires = time.monotonic() + self.ttl
+        for name in names:
+            value = data.get(name)
+            if value is not None:
+                self.cache[name] = (value, expires)
+            future = self._inflight.pop(name, None)
+            if future is not None and not future.done():
+                future.set_result(value)
+        # instruments that are never asked for again would otherwise stay forever
+        if len(self.cache) >= self._purge_at:
+            self.purge()
+            self._purge_at = max(1024, 2 * len(self.cache))
+
+    async def _fetch_upstream(self, names: List[str]) -> Dict[str, Any]:
+        self.calls += 1
+        return await self.fetch(names)
+
+    async def _fetch_shared(self, names: List[str]) -> Dict[str, Any]:
+        found = await self.shared.get_many([self.prefix + name for name in names])
+        data = {name: found[self.prefix + name] for name in names if self.prefix + name in found}
+        missing = [name for name in names if name not in data]
+        if missing:
+            fetched = await self._fetch_upstream(missing)
+            await self.shared.set_many({self.prefix + k: v for k, v in fetched.items()}, self.ttl)
+            data.update(fetched)
+        return data
+
+
+class PriceService:
+    """
+    Last prices and quotes for many instruments with as few Kite calls as
+    possible. LTPs come from the live tick buffer when the instrument is
+    streaming; everything else goes through a short-TTL, single-flight,
+    batching cache.
+    """
+
+    def __init__(
+        self,
+        ticks: Optional[TickIngestionService] = None,
+        ttl: Optional[float] = None,
+        window: float = 0.005,
+        shared: Optional[Cache] = default_cache,
+    ):
+        self.ticks = ticks or tick_service
+        ttl = settings.PRICE_CACHE_TTL if ttl is None else ttl
+        self.ltp_batcher = _Batcher(self._fetch_ltp, MAX_LTP_BATCH, ttl, window, shared, "ltp:")
+        self.quote_batcher = _Batcher(self._fetch_quotes, MAX_QUOTE_BATCH, ttl, window, shared, "quote:")
+
+    async def _fetch_ltp(self, names: List[str]) -> Dict[str, float]:
+        data = await zerodha_service.ltp(names)
+        return {name: quote["last_price"] for name, quote in data.items()}
+
+    async def _fetch_quotes(self, names: List[str]) -> Dict[str, Dict]:
+        return await zerodha_service.quote(names)
+
+    async def get_ltp(self, names: Iterable[str]) -> Dict[str, float]:
+        """Last traded price per "EXCHANGE:SYMBOL"; unknown instruments are omitted"""
+        prices: Dict[str, float] = {}
+        missing = []
+        for name in names:
+            price = self.ticks.latest_price_for(name) if self.ticks.running else None
+            if price is not None:
+                prices[name] = price
+            else:
+                missing.append(name)
+        if missing:
+            prices.update(await self.ltp_batcher.get(missing))
+        return prices
+
+    async def ltp(self, name: str) -> Optional[float]:
+        return (await self.get_ltp([name])).get(name)
+
+    async def get_quotes(self, names: Iterable[str]) -> Dict[str, Dict]:
+        """Full quotes per "EXCHANGE:SYMBOL"; unknown instruments are omitted"""
+        return await self.quote_batcher.get(names)
+
+    def cached_ltp(self, name: str) -> Optional[float]:
+        """Latest known price without any I/O: streaming, or fetched within the TTL"""
+        price = self.ticks.latest_price_for(name) if self.ticks.running else None
+        if price is not None:
+            return price
+        return self.ltp_batcher.peek(name)
+
+
+price_service = PriceService()
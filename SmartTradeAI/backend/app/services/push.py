@@ -0,0 +1,298 @@
+import asyncio
+import os
+import socket
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import msgpack
+
+from app.core import redis_pool
+from app.core.config import settings
+from app.core.socket_manager import sio
+from app.services.position_book import PositionBookService, position_books
+from app.services.ticker import Tick, TickIngestionService, tick_service
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+# Subscriber count per room of each worker (expiring with the worker), the
+# set of those per-worker hashes, and the last full payload per room
+ROOMS_KEY = "push:rooms:{}"
+WORKERS_KEY = "push:workers"
+LAST_KEY = "push:last:{}"
+
+EVENTS = {"symbol": "tick", "portfolio": "portfolio"}
+
+
+def symbol_room(name: str) -> str:
+    return f"symbol:{name}"
+
+
+def portfolio_room(portfolio_id: int) -> str:
+    return f"portfolio:{portfolio_id}"
+
+
+def pack(payload: Dict) -> bytes:
+    """Client payloads are plain msgpack, sent as binary socket.io attachments"""
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+def portfolio_state(snapshot: Dict) -> Tuple[Dict, Dict]:
+    """(scalar fields, {symbol: [qty, avg, ltp, value, pnl]}) rounded to paise"""
+    fields = {k: round(v, 2) for k, v in snapshot.items() if isinstance(v, (int, float))}
+    positions = {
+        p["symbol"]: [
+            p["quantity"], round(p["average_price"], 2), round(p["last_price"], 2),
+            round(p["value"], 2), round(p["unrealized_pnl"], 2),
+        ]
+        for p in snapshot.get("positions", [])
+    }
+    return fields, positions
+
+
+def diff_state(previous: Optional[Tuple[Dict, Dict]], current: Tuple[Dict, Dict]) -> Optional[Dict]:
+    """What changed from `previous` to `current`; None when nothing did"""
+    if previous is None:
+        return {"full": True, "fields": current[0], "positions": current[1]}
+    fields = {k: v for k, v in current[0].items() if previous[0].get(k) != v}
+    positions = {s: row for s, row in current[1].items() if previous[1].get(s) != row}
+    removed = [s for s in previous[1] if s not in current[1]]
+    if not fields and not positions and not removed:
+        return None
+    delta = {"fields": fields, "positions": positions}
+    if removed:
+        delta["removed"] = removed
+    return delta
+
+
+class PushService:
+    """
+    Socket.IO push of ticks to "symbol:<EXCHANGE:SYMBOL>" rooms and
+    portfolio valuations to "portfolio:<id>" rooms.
+
+    Nothing is emitted per tick. Updates collect per room (the latest one
+    wins) and are flushed once per frame, so a room gets at most one
+    message per `frame_interval` however fast its instrument trades.
+    Portfolios are sent as deltas against the previous frame with a
+    sequence number; the latest full payload of every room is kept in
+    Redis, so a joining (or out of sequence) client on any worker starts
+    from it. Only the process that runs the ticker publishes; every
+    worker handles joins and keeps its own room counts in Redis under a
+    TTL it renews, so a worker that dies stops counting once it lapses.
+    """
+
+    def __init__(
+        self,
+        ticks: Optional[TickIngestionService] = None,
+        books: Optional[PositionBookService] = None,
+        frame_interval: Optional[float] = None,
+    ):
+        self.sio = sio
+        self.ticks = ticks or tick_service
+        self.books = books or position_books
+        self.frame_interval = frame_interval or settings.PUSH_FRAME_INTERVAL
+        self.interest: Set[str] = set()
+        self.pending: Dict[str, Dict] = {}
+        self.states: Dict[str, Tuple[Dict, Dict]] = {}
+        self.seq: Dict[str, int] = {}
+        self.emitted = 0
+        self.coalesced = 0
+        self.latency = histogram("push.frame")
+        self._interest_checked = 0.0
+        self.members: Dict[str, int] = {}
+        self.rooms_key = ROOMS_KEY.format(f"{socket.gethostname()}:{os.getpid()}")
+        self._task: Optional[asyncio.Task] = None
+        self._presence: Optional[asyncio.Task] = None
+
+    # Room membership, for the socket handlers in every worker
+
+    async def join(self, sid: str, room: str) -> None:
+        self.sio.enter_room(sid, room)
+        self.members[room] = self.members.get(room, 0) + 1
+        try:
+            await self._count(room, 1)
+        except Exception as e:
+            logger.warning(f"Could not record push interest in {room}: {str(e)}")
+        await self.send_last(sid, room)
+
+    async def leave(self, sid: str, room: str) -> None:
+        self.sio.leave_room(sid, room)
+        count = self.members.pop(room, 0) - 1
+        if count > 0:
+            self.members[room] = count
+        try:
+            await self._count(room, -1)
+        except Exception as e:
+            logger.warning(f"Could not drop push interest in {room}: {str(e)}")
+
+    async def _count(self, room: str, delta: int) -> None:
+        redis = await redis_pool.get_redis()
+        pipe = redis.pipeline()
+        if room in self.members:
+            pipe.hincrby(self.rooms_key, room, delta)
+        else:
+            pipe.hdel(self.rooms_key, room)
+        pipe.expire(self.rooms_key, settings.PUSH_ROOMS_TTL)
+        pipe.sadd(WORKERS_KEY, self.rooms_key)
+        await pipe.execute()
+
+    async def write_members(self) -> None:
+        """Rewrite this worker's room counts and renew their TTL"""
+        redis = await redis_pool.get_redis()
+        pipe = redis.pipeline()
+        pipe.delete(self.rooms_key)
+        if self.members:
+            pipe.hset(self.rooms_key, mapping=self.members)
+            pipe.expire(self.rooms_key, settings.PUSH_ROOMS_TTL)
+            pipe.sadd(WORKERS_KEY, self.rooms_key)
+        await pipe.execute()
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(settings.PUSH_ROOMS_TTL / 3)
+            try:
+                await self.write_members()
+            except Exception as e:
+                logger.warning(f"Could not renew push interest: {str(e)}")
+
+    async def leave_all(self, sid: str) -> None:
+        for room in self.sio.rooms(sid):
+            if room.partition(":")[0] in EVENTS:
+                await self.leave(sid, room)
+
+    async def send_last(self, sid: str, room: str) -> None:
+        """Send the room's latest full payload to one client"""
+        try:
+            redis = await redis_pool.get_redis()
+            last = await redis.get(LAST_KEY.format(room))
+        except Exception as e:
+            logger.warning(f"Could not read last push for {room}: {str(e)}")
+            return
+        if last is not None:
+            await self.sio.emit(EVENTS[room.partition(":")[0]], last, to=sid)
+
+    # Publishing
+
+    async def on_ticks(self, ticks: List[Tick]) -> None:
+        for tick in ticks:
+            name = self.ticks.symbols.get(tick.token)
+            if name is None:
+                continue
+            room = symbol_room(name)
+            if room not in self.interest:
+                continue
+            if room in self.pending:
+                self.coalesced += 1
+            self.pending[room] = {"s": name, "p": tick.ltp, "v": tick.volume, "oi": tick.oi, "t": tick.ts}
+
+    def attach(self, ticks: TickIngestionService) -> None:
+        self.ticks = ticks
+        # only the latest tick per room is ever sent, so this consumer may shed load
+        ticks.add_consumer("push", self.on_ticks)
+
+    async def refresh_interest(self) -> None:
+        redis = await redis_pool.get_redis()
+        workers = list(await redis.smembers(WORKERS_KEY))
+        pipe = redis.pipeline()
+        for key in workers:
+            pipe.hgetall(key)
+        interest = set()
+        lapsed = []
+        for key, counts in zip(workers, await pipe.execute() if workers else []):
+            if not counts:
+                lapsed.append(key)
+            interest.update(
+                room.decode() if isinstance(room, bytes) else room
+                for room, count in counts.items()
+                if int(count) > 0
+            )
+        if lapsed:
+            await redis.srem(WORKERS_KEY, *lapsed)
+        added = [room.partition(":")[2] for room in interest - self.interest if room.startswith("symbol:")]
+        if added and self.ticks.running:
+            self.ticks.subscribe_symbols(added)
+        for room in set(self.states) - interest:
+            self.states.pop(room, None)
+        self.interest = interest
+
+    def _portfolio_messages(self) -> List[Tuple[str, Dict, Dict]]:
+        messages = []
+        for room in self.interest:
+            kind, _, key = room.partition(":")
+            if kind != "portfolio" or not key.isdigit() or int(key) not in self.books.books:
+                continue
+            portfolio_id = int(key)
+            state = portfolio_state(self.books.snapshot(portfolio_id))
+            delta = diff_state(self.states.get(room), state)
+            if delta is None:
+                continue
+            self.states[room] = state
+            seq = self.seq[room] = self.seq.get(room, 0) + 1
+            delta.update(portfolio_id=portfolio_id, seq=seq)
+            full = {"portfolio_id": portfolio_id, "seq": seq, "full": True, "fields": state[0], "positions": state[1]}
+            messages.append((room, delta, full))
+        return messages
+
+    async def flush(self) -> int:
+        """Emit one message per room with something new; returns how many"""
+        started = time.perf_counter()
+        if started - self._interest_checked > 1.0:
+            self._interest_checked = started
+            await self.refresh_interest()
+        pending, self.pending = self.pending, {}
+        messages = [(room, payload, payload) for room, payload in pending.items()]
+        messages.extend(self._portfolio_messages())
+        if not messages:
+            return 0
+
+        redis = await redis_pool.get_redis()
+        pipe = redis.pipeline()
+        for room, _, full in messages:
+            pipe.set(LAST_KEY.format(room), pack(full), ex=settings.PUSH_SNAPSHOT_TTL)
+        await pipe.execute()
+        await asyncio.gather(*(
+            self.sio.emit(EVENTS[room.partition(":")[0]], pack(payload), room=room)
+            for room, payload, _ in messages
+        ))
+        self.emitted += len(messages)
+        self.latency.record(time.perf_counter() - started)
+        return len(messages)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.frame_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing push frame: {str(e)}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def start_presence(self) -> None:
+        """Keep this worker's room counts alive; every worker that serves sockets runs it"""
+        if self._presence is None:
+            self._presence = asyncio.create_task(self._renew())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._presence):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._presence = None
+        self.members = {}
+        try:
+            await self.write_members()
+        except Exception as e:
+            logger.warning(f"Could not clear push interest: {str(e)}")
+
+    def stats(self) -> Dict:
+        return {
+            "rooms": len(self.interest),
+            "emitted": self.emitted,
+            "coalesced": self.coalesced,
+            "frame": self.latency.snapshot(),
+        }
+
+
+push_service = PushService()
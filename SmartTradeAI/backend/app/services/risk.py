@@ -0,0 +1,320 @@
+import asyncio
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from statistics import NormalDist
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.bar_store import BarStore, bar_store
+from app.services.position_book import PositionBookService, position_books
+from app.services.zerodha import zerodha_service
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+YAHOO_SUFFIX = {"NSE": ".NS", "BSE": ".BO"}
+
+# Rebuild the running sums from scratch every so often to shed float drift
+REBUILD_EVERY = 250
+
+
+def yahoo_symbol(name: str) -> Optional[str]:
+    """Bar store (yfinance) symbol for an "EXCHANGE:SYMBOL" name; None for F&O"""
+    exchange, _, symbol = name.rpartition(":")
+    suffix = YAHOO_SUFFIX.get(exchange or "NSE")
+    return f"{symbol}{suffix}" if suffix else None
+
+
+def load_sector_map(path: Optional[str] = None) -> Dict[str, str]:
+    """Tradingsymbol -> sector, from a JSON file if one is configured"""
+    path = path or settings.SECTOR_MAP_PATH
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class RollingCovariance:
+    """
+    Covariance of the last `window` return rows, kept as running sums so a
+    new bar costs one outer product instead of a full recompute.
+    """
+
+    def __init__(self, window: int, columns: int):
+        self.window = window
+        self.rows = np.zeros((window, columns))
+        self.count = 0
+        self.sum = np.zeros(columns)
+        self.products = np.zeros((columns, columns))
+        self._next = 0
+        self._pushes = 0
+
+    def load(self, returns: np.ndarray) -> None:
+        returns = returns[-self.window:]
+        n = len(returns)
+        self.rows[:n] = returns
+        self.count = n
+        self._next = n % self.window
+        self.sum = returns.sum(axis=0)
+        self.products = returns.T @ returns
+        self._pushes = 0
+
+    def push(self, row: np.ndarray) -> None:
+        if self.count == self.window:
+            old = self.rows[self._next]
+            self.sum -= old
+            self.products -= np.outer(old, old)
+        else:
+            self.count += 1
+        self.rows[self._next] = row
+        self.sum += row
+        self.products += np.outer(row, row)
+        self._next = (self._next + 1) % self.window
+        self._pushes += 1
+        if self._pushes >= REBUILD_EVERY:
+            self.load(self.returns())
+
+    def returns(self) -> np.ndarray:
+        """Stored rows, oldest first"""
+        if self.count < self.window:
+            return self.rows[:self.count]
+        return np.roll(self.rows, -self._next, axis=0)
+
+    def mean(self) -> np.ndarray:
+        return self.sum / self.count if self.count else self.sum
+
+    def covariance(self) -> np.ndarray:
+        n = self.count
+        if n < 2:
+            return np.zeros_like(self.products)
+        return (self.products - np.outer(self.sum, self.sum) / n) / (n - 1)
+
+
+def portfolio_var(
+    values: np.ndarray, returns: np.ndarray, mean: np.ndarray, cov: np.ndarray, confidence: float
+) -> Dict[str, np.ndarray]:
+    """
+    Historical and parametric one-period VaR/CVaR for P portfolios at once.
+    `values` is P x N signed rupee exposure, `returns` T x N; losses are
+    reported as positive rupee amounts.
+    """
+    pnl = returns @ values.T
+    tail = 1 - confidence
+    hist_var = -np.quantile(pnl, tail, axis=0)
+    in_tail = pnl <= -hist_var
+    hist_cvar = -(np.where(in_tail, pnl, 0.0).sum(axis=0) / np.maximum(in_tail.sum(axis=0), 1))
+
+    z = NormalDist().inv_cdf(confidence)
+    sigma = np.sqrt(np.maximum(np.einsum("pi,ij,pj->p", values, cov, values), 0.0))
+    mu = values @ mean
+    return {
+        "var_historical": hist_var,
+        "cvar_historical": hist_cvar,
+        "var_parametric": z * sigma - mu,
+        "cvar_parametric": sigma * NormalDist().pdf(z) / tail - mu,
+        "volatility": sigma,
+    }
+
+
+class RiskEngine:
+    """
+    Return-based risk for every portfolio in the position books.
+
+    Daily log returns of every held instrument plus the benchmark come from
+    the local bar store and are kept in one RollingCovariance; new bars are
+    pushed in incrementally and the matrix is only rebuilt when the set of
+    instruments changes. All portfolios are evaluated together as one P x N
+    exposure matrix, off the event loop.
+    """
+
+    def __init__(
+        self,
+        books: Optional[PositionBookService] = None,
+        store: Optional[BarStore] = None,
+        interval: str = "1d",
+        lookback: Optional[int] = None,
+        confidence: Optional[float] = None,
+        benchmark: Optional[str] = None,
+    ):
+        self.books = books or position_books
+        self.store = store or bar_store
+        self.interval = interval
+        self.lookback = lookback or settings.RISK_LOOKBACK
+        self.confidence = confidence or settings.RISK_CONFIDENCE
+        self.benchmark = benchmark or settings.RISK_BENCHMARK
+        self.sectors = load_sector_map()
+        self.columns: List[str] = []
+        self.window: Optional[RollingCovariance] = None
+        self.metrics: Dict[int, Dict] = {}
+        self.latency = histogram("risk.refresh")
+        self._versions: Dict[str, Tuple[int, int]] = {}
+        self._topped_up: Dict[str, date] = {}
+        self._last_ts = 0
+        self._last_close: Optional[np.ndarray] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _closes(self, symbols: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Close prices on the timestamps every symbol has, as (ts, T x N)"""
+        series = [self.store.load(symbol, self.interval) for symbol in symbols]
+        ts = series[0].ts
+        for bars in series[1:]:
+            ts = np.intersect1d(ts, bars.ts, assume_unique=True)
+        closes = np.empty((len(ts), len(series)))
+        for j, bars in enumerate(series):
+            closes[:, j] = bars.close[np.searchsorted(bars.ts, ts)]
+        return ts, closes
+
+    def _rebuild(self, columns: List[str]) -> None:
+        ts, closes = self._closes(columns)
+        closes = closes[-(self.lookback + 1):]
+        self.window = RollingCovariance(self.lookback, len(columns))
+        self.window.load(np.diff(np.log(closes), axis=0))
+        self.columns = columns
+        self._last_ts = int(ts[-1]) if len(ts) else 0
+        self._last_close = closes[-1] if len(closes) else None
+
+    def _sync(self, columns: List[str]) -> None:
+        """Bring the return window up to date with the bar store"""
+        versions = {symbol: self.store.version(symbol, self.interval) for symbol in columns}
+        if columns != self.columns or self.window is None or self._last_close is None:
+            self._rebuild(columns)
+        elif versions != self._versions:
+            if any(v[1] < self._versions.get(s, (0, 0))[1] for s, v in versions.items()):
+                self._rebuild(columns)
+            else:
+                ts, closes = self._closes(columns)
+                new = ts > self._last_ts
+                if new.any():
+                    for close in closes[new]:
+                        self.window.push(np.log(close) - np.log(self._last_close))
+                        self._last_close = close
+                    self._last_ts = int(ts[new][-1])
+        self._versions = versions
+
+    def ensure_history(self, names: Sequence[str], days: int = 550) -> None:
+        """
+        Top up daily bars from each symbol's last stored bar (or `days` back
+        for a new one) to today, at most once a day per symbol
+        """
+        from app.services.market_data import get_stock_bars
+
+        end = datetime.utcnow()
+        today = end.date()
+        for symbol in names:
+            if self._topped_up.get(symbol) == today:
+                continue
+            last = self.store.version(symbol, self.interval)[1]
+            start = datetime.utcfromtimestamp(last) if last else end - timedelta(days=days)
+            try:
+                get_stock_bars(symbol, start, end, self.interval)
+            except Exception as e:
+                logger.warning(f"No history for {symbol}: {str(e)}")
+            self._topped_up[symbol] = today
+
+    def compute(self, books: Dict[int, Dict[str, float]], margin_utilisation: Optional[float]) -> Dict[int, Dict]:
+        """Risk metrics per portfolio from {portfolio_id: {name: signed value}}"""
+        names = sorted({name for values in books.values() for name in values})
+        symbols = {name: yahoo_symbol(name) for name in names}
+        self.ensure_history([s for s in symbols.values() if s] + [self.benchmark])
+        covered = [n for n in names if symbols[n] and self.store.version(symbols[n], self.interval)[0]]
+        columns = [symbols[n] for n in covered] + [self.benchmark]
+        self._sync(columns)
+
+        ids = list(books)
+        values = np.array([[books[pid].get(n, 0.0) for n in covered] for pid in ids]).reshape(len(ids), len(covered))
+        label = int(self.confidence * 100)
+        results = {}
+        for p, pid in enumerate(ids):
+            exposure = {n: abs(v) for n, v in books[pid].items()}
+            gross = sum(exposure.values())
+            sectors: Dict[str, float] = {}
+            for n, v in exposure.items():
+                sector = self.sectors.get(n.rpartition(":")[2], "Unknown")
+                sectors[sector] = sectors.get(sector, 0.0) + v
+            results[pid] = {
+                "sector_exposure": {s: round(v / gross, 4) for s, v in sectors.items()} if gross else {},
+                "risk_coverage": round(float(np.abs(values[p]).sum()) / gross, 4) if gross else 1.0,
+                "margin_utilisation": margin_utilisation,
+                "risk_updated_at": datetime.utcnow().isoformat(),
+            }
+        if self.window.count < 2 or not covered:
+            return results
+
+        cov = self.window.covariance()
+        var = portfolio_var(
+            values, self.window.returns()[:, :-1], self.window.mean()[:-1], cov[:-1, :-1], self.confidence
+        )
+        bench_var = cov[-1, -1]
+        net = values.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            beta = (values @ cov[:-1, -1]) / (net * bench_var)
+            std = np.sqrt(np.diag(cov)[:-1])
+            corr = np.nan_to_num(cov[:-1, :-1] / np.outer(std, std))
+        for p, pid in enumerate(ids):
+            held = [j for j in range(len(covered)) if values[p, j]]
+            results[pid].update({
+                f"var_{label}_historical": round(float(var["var_historical"][p]), 2),
+                f"cvar_{label}_historical": round(float(var["cvar_historical"][p]), 2),
+                f"var_{label}_parametric": round(float(var["var_parametric"][p]), 2),
+                f"cvar_{label}_parametric": round(float(var["cvar_parametric"][p]), 2),
+                "volatility": round(float(var["volatility"][p]), 2),
+                "beta": round(float(beta[p]), 4) if np.isfinite(beta[p]) else None,
+                "correlation": {
+                    "symbols": [covered[j] for j in held],
+                    "matrix": np.round(corr[np.ix_(held, held)], 4).tolist(),
+                },
+            })
+        return results
+
+    async def margin_utilisation(self) -> Optional[float]:
+        try:
+            equity = await zerodha_service.margins("equity")
+        except Exception as e:
+            logger.warning(f"Could not fetch margins: {str(e)}")
+            return None
+        used = float(equity.get("utilised", {}).get("debits", 0.0) or 0.0)
+        available = float(equity.get("net", 0.0) or 0.0)
+        return round(used / (used + available), 4) if used + available > 0 else 0.0
+
+    async def refresh(self) -> None:
+        books = {}
+        for pid, book in self.books.books.items():
+            values = {p["symbol"]: p["value"] for p in book.positions()}
+            if values:
+                books[pid] = values
+        if not books:
+            return
+        started = time.perf_counter()
+        margin = await self.margin_utilisation()
+        self.metrics = await asyncio.get_running_loop().run_in_executor(None, self.compute, books, margin)
+        for pid, metrics in self.metrics.items():
+            book = self.books.books.get(pid)
+            if book is not None:
+                book.risk = metrics
+                book.dirty = True
+        self.latency.record(time.perf_counter() - started)
+
+    async def run(self, interval: Optional[float] = None) -> None:
+        interval = interval or settings.RISK_REFRESH_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing risk: {str(e)}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+risk_engine = RiskEngine()
@@ -0,0 +1,341 @@
+"""
+Compiler for Strategy.entry_conditions / exit_conditions.
+
+A rule document is a JSON tree:
+
+    {"all": [rule, ...]}, {"any": [rule, ...]}, {"not": rule}, or a bare list (= all)
+    {"op": ">", "left": operand, "right": operand}
+        op is one of > >= < <= == != crosses_above crosses_below
+    operand is a number, {"field": "close"} or
+        {"indicator": "bollinger", "period": 20, "k": 2, "output": "upper"}
+
+entry_conditions may wrap its tree as {"symbols": [...], "timeframe": "5m",
+"rules": tree}; the wrapper tells the scheduler what to run the strategy on.
+
+Compiling resolves every operand to a slot, dedupes identical indicator
+specs across the entry and exit trees, and turns the tree into closures.
+The same plan evaluates whole NumPy arrays for backtests and one bar at a
+time against an IndicatorBank for live trading.
+"""
+import operator
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.strategy import Strategy
+from app.services import indicators
+
+FIELDS = ("open", "high", "low", "close", "volume")
+IST_OFFSET = 19800
+
+COMPARISONS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+CROSSES = ("crosses_above", "crosses_below")
+
+
+class RuleError(ValueError):
+    pass
+
+
+class _Kind:
+    """How to build, feed and batch-compute one indicator type"""
+
+    def __init__(self, cls, params: Dict[str, Any], inputs: str, outputs: Tuple[str, ...], batch: Callable):
+        self.cls = cls
+        self.params = params
+        self.inputs = inputs
+        self.outputs = outputs
+        self.batch = batch
+
+
+def _vwap_batch(bars, **params):
+    price = (_column(bars, "high") + _column(bars, "low") + _column(bars, "close")) / 3.0
+    volume = _column(bars, "volume")
+    ts = _column(bars, "ts", required=False)
+    if ts is None:
+        return {"value": indicators.vwap(price, volume)}
+    session = (ts.astype(np.int64) + IST_OFFSET) // 86400
+    bounds = np.flatnonzero(np.diff(session)) + 1
+    parts = [indicators.vwap(p, v) for p, v in zip(np.split(price, bounds), np.split(volume, bounds))]
+    return {"value": np.concatenate(parts) if parts else np.empty(0)}
+
+
+KINDS = {
+    "sma": _Kind(indicators.SMA, {"period": 20}, "source", ("value",),
+                 lambda bars, period, source: {"value": indicators.sma(_column(bars, source), period)}),
+    "ema": _Kind(indicators.EMA, {"period": 20}, "source", ("value",),
+                 lambda bars, period, source: {"value": indicators.ema(_column(bars, source), period)}),
+    "rsi": _Kind(indicators.RSI, {"period": 14}, "source", ("value",),
+                 lambda bars, period, source: {"value": indicators.rsi(_column(bars, source), period)}),
+    "atr": _Kind(indicators.ATR, {"period": 14}, "hlc", ("value",),
+                 lambda bars, period: {"value": indicators.atr(
+                     _column(bars, "high"), _column(bars, "low"), _column(bars, "close"), period)}),
+    "vwap": _Kind(indicators.VWAP, {}, "vwap", ("value",), _vwap_batch),
+    "bollinger": _Kind(indicators.Bollinger, {"period": 20, "k": 2.0}, "source", ("value", "upper", "lower"),
+                       lambda bars, period, k, source: dict(zip(
+                           ("value", "upper", "lower"), indicators.bollinger(_column(bars, source), period, k)))),
+    "macd": _Kind(indicators.MACD, {"fast": 12, "slow": 26, "signal": 9}, "source", ("value", "signal", "hist"),
+                  lambda bars, fast, slow, signal, source: dict(zip(
+                      ("value", "signal", "hist"), indicators.macd(_column(bars, source), fast, slow, signal)))),
+}
+
+
+def _column(bars, name: str, required: bool = True) -> Optional[np.ndarray]:
+    value = bars.get(name) if isinstance(bars, dict) else getattr(bars, name, None)
+    if value is None:
+        if required:
+            raise RuleError(f"Bars have no '{name}' column")
+        return None
+    return np.asarray(value, dtype=np.float64)
+
+
+class IndicatorSpec:
+    """A fully-parameterized indicator; equal specs share one instance"""
+
+    __slots__ = ("name", "params", "key")
+
+    def __init__(self, name: str, params: Dict[str, Any]):
+        self.name = name
+        self.params = params
+        self.key = (name,) + tuple(sorted(params.items()))
+
+    @classmethod
+    def parse(cls, node: Dict) -> Tuple["IndicatorSpec", str]:
+        name = str(node["indicator"]).lower()
+        kind = KINDS.get(name)
+        if kind is None:
+            raise RuleError(f"Unknown indicator: {name}")
+        params = dict(kind.params)
+        for param in kind.params:
+            if param in node:
+                params[param] = type(kind.params[param])(node[param])
+        if kind.inputs == "source":
+            params["source"] = node.get("source", "close")
+            if params["source"] not in FIELDS:
+                raise RuleError(f"Unknown source field: {params['source']}")
+        output = node.get("output", "value")
+        if output not in kind.outputs:
+            raise RuleError(f"{name} has no output '{output}'")
+        return cls(name, params), output
+
+    def create(self):
+        kwargs = {k: v for k, v in self.params.items() if k != "source"}
+        return KINDS[self.name].cls(**kwargs)
+
+    def batch(self, bars) -> Dict[str, np.ndarray]:
+        return KINDS[self.name].batch(bars, **self.params)
+
+
+Slot = Tuple
+
+
+class IndicatorBank:
+    """
+    Live indicator instances for one instrument/timeframe. Several plans can
+    share a bank, so an indicator used by many strategies is updated once.
+    """
+
+    def __init__(self, specs: Iterable[IndicatorSpec] = ()):
+        self.instances: Dict[Tuple, Any] = {}
+        self._feeds: List[Tuple[Tuple, Any, str, Optional[str]]] = []
+        self._session: Optional[int] = None
+        self.values: Dict[Slot, Optional[float]] = {}
+        self.previous: Dict[Slot, Optional[float]] = {}
+        self.add(specs)
+
+    def add(self, specs: Iterable[IndicatorSpec]) -> None:
+        for spec in specs:
+            if spec.key in self.instances:
+                continue
+            instance = spec.create()
+            self.instances[spec.key] = instance
+            self._feeds.append((spec.key, instance, KINDS[spec.name].inputs, spec.params.get("source")))
+
+    def update(self, open_: float, high: float, low: float, close: float, volume: float,
+               ts: Optional[float] = None) -> Dict[Slot, Optional[float]]:
+        bar = {"open": open_, "high": high, "low": low, "close": close, "volume": volume}
+        session = int(ts + IST_OFFSET) // 86400 if ts is not None else None
+        new_session = session is not None and session != self._session
+        self._session = session
+
+        values = {("field", name): value for name, value in bar.items()}
+        for key, instance, inputs, source in self._feeds:
+            if inputs == "source":
+                instance.update(bar[source])
+            elif inputs == "hlc":
+                instance.update(high, low, close)
+            else:
+                if new_session:
+                    instance.reset()
+                instance.update((high + low + close) / 3.0, volume)
+            for output in KINDS[key[0]].outputs:
+                values[(key, output)] = getattr(instance, output)
+        self.previous, self.values = self.values, values
+        return values
+
+    def update_candle(self, candle) -> Dict[Slot, Optional[float]]:
+        return self.update(candle.open, candle.high, candle.low, candle.close, candle.volume, candle.start)
+
+
+def _live_compare(op, left: Slot, right: Slot):
+    def evaluate(values, previous):
+        a, b = values.get(left), values.get(right)
+        return a is not None and b is not None and op(a, b)
+    return evaluate
+
+
+def _live_cross(above: bool, left: Slot, right: Slot):
+    def evaluate(values, previous):
+        a, b = values.get(left), values.get(right)
+        pa, pb = previous.get(left), previous.get(right)
+        if a is None or b is None or pa is None or pb is None:
+            return False
+        return a > b and pa <= pb if above else a < b and pa >= pb
+    return evaluate
+
+
+def _batch_compare(op, left: Slot, right: Slot):
+    def evaluate(arrays):
+        a, b = arrays[left], arrays[right]
+        with np.errstate(invalid="ignore"):
+            return ~np.isnan(a) & ~np.isnan(b) & op(a, b)
+    return evaluate
+
+
+def _shift(x: np.ndarray) -> np.ndarray:
+    out = np.empty_like(x)
+    out[:1] = np.nan
+    out[1:] = x[:-1]
+    return out
+
+
+def _batch_cross(above: bool, left: Slot, right: Slot):
+    def evaluate(arrays):
+        a, b = arrays[left], arrays[right]
+        pa, pb = _shift(a), _shift(b)
+        with np.errstate(invalid="ignore"):
+            crossed = (a > b) & (pa <= pb) if above else (a < b) & (pa >= pb)
+        return crossed & ~np.isnan(pa) & ~np.isnan(pb)
+    return evaluate
+
+
+class CompiledPlan:
+    """Entry and exit rules of one strategy compiled to closures over shared slots"""
+
+    def __init__(self, entry_conditions: Any, exit_conditions: Any):
+        self.specs: Dict[Tuple, IndicatorSpec] = {}
+        self.constants: Dict[Slot, float] = {}
+        self.symbols: List[str] = []
+        self.timeframe = "1d"
+        if isinstance(entry_conditions, dict) and "rules" in entry_conditions:
+            self.symbols = list(entry_conditions.get("symbols", []))
+            self.timeframe = entry_conditions.get("timeframe", self.timeframe)
+            entry_conditions = entry_conditions["rules"]
+        if isinstance(exit_conditions, dict) and "rules" in exit_conditions:
+            exit_conditions = exit_conditions["rules"]
+        self._entry_live, self._entry_batch = self._compile(entry_conditions)
+        self._exit_live, self._exit_batch = self._compile(exit_conditions)
+
+    def _operand(self, node) -> Slot:
+        if isinstance(node, (int, float)) and not isinstance(node, bool):
+            slot = ("const", float(node))
+            self.constants[slot] = float(node)
+            return slot
+        if isinstance(node, dict) and "field" in node:
+            if node["field"] not in FIELDS:
+                raise RuleError(f"Unknown field: {node['field']}")
+            return ("field", node["field"])
+        if isinstance(node, dict) and "indicator" in node:
+            spec, output = IndicatorSpec.parse(node)
+            self.specs.setdefault(spec.key, spec)
+            return (spec.key, output)
+        raise RuleError(f"Invalid operand: {node!r}")
+
+    def _compile(self, node):
+        if node is None or node == [] or node == {}:
+            return (lambda values, previous: False), (lambda arrays: np.zeros(len(arrays["n"]), dtype=bool))
+        if isinstance(node, list):
+            node = {"all": node}
+        if not isinstance(node, dict):
+            raise RuleError(f"Invalid rule: {node!r}")
+
+        if "all" in node or "any" in node:
+            combine_all = "all" in node
+            children = [self._compile(child) for child in node["all" if combine_all else "any"]]
+            if not children:
+                raise RuleError("Empty rule group")
+            lives = [live for live, _ in children]
+            batches = [batch for _, batch in children]
+            if combine_all:
+                live = lambda values, previous: all(f(values, previous) for f in lives)
+                batch = lambda arrays: np.logical_and.reduce([f(arrays) for f in batches])
+            else:
+                live = lambda values, previous: any(f(values, previous) for f in lives)
+                batch = lambda arrays: np.logical_or.reduce([f(arrays) for f in batches])
+            return live, batch
+
+        if "not" in node:
+            child_live, child_batch = self._compile(node["not"])
+            return (lambda values, previous: not child_live(values, previous)), (lambda arrays: ~child_batch(arrays))
+
+        op = node.get("op")
+        left, right = self._operand(node.get("left")), self._operand(node.get("right"))
+        if op in COMPARISONS:
+            return _live_compare(COMPARISONS[op], left, right), _batch_compare(COMPARISONS[op], left, right)
+        if op in CROSSES:
+            above = op == "crosses_above"
+            return _live_cross(above, left, right), _batch_cross(above, left, right)
+        raise RuleError(f"Unknown operator: {op}")
+
+    def evaluate_live(self, values: Dict[Slot, Optional[float]], previous: Dict[Slot, Optional[float]]) -> Tuple[bool, bool]:
+        """(entry, exit) for the latest bar of an IndicatorBank"""
+        if self.constants:
+            values = {**values, **self.constants}
+            previous = {**previous, **self.constants}
+        return self._entry_live(values, previous), self._exit_live(values, previous)
+
+    def evaluate_batch(self, bars) -> Tuple[np.ndarray, np.ndarray]:
+        """(entry, exit) boolean arrays over every bar"""
+        close = _column(bars, "close")
+        n = len(close)
+        arrays: Dict[Any, np.ndarray] = {"n": close}
+        for name in FIELDS:
+            column = _column(bars, name, required=False)
+            if column is not None:
+                arrays[("field", name)] = column
+        for key, spec in self.specs.items():
+            for output, values in spec.batch(bars).items():
+                arrays[(key, output)] = values
+        for slot, value in self.constants.items():
+            arrays[slot] = np.full(n, value)
+        return self._entry_batch(arrays), self._exit_batch(arrays)
+
+    def bank(self) -> IndicatorBank:
+        return IndicatorBank(self.specs.values())
+
+
+_plans: Dict[int, Tuple[Any, CompiledPlan]] = {}
+
+
+def compile_strategy(strategy: Strategy) -> CompiledPlan:
+    return CompiledPlan(strategy.entry_conditions, strategy.exit_conditions)
+
+
+def get_plan(strategy: Strategy) -> CompiledPlan:
+    """Compiled plan for a strategy, recompiled only when updated_at changes"""
+    cached = _plans.get(strategy.id)
+    if cached is not None and cached[0] == strategy.updated_at:
+        return cached[1]
+    plan = compile_strategy(strategy)
+    _plans[strategy.id] = (strategy.updated_at, plan)
+    return plan
+
+
+def invalidate_plan(strategy_id: int) -> None:
+    _plans.pop(strategy_id, None)
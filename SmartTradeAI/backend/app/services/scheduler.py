@@ -0,0 +1,328 @@
+import asyncio
+import time
+import zlib
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, SessionLocal
+from app.models.portfolio import Portfolio
+from app.models.strategy import Strategy
+from app.models.trade import Trade, TradeStatus, TradeType
+from app.services import zerodha
+from app.services.bar_store import bar_store
+from app.services.candles import TIMEFRAMES, Candle, CandleAggregator
+from app.services.instruments import instrument_registry
+from app.services.position_book import position_books
+from app.services.rules import CompiledPlan, IndicatorBank, RuleError, get_plan
+from app.services.sizing import order_quantity, product_for
+from app.services.ticker import TickIngestionService
+from app.services.trading import trading_service
+from app.utils.logging import logger
+from app.utils.metrics import histogram
+
+WARMUP_BARS = 500
+
+
+def shard_for(symbol: str, shards: int) -> int:
+    """Stable shard index for an instrument, identical across processes"""
+    return zlib.crc32(symbol.encode()) % shards
+
+
+class _Member:
+    __slots__ = (
+        "strategy_id", "user_id", "portfolio_id", "plan", "position_size", "risk_per_trade",
+        "quantity", "product", "in_position", "latency",
+    )
+
+    def __init__(self, strategy: Strategy, portfolio_id: int, plan: CompiledPlan, exchange: str, held: int):
+        self.strategy_id = strategy.id
+        self.user_id = strategy.user_id
+        self.portfolio_id = portfolio_id
+        self.plan = plan
+        self.position_size = strategy.position_size
+        self.risk_per_trade = strategy.risk_per_trade
+        # sized on each entry (sizing.order_quantity); the exit sells what the entry bought
+        self.quantity = held
+        self.product = product_for(exchange, plan.timeframe)
+        self.in_position = held > 0
+        self.latency = histogram(f"strategy.{strategy.id}.evaluate")
+
+
+class _Group:
+    """All strategies on one (symbol, timeframe), sharing one indicator bank"""
+
+    __slots__ = ("symbol", "timeframe", "bank", "members")
+
+    def __init__(self, symbol: str, timeframe: str):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.bank = IndicatorBank()
+        self.members: List[_Member] = []
+
+
+class StrategyScheduler:
+    """
+    Runs every active automated strategy on closed candles.
+
+    Strategies are grouped by (symbol, timeframe) so an indicator used by
+    many strategies is updated once per candle. With `shards` > 1 a process
+    only runs the instruments whose hash maps to its `shard`, so the load
+    can be split across Celery workers.
+    """
+
+    def __init__(
+        self,
+        shard: int = 0,
+        shards: int = 1,
+        session_factory: Callable[[], Session] = SessionLocal,
+        async_session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+    ):
+        self.shard = shard
+        self.shards = shards
+        self.session_factory = session_factory
+        self.async_session_factory = async_session_factory
+        self.groups: Dict[Tuple[str, str], _Group] = {}
+        self.symbols: Dict[int, str] = {}
+        self.dispatch_latency = histogram("strategy.candle_to_order")
+        self._tasks: List[asyncio.Task] = []
+
+    def fetch(self, db: Session):
+        """Read automated strategies, their users' portfolios and open positions"""
+        strategies = (
+            db.query(Strategy)
+            .filter(Strategy.is_active.is_(True), Strategy.is_automated.is_(True))
+            .all()
+        )
+        portfolios = {}
+        for portfolio in db.query(Portfolio).order_by(Portfolio.id.desc()).all():
+            portfolios[portfolio.user_id] = portfolio.id
+        return strategies, portfolios, self._open_positions(db, [s.id for s in strategies])
+
+    def apply(self, strategies: List[Strategy], portfolios: Dict[int, int], open_positions: Dict[Tuple[int, str], int]) -> None:
+        """
+        Rebuild groups on the event loop. Existing groups keep their warmed-up
+        indicator bank; new groups are warmed from stored candles.
+        """
+        groups: Dict[Tuple[str, str], _Group] = {}
+        for strategy in strategies:
+            if strategy.user_id not in portfolios:
+                continue
+            try:
+                plan = get_plan(strategy)
+            except (RuleError, KeyError, TypeError) as e:
+                logger.error(f"Strategy {strategy.id} has invalid rules: {str(e)}")
+                continue
+            if plan.timeframe not in TIMEFRAMES:
+                # no candles are built for it, so the strategy would never fire
+                logger.error(
+                    f"Strategy {strategy.id} timeframe {plan.timeframe!r} is not supported "
+                    f"for automated trading; use one of {', '.join(TIMEFRAMES)}"
+                )
+                continue
+            for symbol in plan.symbols:
+                if shard_for(symbol, self.shards) != self.shard:
+                    continue
+                key = (symbol, plan.timeframe)
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = _Group(symbol, plan.timeframe)
+                    if key in self.groups:
+                        group.bank = self.groups[key].bank
+                group.bank.add(plan.specs.values())
+                previous = self._member(key, strategy.id)
+                exchange = symbol.split(":")[0] if ":" in symbol else "NSE"
+                group.members.append(_Member(
+                    strategy, portfolios[strategy.user_id], plan, exchange,
+                    (previous.quantity if previous.in_position else 0) if previous is not None
+                    else open_positions.get((strategy.id, symbol.split(":")[-1]), 0),
+                ))
+
+        for key, group in groups.items():
+            if key not in self.groups:
+                self._warm_up(group)
+        self.groups = groups
+        logger.info(
+            f"Strategy scheduler shard {self.shard}/{self.shards}: "
+            f"{sum(len(g.members) for g in groups.values())} strategies in {len(groups)} groups"
+        )
+
+    def _member(self, key: Tuple[str, str], strategy_id: int) -> Optional[_Member]:
+        group = self.groups.get(key)
+        if group is None:
+            return None
+        return next((m for m in group.members if m.strategy_id == strategy_id), None)
+
+    def _open_positions(self, db: Session, strategy_ids: List[int]) -> Dict[Tuple[int, str], int]:
+        """Quantity held per (strategy_id, symbol) whose last executed trade was a buy"""
+        last: Dict[Tuple[int, str], Tuple[TradeType, int]] = {}
+        if not strategy_ids:
+            return {}
+        trades = (
+            db.query(Trade.strategy_id, Trade.symbol, Trade.trade_type, Trade.quantity, Trade.filled_quantity)
+            .filter(Trade.strategy_id.in_(strategy_ids), Trade.status == TradeStatus.EXECUTED)
+            .order_by(Trade.id)
+        )
+        for strategy_id, symbol, trade_type, quantity, filled in trades:
+            last[(strategy_id, symbol)] = (trade_type, filled or quantity)
+        return {key: quantity for key, (trade_type, quantity) in last.items() if trade_type == TradeType.BUY}
+
+    def _warm_up(self, group: _Group) -> None:
+        bars = bar_store.load(group.symbol, group.timeframe, source="kite")
+        start = max(0, len(bars) - WARMUP_BARS)
+        for i in range(start, len(bars)):
+            group.bank.update(
+                float(bars.open[i]), float(bars.high[i]), float(bars.low[i]),
+                float(bars.close[i]), float(bars.volume[i]), float(bars.ts[i]),
+            )
+
+    def instruments(self) -> List[str]:
+        return sorted({symbol for symbol, _ in self.groups})
+
+    async def on_candle(self, candle: Candle) -> None:
+        symbol = self.symbols.get(candle.token)
+        group = self.groups.get((symbol, candle.timeframe)) if symbol else None
+        if group is None:
+            return
+        started = time.perf_counter()
+        values = group.bank.update_candle(candle)
+        previous = group.bank.previous
+        signals = []
+        for member in group.members:
+            t0 = time.perf_counter()
+            entry, exit_ = member.plan.evaluate_live(values, previous)
+            member.latency.record(time.perf_counter() - t0)
+            if entry and not member.in_position:
+                member.in_position = True
+                signals.append((member, TradeType.BUY))
+            elif exit_ and member.in_position:
+                member.in_position = False
+                signals.append((member, TradeType.SELL))
+        if signals:
+            self._tasks.append(asyncio.create_task(self._dispatch(group, candle, signals, started)))
+            self._tasks = [t for t in self._tasks if not t.done()]
+
+    async def _dispatch(self, group: _Group, candle: Candle, signals, started: float) -> None:
+        exchange, tradingsymbol = group.symbol.split(":") if ":" in group.symbol else ("NSE", group.symbol)
+        cash = await self._cash(signals)
+        async with self.async_session_factory() as db:
+            for member, trade_type in signals:
+                if trade_type == TradeType.BUY:
+                    equity = None if cash is None else cash + position_books.book(member.portfolio_id).valuation()["total_value"]
+                    member.quantity = order_quantity(
+                        candle.close, instrument_registry.lot_size(group.symbol),
+                        member.position_size, member.risk_per_trade, equity or 0.0, cash,
+                    )
+                    if member.quantity <= 0:
+                        logger.warning(f"Strategy {member.strategy_id} entry on {group.symbol} sized to zero; skipped")
+                        member.in_position = False
+                        continue
+                try:
+                    await trading_service.place_order(
+                        db=db,
+                        user_id=member.user_id,
+                        portfolio_id=member.portfolio_id,
+                        symbol=tradingsymbol,
+                        trade_type=trade_type,
+                        quantity=member.quantity,
+                        price=candle.close,
+                        order_type="MARKET",
+                        product=member.product,
+                        strategy_id=member.strategy_id,
+                        exchange=exchange,
+                    )
+                except Exception as e:
+                    logger.error(f"Strategy {member.strategy_id} order failed: {str(e)}")
+                    member.in_position = trade_type == TradeType.SELL
+                self.dispatch_latency.record(time.perf_counter() - started)
+            await db.execute(
+                update(Strategy)
+                .where(Strategy.id.in_([member.strategy_id for member, _ in signals]))
+                .values(last_execution=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _cash(self, signals) -> Optional[float]:
+        """Available equity margin when an entry is sized from risk_per_trade, like the backtester's cash"""
+        if all(trade_type != TradeType.BUY or member.position_size for member, trade_type in signals):
+            return None
+        try:
+            equity = await zerodha.zerodha_service.margins("equity")
+            return float(equity.get("net", 0.0) or 0.0)
+        except Exception as e:
+            logger.warning(f"Could not fetch margins to size entries: {str(e)}")
+            return 0.0
+
+    def resolve_tokens(self) -> Dict[int, str]:
+        """Instrument tokens for the scheduled symbols, from the instrument registry when it is loaded"""
+        symbols = self.instruments()
+        if not symbols:
+            return {}
+        tokens = instrument_registry.tokens(symbols)
+        missing = set(symbols) - set(tokens.values())
+        # a paper session has no Kite account; its replay subscribes what it has bars for
+        if missing and not settings.PAPER_TRADING:
+            quotes = zerodha.get_kite().ltp(sorted(missing))
+            tokens.update({q["instrument_token"]: symbol for symbol, q in quotes.items()})
+        self.symbols = tokens
+        return self.symbols
+
+    async def start(self, ticks: TickIngestionService, candles: CandleAggregator, reload_interval: float = 60.0) -> None:
+        await self.reload()
+        await asyncio.get_running_loop().run_in_executor(None, self.resolve_tokens)
+        ticks.subscribe(self.symbols)
+        candles.add_listener(self.on_candle)
+        self._tasks.append(asyncio.create_task(self._reload_loop(ticks, reload_interval)))
+
+    async def reload(self) -> None:
+        def fetch():
+            db = self.session_factory()
+            try:
+                return self.fetch(db)
+            finally:
+                db.close()
+
+        self.apply(*await asyncio.get_running_loop().run_in_executor(None, fetch))
+
+    async def _reload_loop(self, ticks: TickIngestionService, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                known = set(self.symbols.values())
+                await self.reload()
+                if set(self.instruments()) - known:
+                    await asyncio.get_running_loop().run_in_executor(None, self.resolve_tokens)
+                    ticks.subscribe(self.symbols)
+            except Exception as e:
+                logger.error(f"Error reloading strategies: {str(e)}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+async def run_shard(shard: int, shards: int) -> None:
+    """Run one scheduler shard with its own tick feed and candle builder"""
+    ticks = TickIngestionService()
+    candles = CandleAggregator()
+    scheduler = StrategyScheduler(shard=shard, shards=shards)
+    candles.attach(ticks)
+    await scheduler.start(ticks, candles)
+    candles.start()
+    await ticks.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await scheduler.stop()
+        await ticks.stop()
+        await candles.stop()
+
+
+strategy_scheduler = StrategyScheduler()
@@ -0,0 +1,41 @@
+from typing import Optional
+
+from app.services.charges import DERIVATIVE_EXCHANGES
+
+INTRADAY_TIMEFRAMES = ("1m", "3m", "5m", "15m", "30m", "1h")
+
+# leave room for charges, which stay well under half a percent of turnover
+CHARGES_HEADROOM = 1.005
+
+
+def product_for(exchange: str, timeframe: str) -> str:
+    """Product a strategy trades: MIS intraday, else CNC (NRML for derivatives)"""
+    if timeframe in INTRADAY_TIMEFRAMES:
+        return "MIS"
+    return "NRML" if exchange in DERIVATIVE_EXCHANGES else "CNC"
+
+
+def order_quantity(
+    price: float,
+    lot: int = 1,
+    position_size: Optional[float] = None,
+    risk_per_trade: Optional[float] = None,
+    equity: float = 0.0,
+    cash: Optional[float] = None,
+) -> int:
+    """
+    Entry quantity of a strategy, shared by the live scheduler and the
+    backtester: `position_size` when set, else `risk_per_trade` percent
+    (default 1) of `equity` at `price`, capped by what `cash` covers and
+    rounded down to the lot size. Zero means the entry cannot be sized.
+    """
+    if price <= 0:
+        return 0
+    if position_size:
+        quantity = float(position_size)
+    else:
+        quantity = equity * (1.0 if risk_per_trade is None else risk_per_trade) / 100.0 / price
+    if cash is not None:
+        quantity = min(quantity, cash / (price * CHARGES_HEADROOM))
+    lot = max(int(lot), 1)
+    return int(quantity // lot) * lot
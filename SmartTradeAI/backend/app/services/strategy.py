@@ -1,15 +1,56 @@
-import yfinance as yf
+from datetime import date, timedelta
+from typing import Sequence, Tuple
+
 import pandas as pd
 import numpy as np
+from sqlalchemy.orm import Session
+
+from app.core.cache import cached
+from app.core.config import settings
+from app.models.strategy import Strategy
+from app.services import backtest, market_data
 
+@cached(settings.CACHE_STRATEGY_TTL, tags=lambda ticker, *args, **kwargs: ["strategy", f"ticker:{ticker}"])
 def generate_moving_average_strategy(ticker: str, short_window: int = 40, long_window: int = 100):
     """
     Generates a moving average strategy for a given ticker.
     """
-    data = yf.download(ticker, period="1y", interval="1d")
-    data['short_mavg'] = data['Close'].rolling(window=short_window, min_periods=1, center=False).mean()
-    data['long_mavg'] = data['Close'].rolling(window=long_window, min_periods=1, center=False).mean()
-    data['signal'] = 0
-    data['signal'][short_window:] = np.where(data['short_mavg'][short_window:] > data['long_mavg'][short_window:], 1, 0)
+    today = date.today()
+    # the frame is shared with the cache; work on a copy
+    data = market_data.get_stock_data(ticker, today - timedelta(days=365), today + timedelta(days=1)).copy()
+    close = data['Close'].to_numpy(dtype=np.float64)
+    means = backtest.rolling_means(close, (short_window, long_window), min_periods=1)
+    data['short_mavg'] = means[short_window][0]
+    data['long_mavg'] = means[long_window][0]
+    signal = np.where(data['short_mavg'] > data['long_mavg'], 1, 0)
+    signal[:short_window] = 0
+    data['signal'] = signal
     data['positions'] = data['signal'].diff()
-    return data
\ No newline at end of file
+    return data
+
+def load_close_matrix(tickers: Sequence[str], days: int = 365, interval: str = "1d") -> pd.DataFrame:
+    """
+    Closes for all tickers from the bar store, bars x symbols.
+    """
+    today = date.today()
+    start, end = today - timedelta(days=days), today + timedelta(days=1)
+    closes = {}
+    for ticker in tickers:
+        bars = market_data.get_stock_bars(ticker, start, end, interval=interval)
+        closes[ticker] = pd.Series(bars.close, index=pd.to_datetime(bars.ts, unit="s"))
+    return pd.DataFrame(closes).reindex(columns=list(tickers))
+
+def sweep_moving_average_strategy(
+    db: Session,
+    strategy: Strategy,
+    tickers: Sequence[str],
+    window_pairs: Sequence[Tuple[int, int]],
+    days: int = 365,
+):
+    """
+    Backtest every SMA window pair over every ticker and store the summary on the strategy.
+    """
+    close = load_close_matrix(tickers, days=days)
+    result = backtest.run_sma_grid(close.to_numpy(dtype=np.float64).T, window_pairs)
+    summary = backtest.summarize_grid(result, window_pairs, list(close.columns))
+    return backtest.save_backtest_results(db, strategy, summary)
@@ -0,0 +1,502 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.bar_store import INTERVAL_SECONDS, BarStore, bar_store
+from app.services.instruments import instrument_registry
+from app.utils.logging import logger
+
+
+class Tick:
+    """A normalized market tick"""
+
+    __slots__ = ("token", "ts", "ltp", "volume", "oi")
+
+    def __init__(self, token: int, ts: float, ltp: float, volume: float = 0.0, oi: float = 0.0):
+        self.token = token
+        self.ts = ts
+        self.ltp = ltp
+        self.volume = volume
+        self.oi = oi
+
+    @classmethod
+    def from_kite(cls, tick: Dict) -> "Tick":
+        stamp = tick.get("exchange_timestamp") or tick.get("last_trade_time")
+        if isinstance(stamp, datetime):
+            ts = stamp.timestamp()
+        elif stamp is not None:
+            ts = float(stamp)
+        else:
+            ts = time.time()
+        return cls(
+            token=int(tick["instrument_token"]),
+            ts=ts,
+            ltp=float(tick["last_price"]),
+            volume=float(tick.get("volume_traded", tick.get("volume", 0)) or 0),
+            oi=float(tick.get("oi", 0) or 0),
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            "instrument_token": self.token,
+            "exchange_timestamp": self.ts,
+            "last_price": self.ltp,
+            "volume_traded": self.volume,
+            "oi": self.oi,
+        }
+
+
+class TickRingBuffer:
+    """
+    Fixed-size ring of the most recent ticks for one instrument, stored as
+    parallel NumPy columns. The latest price is also kept as a plain float
+    so the hot lookup never touches the arrays.
+    """
+
+    __slots__ = ("capacity", "ts", "ltp", "volume", "oi", "count", "last_price", "last_ts", "_next")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.float64)
+        self.ltp = np.zeros(capacity, dtype=np.float64)
+        self.volume = np.zeros(capacity, dtype=np.float64)
+        self.oi = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.last_price: Optional[float] = None
+        self.last_ts = 0.0
+        self._next = 0
+
+    def append(self, tick: Tick) -> None:
+        i = self._next
+        self.ts[i] = tick.ts
+        self.ltp[i] = tick.ltp
+        self.volume[i] = tick.volume
+        self.oi[i] = tick.oi
+        self._next = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self.last_price = tick.ltp
+        self.last_ts = tick.ts
+
+    def snapshot(self, n: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Copy of the last `n` ticks (all buffered ticks by default), oldest first"""
+        n = self.count if n is None else min(n, self.count)
+        index = (np.arange(self._next - n, self._next)) % self.capacity
+        return {
+            "ts": self.ts[index],
+            "ltp": self.ltp[index],
+            "volume": self.volume[index],
+            "oi": self.oi[index],
+        }
+
+
+TickHandler = Callable[[List[Tick]], Awaitable[None]]
+
+
+class _Consumer:
+    __slots__ = ("name", "handler", "maxsize", "queue", "lossless", "dropped", "task")
+
+    def __init__(self, name: str, handler: TickHandler, maxsize: int, lossless: bool):
+        self.name = name
+        self.handler = handler
+        self.maxsize = maxsize
+        self.queue: Optional[asyncio.Queue] = None
+        self.lossless = lossless
+        self.dropped = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self, run: Callable[["_Consumer"], Awaitable[None]]) -> None:
+        # queues are created on the running loop, not at import time
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.task = asyncio.create_task(run(self))
+
+
+def _put_dropping_oldest(queue: asyncio.Queue, item) -> bool:
+    """put_nowait that evicts the oldest item when full; True if one was evicted"""
+    try:
+        queue.put_nowait(item)
+        return False
+    except asyncio.QueueFull:
+        queue.get_nowait()
+        queue.put_nowait(item)
+        return True
+
+
+class KiteTickerSource:
+    """Live ticks from the Kite websocket (KiteTicker runs on its own thread)"""
+
+    def __init__(self, mode: Optional[str] = None):
+        self.mode = mode
+        self.ticker = None
+        self.tokens: List[int] = []
+        self.on_order_update: Optional[Callable[[Dict], None]] = None
+        self._closed: Optional[asyncio.Event] = None
+
+    async def run(self, service: "TickIngestionService") -> None:
+        from kiteconnect import KiteTicker
+
+        loop = asyncio.get_running_loop()
+        self._closed = asyncio.Event()
+        self.ticker = KiteTicker(settings.KITE_API_KEY, settings.KITE_ACCESS_TOKEN)
+        mode = self.mode or self.ticker.MODE_FULL
+
+        def on_ticks(ws, ticks):
+            loop.call_soon_threadsafe(service.ingest_nowait, ticks)
+
+        def on_connect(ws, response):
+            if self.tokens:
+                ws.subscribe(self.tokens)
+                ws.set_mode(mode, self.tokens)
+
+        def on_order_update(ws, data):
+            if self.on_order_update is not None:
+                loop.call_soon_threadsafe(self.on_order_update, data)
+
+        def on_close(ws, code, reason):
+            logger.warning(f"KiteTicker closed: {code} {reason}")
+
+        self.ticker.on_ticks = on_ticks
+        self.ticker.on_connect = on_connect
+        self.ticker.on_order_update = on_order_update
+        self.ticker.on_close = on_close
+        self.ticker.connect(threaded=True)
+        await self._closed.wait()
+
+    def subscribe(self, tokens: Iterable[int]) -> None:
+        tokens = [t for t in tokens if t not in self.tokens]
+        self.tokens.extend(tokens)
+        if tokens and self.ticker is not None and self.ticker.is_connected():
+            self.ticker.subscribe(tokens)
+            self.ticker.set_mode(self.mode or self.ticker.MODE_FULL, tokens)
+
+    def stop(self) -> None:
+        if self.ticker is not None:
+            self.ticker.close()
+        if self._closed is not None:
+            self._closed.set()
+
+
+class ReplayTickSource:
+    """
+    Replays recorded ticks in place of the websocket. Each recorded line is
+    a JSON batch of Kite-style tick dicts; `speed` scales the recorded gaps
+    (0 replays as fast as consumers allow). Unlike the websocket, a replay
+    waits for room in the ingest queue, so no batch is ever shed.
+    """
+
+    def __init__(self, batches: Iterable[List[Dict]], speed: float = 0.0):
+        self.batches = batches
+        self.speed = speed
+        self.tokens: List[int] = []
+        self.on_order_update: Optional[Callable[[Dict], None]] = None
+        self._stopped = False
+
+    @classmethod
+    def from_file(cls, path: str, speed: float = 0.0) -> "ReplayTickSource":
+        with open(path) as f:
+            return cls([json.loads(line) for line in f if line.strip()], speed=speed)
+
+    async def run(self, service: "TickIngestionService") -> None:
+        previous = None
+        for batch in self.batches:
+            if self._stopped:
+                break
+            if self.tokens:
+                batch = [t for t in batch if t["instrument_token"] in self.tokens]
+            stamp = batch[0].get("exchange_timestamp") if batch else None
+            if self.speed and previous is not None and stamp is not None:
+                await asyncio.sleep(max(0.0, (stamp - previous) / self.speed))
+            else:
+                await asyncio.sleep(0)
+            previous = stamp if stamp is not None else previous
+            if batch:
+                await service.ingest(batch)
+
+    def subscribe(self, tokens: Iterable[int]) -> None:
+        self.tokens.extend(t for t in tokens if t not in self.tokens)
+
+    def stop(self) -> None:
+        self._stopped = True
+
+
+class BarReplaySource:
+    """
+    Replays stored bars as ticks, for paper trading and load tests when no
+    tick recording exists. Each bar becomes four ticks (open, the nearer
+    extreme, the other extreme, close) spread over its interval, with
+    cumulative volume like Kite's. All instruments are merged in time order
+    and each timestamp is one batch; `speed` scales the gaps as in
+    ReplayTickSource. Names the instrument registry does not know get
+    synthetic tokens.
+    """
+
+    SYNTHETIC_TOKEN = 1 << 40
+
+    def __init__(
+        self,
+        names: Iterable[str],
+        interval: str = "1m",
+        speed: float = 0.0,
+        start=None,
+        end=None,
+        source: str = "kite",
+        store: Optional[BarStore] = None,
+    ):
+        self.names = list(names)
+        self.interval = interval
+        self.speed = speed
+        self.start = start
+        self.end = end
+        self.source = source
+        self.store = store or bar_store
+        self.tokens: List[int] = []
+        self.on_order_update: Optional[Callable[[Dict], None]] = None
+        self._stopped = False
+
+    def instruments(self) -> Dict[int, str]:
+        known = instrument_registry.tokens(self.names)
+        missing = [n for n in self.names if n not in known.values()]
+        known.update({self.SYNTHETIC_TOKEN + i: name for i, name in enumerate(missing)})
+        return known
+
+    def ticks(self, instruments: Dict[int, str]) -> Dict[str, np.ndarray]:
+        """Every replayed tick as columns, sorted by time"""
+        step = INTERVAL_SECONDS[self.interval]
+        # where in the bar each of its four ticks lands
+        offsets = np.array([0.0, step / 3, 2 * step / 3, step - 1e-3])
+        columns = {"token": [], "ts": [], "price": [], "volume": []}
+        for token, name in instruments.items():
+            bars = self.store.load(name, self.interval, source=self.source).slice(self.start, self.end)
+            if not len(bars):
+                continue
+            up = bars.close >= bars.open
+            first = np.where(up, bars.low, bars.high)
+            second = np.where(up, bars.high, bars.low)
+            prices = np.column_stack([bars.open, first, second, bars.close])
+            total = np.cumsum(np.nan_to_num(bars.volume))
+            before = total - np.nan_to_num(bars.volume)
+            volume = before[:, None] + np.nan_to_num(bars.volume)[:, None] * np.array([0.0, 1 / 3, 2 / 3, 1.0])
+            columns["ts"].append((bars.ts[:, None] + offsets).ravel())
+            columns["price"].append(prices.ravel())
+            columns["volume"].append(volume.ravel())
+            columns["token"].append(np.full(prices.size, token, dtype=np.int64))
+        if not columns["ts"]:
+            return {k: np.empty(0) for k in columns}
+        merged = {k: np.concatenate(v) for k, v in columns.items()}
+        order = np.argsort(merged["ts"], kind="stable")
+        return {k: v[order] for k, v in merged.items()}
+
+    async def run(self, service: "TickIngestionService") -> None:
+        instruments = self.instruments()
+        service.subscribe(instruments)
+        columns = self.ticks(instruments)
+        ts = columns["ts"]
+        bounds = np.flatnonzero(np.diff(ts)) + 1
+        previous = None
+        for lo, hi in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(ts)]])):
+            if self._stopped:
+                break
+            stamp = float(ts[lo])
+            if self.speed and previous is not None:
+                await asyncio.sleep((stamp - previous) / self.speed)
+            else:
+                await asyncio.sleep(0)
+            previous = stamp
+            await service.ingest([
+                {
+                    "instrument_token": int(columns["token"][i]),
+                    "exchange_timestamp": stamp,
+                    "last_price": float(columns["price"][i]),
+                    "volume_traded": float(columns["volume"][i]),
+                }
+                for i in range(lo, hi)
+            ])
+
+    def subscribe(self, tokens: Iterable[int]) -> None:
+        # the replayed names are fixed; later subscriptions just have no bars
+        self.tokens.extend(t for t in tokens if t not in self.tokens)
+
+    def stop(self) -> None:
+        self._stopped = True
+
+
+class TickRecorder:
+    """Tick consumer that appends batches to a JSON-lines file for replay"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def __call__(self, ticks: List[Tick]) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps([t.to_dict() for t in ticks]) + "\n")
+
+
+class TickIngestionService:
+    """
+    Ingests ticks into per-instrument ring buffers and fans them out to
+    consumers.
+
+    Buffers are written as soon as a batch arrives, so latest-price lookups
+    are never behind the fan-out. Each consumer has its own bounded queue:
+    lossy consumers (valuation, socket push) drop their oldest batch when
+    they fall behind, lossless ones (candle building, strategies) make the
+    pump wait instead, and the pump's own inbound queue then sheds the
+    oldest batches.
+    """
+
+    def __init__(self, capacity: Optional[int] = None, queue_size: Optional[int] = None):
+        self.capacity = capacity or settings.TICK_BUFFER_SIZE
+        self.queue_size = queue_size or settings.TICK_QUEUE_SIZE
+        self.buffers: Dict[int, TickRingBuffer] = {}
+        self.symbols: Dict[int, str] = {}
+        self.tokens: Dict[str, int] = {}
+        self.consumers: Dict[str, _Consumer] = {}
+        self.order_update_handlers: List[Callable[[Dict], None]] = []
+        self.source = None
+        self.dropped = 0
+        self._inbound: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def add_consumer(
+        self, name: str, handler: TickHandler, maxsize: Optional[int] = None, lossless: bool = False
+    ) -> None:
+        consumer = _Consumer(name, handler, maxsize or self.queue_size, lossless)
+        self.consumers[name] = consumer
+        if self.running:
+            consumer.start(self._consume)
+
+    def remove_consumer(self, name: str) -> None:
+        consumer = self.consumers.pop(name, None)
+        if consumer is not None and consumer.task is not None:
+            consumer.task.cancel()
+
+    def subscribe(self, instruments: Dict[int, str]) -> None:
+        """Subscribe to instrument tokens, mapped to their "EXCHANGE:SYMBOL" names"""
+        for token, symbol in instruments.items():
+            self.symbols[token] = symbol
+            self.tokens[symbol] = token
+        if self.source is not None:
+            self.source.subscribe(instruments.keys())
+
+    def subscribe_symbols(self, names: Iterable[str]) -> Dict[int, str]:
+        """Subscribe to "EXCHANGE:SYMBOL" names via the instrument registry; unknown names are skipped"""
+        instruments = instrument_registry.tokens(names)
+        self.subscribe(instruments)
+        return instruments
+
+    def latest_price(self, token: int) -> Optional[float]:
+        buffer = self.buffers.get(token)
+        return buffer.last_price if buffer is not None else None
+
+    def latest_price_for(self, symbol: str) -> Optional[float]:
+        token = self.tokens.get(symbol)
+        return self.latest_price(token) if token is not None else None
+
+    def latest_tick_time(self, token: int) -> float:
+        buffer = self.buffers.get(token)
+        return buffer.last_ts if buffer is not None else 0.0
+
+    async def start(self, source=None) -> None:
+        if self.running:
+            return
+        self.source = source or KiteTickerSource()
+        self.source.subscribe(self.symbols.keys())
+        self.source.on_order_update = self._on_order_update
+        self._inbound = asyncio.Queue(maxsize=self.queue_size)
+        for consumer in self.consumers.values():
+            consumer.start(self._consume)
+        self._tasks = [
+            asyncio.create_task(self.source.run(self)),
+            asyncio.create_task(self._pump()),
+        ]
+        logger.info(f"Tick ingestion started with {len(self.consumers)} consumers")
+
+    async def stop(self) -> None:
+        if self.source is not None:
+            self.source.stop()
+        tasks = self._tasks + [c.task for c in self.consumers.values() if c.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        for consumer in self.consumers.values():
+            consumer.task = None
+
+    async def drain(self) -> None:
+        """Wait until every queued batch has been handled (replays and tests)"""
+        if self._tasks:
+            await asyncio.wait([self._tasks[0]])
+        await self._inbound.join()
+        for consumer in self.consumers.values():
+            await consumer.queue.join()
+
+    def _buffer(self, raw_ticks: List[Dict]) -> List[Tick]:
+        ticks = [Tick.from_kite(t) for t in raw_ticks]
+        for tick in ticks:
+            buffer = self.buffers.get(tick.token)
+            if buffer is None:
+                buffer = self.buffers[tick.token] = TickRingBuffer(self.capacity)
+            buffer.append(tick)
+        return ticks
+
+    def ingest_nowait(self, raw_ticks: List[Dict]) -> None:
+        """Ingest a batch of Kite ticks, shedding the oldest queued batch if full"""
+        if _put_dropping_oldest(self._inbound, self._buffer(raw_ticks)):
+            self._inbound.task_done()
+            self.dropped += 1
+
+    async def ingest(self, raw_ticks: List[Dict]) -> None:
+        """Ingest a batch of Kite ticks, waiting for room in the queue"""
+        await self._inbound.put(self._buffer(raw_ticks))
+
+    def _on_order_update(self, data: Dict) -> None:
+        for handler in self.order_update_handlers:
+            try:
+                handler(data)
+            except Exception as e:
+                logger.error(f"Error handling order update: {str(e)}")
+
+    async def _pump(self) -> None:
+        while True:
+            ticks = await self._inbound.get()
+            try:
+                for consumer in list(self.consumers.values()):
+                    if consumer.lossless:
+                        await consumer.queue.put(ticks)
+                    elif _put_dropping_oldest(consumer.queue, ticks):
+                        consumer.queue.task_done()
+                        consumer.dropped += 1
+            finally:
+                self._inbound.task_done()
+
+    async def _consume(self, consumer: _Consumer) -> None:
+        while True:
+            ticks = await consumer.queue.get()
+            try:
+                await consumer.handler(ticks)
+            except Exception as e:
+                logger.error(f"Tick consumer {consumer.name} failed: {str(e)}")
+            finally:
+                consumer.queue.task_done()
+
+    def stats(self) -> Dict:
+        return {
+            "instruments": len(self.buffers),
+            "dropped": self.dropped,
+            "consumers": {
+                name: {"queued": c.queue.qsize() if c.queue else 0, "dropped": c.dropped}
+                for name, c in self.consumers.items()
+            },
+        }
+
+
+tick_service = TickIngestionService()
@@ -1,18 +1,28 @@
+import asyncio
 from typing import Dict, List, Optional
-from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.services.zerodha import zerodha_service
+from app.services.instruments import instrument_registry
+from app.services.prices import price_service
+from app.services.position_book import position_books
+from app.services.orders import order_tracker
+from app.services.risk import risk_engine
+from app.services.pretrade import RiskRejected, pretrade_gate
 from app.models.trade import Trade, TradeType, TradeStatus
 from app.models.portfolio import Portfolio
 from app.utils.logging import logger
 
+PRODUCTS = ("CNC", "MIS", "NRML")
+ORDER_TYPES = ("MARKET", "LIMIT", "SL", "SL-M")
+
 class TradingService:
     def __init__(self):
         self.order_cache = {}
 
     async def place_order(
         self,
-        db: Session,
+        db: AsyncSession,
         user_id: int,
         portfolio_id: int,
         symbol: str,
@@ -23,9 +33,26 @@ class TradingService:
         product: str = "CNC",
         stop_loss: Optional[float] = None,
         target: Optional[float] = None,
-        strategy_id: Optional[int] = None
+        trailing_sl: Optional[float] = None,
+        strategy_id: Optional[int] = None,
+        exchange: Optional[str] = None,
+        throttle: bool = True,
+        **params
     ) -> Trade:
-        """Place a new trade order"""
+        """
+        Place a new trade order; the exchange defaults to the first one
+        listing the symbol. The trade stays PENDING until the order tracker
+        hears about fills. `stop_loss`, `target` and `trailing_sl` are
+        kept on the trade for the exit monitor, not sent to the broker.
+        With `throttle` off the order does not count against the user's
+        order rate. `params` are passed to the broker
+        as is (variety, trigger_price, validity, tag, ...).
+        """
+        exchange = exchange or instrument_registry.exchange_for(symbol)
+        name = f"{exchange}:{symbol}"
+        signed = quantity if trade_type == TradeType.BUY else -quantity
+        pretrade_gate.check(user_id, name, signed, price, order_type, throttle=throttle)
+        placed = False
         try:
             # Calculate total amount
             total_amount = quantity * price
@@ -43,84 +70,91 @@ class TradingService:
                 product=product,
                 stop_loss=stop_loss,
                 target=target,
-                exchange="NSE"  # Default to NSE, make configurable if needed
+                trailing_sl=trailing_sl,
+                exchange=exchange
             )
 
             # Place order with Zerodha
-            order_id = zerodha_service.place_order(
+            order_id = await zerodha_service.place_order(
                 tradingsymbol=symbol,
-                exchange="NSE",
+                exchange=exchange,
                 transaction_type="BUY" if trade_type == TradeType.BUY else "SELL",
                 quantity=quantity,
                 product=product,
                 order_type=order_type,
-                price=price
+                price=price if order_type != "MARKET" else None,
+                **params
             )
 
             trade.order_id = order_id
-            trade.status = TradeStatus.EXECUTED
-            trade.execution_time = datetime.utcnow()
+            trade.status = TradeStatus.PENDING
+            placed = True
 
-            # Save to database
-            db.add(trade)
-            db.commit()
-            db.refresh(trade)
+            # Save to database; the order is live at the broker whether or not this works
+            await self._save(db, [trade])
 
-            # Update portfolio
-            await self.update_portfolio(db, portfolio_id)
+            # Fills are booked as the tracker hears of them; the reservation holds until then
+            order_tracker.track(trade)
 
             return trade
 
         except Exception as e:
             logger.error(f"Error placing order: {str(e)}")
-            if 'trade' in locals():
-                trade.status = TradeStatus.FAILED
-                db.add(trade)
-                db.commit()
+            if not placed:
+                pretrade_gate.release(user_id, name, signed)
+                if 'trade' in locals():
+                    trade.status = TradeStatus.FAILED
+                    await self._save(db, [trade])
             raise
 
-    async def update_portfolio(self, db: Session, portfolio_id: int):
-        """Update portfolio with current positions and calculations"""
+    async def _save(self, db: AsyncSession, trades: List[Trade]) -> bool:
+        """
+        Write new trades, rolling back and trying once more if the commit
+        fails. Trades still unsaved keep no id; the order tracker then
+        writes their updates by order id.
+        """
+        for attempt in range(2):
+            try:
+                db.add_all(trades)
+                await db.commit()
+                return True
+            except Exception as e:
+                await db.rollback()
+                for trade in trades:
+                    trade.id = None
+                logger.error(
+                    f"Error saving trades for orders {[trade.order_id for trade in trades]} "
+                    f"(attempt {attempt + 1}): {str(e)}"
+                )
+        return False
+
+    async def update_portfolio(self, db: AsyncSession, portfolio_id: int):
+        """Reconcile the portfolio with the broker and write it now"""
         try:
-            portfolio = db.query(Portfolio).filter(Portfolio.id == portfolio_id).first()
+            portfolio = await db.get(Portfolio, portfolio_id)
             if not portfolio:
                 return
 
-            # Get current positions from Zerodha
-            positions = zerodha_service.get_positions()
-            holdings = zerodha_service.get_holdings()
-
-            # Calculate total value and P&L
-            total_value = 0
-            unrealized_pnl = 0
-            realized_pnl = 0
-
-            for position in positions:
-                total_value += position.get('value', 0)
-                unrealized_pnl += position.get('unrealized_pnl', 0)
-                realized_pnl += position.get('realized_pnl', 0)
-
-            for holding in holdings:
-                total_value += holding.get('value', 0)
-                unrealized_pnl += holding.get('unrealized_pnl', 0)
+            await position_books.reconcile([portfolio_id])
+            book = position_books.book(portfolio_id)
+            valuation = book.valuation()
 
             # Update portfolio
-            portfolio.total_value = total_value
-            portfolio.unrealized_pnl = unrealized_pnl
-            portfolio.realized_pnl = realized_pnl
-
-            # Calculate risk metrics
-            portfolio.risk_metrics = self.calculate_risk_metrics(positions + holdings)
+            portfolio.total_value = valuation["total_value"]
+            portfolio.unrealized_pnl = valuation["unrealized_pnl"]
+            portfolio.realized_pnl = valuation["realized_pnl"]
+            portfolio.risk_metrics = self.calculate_risk_metrics(book.positions(), portfolio_id)
+            book.dirty = False
 
             db.add(portfolio)
-            db.commit()
+            await db.commit()
 
         except Exception as e:
             logger.error(f"Error updating portfolio: {str(e)}")
             raise
 
-    def calculate_risk_metrics(self, positions: List[Dict]) -> Dict:
-        """Calculate risk metrics for the portfolio"""
+    def calculate_risk_metrics(self, positions: List[Dict], portfolio_id: Optional[int] = None) -> Dict:
+        """Calculate risk metrics for the portfolio, with the latest VaR/beta/margin figures if known"""
         try:
             total_exposure = sum(abs(p.get('value', 0)) for p in positions)
             position_exposures = [abs(p.get('value', 0)) for p in positions]
@@ -129,7 +163,8 @@ class TradingService:
                 "total_exposure": total_exposure,
                 "largest_position": max(position_exposures) if position_exposures else 0,
                 "position_count": len(positions),
-                "concentration": max(position_exposures) / total_exposure if total_exposure else 0
+                "concentration": max(position_exposures) / total_exposure if total_exposure else 0,
+                **risk_engine.metrics.get(portfolio_id, {})
             }
         except Exception as e:
             logger.error(f"Error calculating risk metrics: {str(e)}")
@@ -137,40 +172,370 @@ class TradingService:
 
     async def close_position(
         self,
-        db: Session,
+        db: AsyncSession,
         user_id: int,
         portfolio_id: int,
-        trade_id: int
-    ) -> bool:
-        """Close an existing position"""
-        try:
-            # Get the original trade
-            trade = db.query(Trade).filter(
-                Trade.id == trade_id,
-                Trade.user_id == user_id
-            ).first()
+        trade_id: int,
+        quantity: Optional[int] = None,
+        throttle: bool = True
+    ) -> Trade:
+        """
+        Close an existing position at market; `quantity` defaults to what has
+        filled. The entry is claimed before the order goes out, so no other
+        path or process can close it twice. Raises ValueError when the trade
+        is unknown or already closed (or being closed), LookupError when there
+        is no price, and whatever placement raises.
+        """
+        # Get the original trade
+        result = await db.execute(select(Trade).where(
+            Trade.id == trade_id,
+            Trade.user_id == user_id
+        ))
+        trade = result.scalars().first()
 
-            if not trade:
-                raise ValueError("Trade not found")
+        if not trade:
+            raise ValueError("Trade not found")
+        if trade.exit_trade_id is not None:
+            raise ValueError(f"Trade {trade_id} is already closed")
 
-            # Place opposite order
-            opposite_type = TradeType.SELL if trade.trade_type == TradeType.BUY else TradeType.BUY
-            
-            await self.place_order(
+        # Place opposite order
+        opposite_type = TradeType.SELL if trade.trade_type == TradeType.BUY else TradeType.BUY
+
+        price = await price_service.ltp(f"{trade.exchange}:{trade.symbol}")
+        if price is None:
+            raise LookupError(f"No price for {trade.symbol}")
+
+        if not await self._claim(db, [trade.id]):
+            raise ValueError(f"Trade {trade_id} is already closed")
+        try:
+            exit_trade = await self.place_order(
                 db=db,
                 user_id=user_id,
                 portfolio_id=portfolio_id,
                 symbol=trade.symbol,
                 trade_type=opposite_type,
-                quantity=trade.quantity,
-                price=zerodha_service.kite.ltp(trade.symbol)['ltp'],
-                product=trade.product
+                quantity=quantity or trade.filled_quantity or trade.quantity,
+                price=price,
+                order_type="MARKET",
+                product=trade.product,
+                exchange=trade.exchange,
+                throttle=throttle
             )
+        except Exception:
+            await self._unclaim(db, [trade.id])
+            raise
 
-            return True
+        await self._link_exits(db, {trade.id: exit_trade.id})
+        return exit_trade
 
-        except Exception as e:
-            logger.error(f"Error closing position: {str(e)}")
-            return False
+    async def close_positions(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        portfolio_id: int,
+        trade_ids: List[int]
+    ) -> List[Dict]:
+        """
+        Close several positions as one basket. Entries are claimed before
+        anything is sent, so one closed elsewhere meanwhile is left out; each
+        is linked to the trade that closes it, and claims of legs that failed
+        are given back.
+        """
+        result = await db.execute(select(Trade).where(
+            Trade.id.in_(trade_ids),
+            Trade.user_id == user_id,
+            Trade.exit_trade_id.is_(None)
+        ))
+        trades = [trade for trade in result.scalars().all() if trade.filled_quantity or trade.status == TradeStatus.EXECUTED]
+        claimed = set(await self._claim(db, [trade.id for trade in trades]))
+        trades = [trade for trade in trades if trade.id in claimed]
+        legs = [
+            {
+                "tradingsymbol": trade.symbol,
+                "exchange": trade.exchange,
+                "transaction_type": "SELL" if trade.trade_type == TradeType.BUY else "BUY",
+                "quantity": trade.filled_quantity or trade.quantity,
+                "product": trade.product,
+                "order_type": "MARKET",
+            }
+            for trade in trades
+        ]
+        try:
+            results = await self.place_basket(db, user_id, portfolio_id, legs)
+        except Exception:
+            await self._unclaim(db, list(claimed))
+            raise
+        await self._link_exits(db, {
+            trade.id: placed["trade_id"]
+            for trade, placed in zip(trades, results)
+            if placed["status"] == TradeStatus.PENDING.value
+        })
+        await self._unclaim(db, [
+            trade.id for trade, placed in zip(trades, results) if placed["status"] != TradeStatus.PENDING.value
+        ])
+        return results
+
+    async def square_off(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        portfolio_id: int,
+        product: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Flatten every open net position at the broker, optionally for one
+        product. The portfolio's open entries in each instrument are claimed
+        before the legs go out and linked to the leg that closes them.
+        """
+        positions = await zerodha_service.get_positions()
+        legs = [
+            {
+                "tradingsymbol": position["tradingsymbol"],
+                "exchange": position["exchange"],
+                "transaction_type": "SELL" if position["quantity"] > 0 else "BUY",
+                "quantity": abs(position["quantity"]),
+                "product": position["product"],
+                "order_type": "MARKET",
+            }
+            for position in positions
+            if position.get("quantity") and (product is None or position.get("product") == product)
+        ]
+        if not legs:
+            return []
+
+        index = {(leg["exchange"], leg["tradingsymbol"], leg["product"]): i for i, leg in enumerate(legs)}
+        result = await db.execute(select(Trade).where(
+            Trade.user_id == user_id,
+            Trade.portfolio_id == portfolio_id,
+            Trade.exit_trade_id.is_(None),
+            Trade.symbol.in_({symbol for _, symbol, _ in index}),
+            or_(Trade.status == TradeStatus.EXECUTED, Trade.filled_quantity > 0)
+        ))
+        entries = {}
+        for trade in result.scalars().all():
+            i = index.get((trade.exchange, trade.symbol, trade.product))
+            # entries on the side the leg flattens; the leg trades the other way
+            if i is not None and trade.trade_type.value != legs[i]["transaction_type"]:
+                entries[trade.id] = i
+        claimed = await self._claim(db, list(entries))
+
+        try:
+            results = await self.place_basket(db, user_id, portfolio_id, legs)
+        except Exception:
+            await self._unclaim(db, claimed)
+            raise
+        placed = {
+            trade_id: results[entries[trade_id]]["trade_id"]
+            for trade_id in claimed
+            if results[entries[trade_id]]["status"] == TradeStatus.PENDING.value
+        }
+        await self._link_exits(db, placed)
+        await self._unclaim(db, [trade_id for trade_id in claimed if trade_id not in placed])
+        return results
+
+    async def _claim(self, db: AsyncSession, trade_ids: List[int]) -> List[int]:
+        """
+        Mark entries as being closed, in one conditional UPDATE, before any
+        exit order is sent; returns the ids this call claimed. A claimed
+        entry points at itself until its closing trade exists.
+        """
+        if not trade_ids:
+            return []
+        result = await db.execute(
+            update(Trade)
+            .where(Trade.id.in_(trade_ids), Trade.exit_trade_id.is_(None))
+            .values(exit_trade_id=Trade.id)
+            .returning(Trade.id)
+            .execution_options(synchronize_session=False)
+        )
+        claimed = [row[0] for row in result]
+        await db.commit()
+        return claimed
+
+    async def _unclaim(self, db: AsyncSession, trade_ids: List[int]) -> None:
+        """Give back claims whose exit order was never placed"""
+        if not trade_ids:
+            return
+        await db.execute(
+            update(Trade)
+            .where(Trade.id.in_(trade_ids), Trade.exit_trade_id == Trade.id)
+            .values(exit_trade_id=None)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+    async def _link_exits(self, db: AsyncSession, entries: Dict[int, int]) -> None:
+        """Point claimed entries at the trades closing them and stop the exit monitor watching them"""
+        from app.services.exits import exit_monitor
+
+        if not entries:
+            return
+        for trade_id, exit_trade_id in entries.items():
+            if exit_trade_id is not None:
+                await db.execute(
+                    update(Trade)
+                    .where(Trade.id == trade_id, Trade.exit_trade_id == Trade.id)
+                    .values(exit_trade_id=exit_trade_id)
+                    .execution_options(synchronize_session=False)
+                )
+            # an exit whose row could not be written keeps its claim, so nothing closes the entry again
+            exit_monitor.disarm(trade_id)
+        await db.commit()
+
+    def validate_exits(self, order: Dict) -> List[str]:
+        """Problems with an order's exit levels"""
+        errors = []
+        for field in ("stop_loss", "target", "trailing_sl"):
+            if order.get(field) is not None and not order[field] > 0:
+                errors.append(f"{field} must be positive")
+        return errors
+
+    def validate_leg(self, leg: Dict) -> List[str]:
+        """Problems with one basket leg; empty when it can be sent"""
+        errors = self.validate_exits(leg)
+        if not leg.get("tradingsymbol"):
+            errors.append("tradingsymbol is required")
+        if leg.get("transaction_type") not in ("BUY", "SELL"):
+            errors.append("transaction_type must be BUY or SELL")
+        if not isinstance(leg.get("quantity"), int) or leg["quantity"] <= 0:
+            errors.append("quantity must be a positive integer")
+        if leg.get("product", "CNC") not in PRODUCTS:
+            errors.append(f"product must be one of {', '.join(PRODUCTS)}")
+        order_type = leg.get("order_type", "MARKET")
+        if order_type not in ORDER_TYPES:
+            errors.append(f"order_type must be one of {', '.join(ORDER_TYPES)}")
+        if order_type in ("LIMIT", "SL") and not (leg.get("price") or 0) > 0:
+            errors.append(f"{order_type} orders need a positive price")
+        if order_type in ("SL", "SL-M") and not (leg.get("trigger_price") or 0) > 0:
+            errors.append(f"{order_type} orders need a positive trigger_price")
+        if errors or not instrument_registry.loaded:
+            return errors
+
+        name = f"{leg.get('exchange', 'NSE')}:{leg['tradingsymbol']}"
+        instrument = instrument_registry.lookup(name)
+        if instrument is None:
+            errors.append(f"unknown instrument {name}")
+            return errors
+        if leg["quantity"] % instrument.lot_size:
+            errors.append(f"quantity must be a multiple of the lot size {instrument.lot_size}")
+        for field in ("price", "trigger_price"):
+            ticks = leg[field] / instrument.tick_size if leg.get(field) and instrument.tick_size else 0.0
+            if abs(ticks - round(ticks)) > 1e-6:
+                errors.append(f"{field} must be a multiple of the tick size {instrument.tick_size:g}")
+        return errors
+
+    async def place_basket(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        portfolio_id: int,
+        legs: List[Dict],
+        strategy_id: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Place many orders at once. Every leg is validated and risk-checked
+        before anything is sent; orders then go out concurrently (the Kite
+        client paces them to the order rate limit), all trades are written
+        in one flush and the placed orders are handed to the order tracker.
+        Returns one result per leg, in order.
+        """
+        errors = {i: self.validate_leg(leg) for i, leg in enumerate(legs)}
+        errors = {i: e for i, e in errors.items() if e}
+        if errors:
+            raise ValueError(
+                "; ".join(f"order {i}: {', '.join(e)}" for i, e in sorted(errors.items()))
+            )
+        if not legs:
+            return []
+
+        # Market legs are recorded at the current price, looked up in one batch
+        names = {f"{leg.get('exchange', 'NSE')}:{leg['tradingsymbol']}" for leg in legs if not leg.get("price")}
+        prices = {}
+        if names:
+            try:
+                prices = await price_service.get_ltp(names)
+            except Exception as e:
+                logger.error(f"Error pricing basket, recording market legs at 0: {str(e)}")
+
+        # Risk-check the whole basket before sending any of it; one basket is one order for the rate limit
+        reserved = []
+        try:
+            for i, leg in enumerate(legs):
+                name = f"{leg.get('exchange', 'NSE')}:{leg['tradingsymbol']}"
+                signed = leg["quantity"] if leg["transaction_type"] == "BUY" else -leg["quantity"]
+                pretrade_gate.check(
+                    user_id, name, signed, leg.get("price") or prices.get(name), leg.get("order_type", "MARKET"),
+                    throttle=i == 0
+                )
+                reserved.append((name, signed))
+        except RiskRejected as e:
+            for name, signed in reserved:
+                pretrade_gate.release(user_id, name, signed)
+            raise ValueError(f"order {len(reserved)}: {str(e)}") from e
+
+        async def send(leg: Dict) -> str:
+            return await zerodha_service.place_order(
+                tradingsymbol=leg["tradingsymbol"],
+                exchange=leg.get("exchange", "NSE"),
+                transaction_type=leg["transaction_type"],
+                quantity=leg["quantity"],
+                product=leg.get("product", "CNC"),
+                order_type=leg.get("order_type", "MARKET"),
+                price=leg.get("price") if leg.get("order_type", "MARKET") != "MARKET" else None,
+                trigger_price=leg.get("trigger_price"),
+                tag=leg.get("tag"),
+            )
+
+        outcomes = await asyncio.gather(*(send(leg) for leg in legs), return_exceptions=True)
+
+        trades = []
+        for leg, outcome in zip(legs, outcomes):
+            exchange = leg.get("exchange", "NSE")
+            price = leg.get("price") or prices.get(f"{exchange}:{leg['tradingsymbol']}", 0.0)
+            trade = Trade(
+                user_id=user_id,
+                portfolio_id=portfolio_id,
+                strategy_id=strategy_id,
+                symbol=leg["tradingsymbol"],
+                trade_type=TradeType(leg["transaction_type"]),
+                quantity=leg["quantity"],
+                price=price,
+                total_amount=leg["quantity"] * price,
+                product=leg.get("product", "CNC"),
+                stop_loss=leg.get("stop_loss"),
+                target=leg.get("target"),
+                trailing_sl=leg.get("trailing_sl"),
+                exchange=exchange
+            )
+            if isinstance(outcome, Exception):
+                logger.error(f"Basket order for {leg['tradingsymbol']} failed: {str(outcome)}")
+                trade.status = TradeStatus.FAILED
+                trade.meta_data = {"error": str(outcome)}
+            else:
+                trade.order_id = outcome
+                trade.status = TradeStatus.PENDING
+            trades.append(trade)
+
+        # One flush; the new ids come back with the INSERTs and stay loaded after commit.
+        # Sent orders are live at the broker, so they are tracked even if this fails.
+        await self._save(db, trades)
+
+        for trade, (name, signed) in zip(trades, reserved):
+            if trade.status == TradeStatus.PENDING:
+                order_tracker.track(trade)
+            else:
+                pretrade_gate.release(user_id, name, signed)
+
+        return [
+            {
+                "index": i,
+                "tradingsymbol": trade.symbol,
+                "status": trade.status.value,
+                "order_id": trade.order_id,
+                "trade_id": trade.id,
+                "error": str(outcome) if isinstance(outcome, Exception) else None,
+            }
+            for i, (trade, outcome) in enumerate(zip(trades, outcomes))
+        ]
 
 trading_service = TradingService()
\ No newline at end of file
@@ -1,9 +1,38 @@
+from functools import lru_cache
+from typing import Optional
 from kiteconnect import KiteConnect
+from app.core.cache import cached
 from app.core.config import settings
+from app.services.kite_client import AsyncKiteClient
+from app.services.paper_broker import SimulatedBroker
 
+# Shared async client for the event loop; its connection pool and rate
+# limiters are per process. Paper trading swaps in the simulated broker.
+if settings.PAPER_TRADING:
+    zerodha_service = SimulatedBroker()
+else:
+    zerodha_service = AsyncKiteClient(
+        api_key=settings.KITE_API_KEY,
+        access_token=settings.KITE_ACCESS_TOKEN,
+        max_connections=settings.KITE_MAX_CONNECTIONS,
+    )
+
+@cached(
+    settings.CACHE_INSTRUMENTS_TTL,
+    key=lambda exchange=None: f"instruments:{exchange or 'all'}",
+    tags=["instruments"],
+)
+async def get_instruments(exchange: Optional[str] = None) -> str:
+    """
+    Instrument dump as CSV text, fetched once for every worker until it
+    expires or the "instruments" tag is invalidated
+    """
+    return await zerodha_service.instruments(exchange)
+
+@lru_cache()
 def get_kite():
     """
-    Initialize KiteConnect
+    Initialize KiteConnect once per process so its HTTP session is reused
     """
     kite = KiteConnect(api_key=settings.KITE_API_KEY)
     kite.set_access_token(settings.KITE_ACCESS_TOKEN)
@@ -0,0 +1,115 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List
+
+# Bucket upper bounds in seconds: 1us doubling up to ~67s
+BUCKETS: List[float] = [1e-6 * 2 ** i for i in range(27)]
+
+
+class LatencyHistogram:
+    """Fixed log-scale latency histogram; recording is a bisect and an increment"""
+
+    __slots__ = ("name", "counts", "count", "total", "max")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - start)
+
+    def percentile(self, q: float) -> float:
+        """Upper bucket bound below which `q` (0-1) of samples fall"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+histograms: Dict[str, LatencyHistogram] = {}
+
+
+def histogram(name: str) -> LatencyHistogram:
+    """Get or create the process-wide histogram `name`"""
+    h = histograms.get(name)
+    if h is None:
+        h = histograms[name] = LatencyHistogram(name)
+    return h
+
+
+def snapshot(prefix: str = "") -> Dict[str, Dict]:
+    return {name: h.snapshot() for name, h in histograms.items() if name.startswith(prefix)}
+
+
+class SizeStats:
+    """Running totals of encoded payload sizes, with the pre-compression size"""
+
+    __slots__ = ("name", "count", "bytes", "raw_bytes", "max")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.bytes = 0
+        self.raw_bytes = 0
+        self.max = 0
+
+    def record(self, size: int, raw_size: int) -> None:
+        self.count += 1
+        self.bytes += size
+        self.raw_bytes += raw_size
+        if size > self.max:
+            self.max = size
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean_bytes": self.bytes / self.count if self.count else 0.0,
+            "max_bytes": self.max,
+            "compression_ratio": self.raw_bytes / self.bytes if self.bytes else 1.0,
+        }
+
+
+sizes: Dict[str, SizeStats] = {}
+
+
+def size_stats(name: str) -> SizeStats:
+    """Get or create the process-wide size counter `name`"""
+    s = sizes.get(name)
+    if s is None:
+        s = sizes[name] = SizeStats(name)
+    return s
+
+
+def size_snapshot(prefix: str = "") -> Dict[str, Dict]:
+    return {name: s.snapshot() for name, s in sizes.items() if name.startswith(prefix)}
@@ -1,5 +1,6 @@
-from typing import TypeVar, Generic, Sequence
+from typing import TypeVar, Generic, Optional, Sequence
 from pydantic import BaseModel
+from pydantic.generics import GenericModel
 from fastapi import Query
 
 T = TypeVar('T')
@@ -17,4 +18,26 @@ class Page(BaseModel, Generic[T]):
     items: Sequence[T]
     total: int
     skip: int
-    limit: int
\ No newline at end of file
+    limit: int
+
+class CursorParams:
+    """
+    Keyset pagination: pass back `next_cursor` to get the following page.
+    `count` ("estimate" or "exact") adds a total to the first page.
+    """
+    def __init__(
+        self,
+        cursor: Optional[str] = Query(default=None),
+        limit: int = Query(default=100, ge=1, le=500),
+        count: Optional[str] = Query(default=None, regex="^(estimate|exact)$")
+    ):
+        self.cursor = cursor
+        self.limit = limit
+        self.count = count
+
+class CursorPage(GenericModel, Generic[T]):
+    items: Sequence[T]
+    next_cursor: Optional[str] = None
+    limit: int
+    total: Optional[int] = None
+    estimated: bool = False
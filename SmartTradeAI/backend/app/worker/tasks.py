@@ -1,5 +1,7 @@
+import asyncio
+
 from app.core.celery_app import celery_app
-from app.services import market_data, strategy
+from app.services import backtest, market_data, optimization
 from app.core.config import settings
 import logging
 
@@ -12,14 +14,82 @@ def get_stock_data_task(ticker: str, start_date: str, end_date: str):
     Celery task to get stock data.
     """
     logger.info(f"Getting stock data for {ticker}")
-    data = market_data.get_stock_data(ticker, start_date, end_date)
-    return data.to_json()
+    bars = market_data.get_stock_bars(ticker, start_date, end_date)
+    return {"ticker": ticker, "bars": len(bars)}
 
 @celery_app.task(acks_late=True)
 def run_sma_strategy_task(ticker: str, start_date: str, end_date: str, short_window: int = 20, long_window: int = 50):
     """
-    Celery task to run SMA strategy.
+    Celery task to run SMA strategy. Returns the metric summary only.
     """
     logger.info(f"Running SMA strategy for {ticker}")
-    data = strategy.get_sma_strategy(ticker, start_date, end_date, short_window, long_window)
-    return data.to_json()
+    bars = market_data.get_stock_bars(ticker, start_date, end_date)
+    pairs = [(short_window, long_window)]
+    result = backtest.run_sma_grid(bars.close, pairs)
+    return backtest.summarize_grid(result, pairs, [ticker])
+
+@celery_app.task(acks_late=True)
+def backtest_strategy_task(strategy_id: int, start_date: str = None, end_date: str = None):
+    """
+    Celery task to backtest a strategy's rules and store the results on it.
+    """
+    from app.db.session import SessionLocal
+    from app.models.strategy import Strategy
+
+    logger.info(f"Backtesting strategy {strategy_id}")
+    db = SessionLocal()
+    try:
+        strategy = db.query(Strategy).filter(Strategy.id == strategy_id).first()
+        if strategy is None:
+            return {"strategy_id": strategy_id, "error": "Strategy not found"}
+        summary = backtest.backtest_strategy(db, strategy, start_date, end_date).backtest_results
+        return {key: summary[key] for key in ("strategy_id", "total_return", "sharpe_ratio", "max_drawdown", "total_trades")}
+    finally:
+        db.close()
+
+@celery_app.task(acks_late=True)
+def optimize_task(request_id: str, tickers: list, pairs: list, params: dict):
+    """
+    Celery task to top up history for an optimization job and fan it out.
+    """
+    logger.info(f"Preparing optimization {request_id}")
+    optimization.run(request_id, tickers, [tuple(p) for p in pairs], **params)
+
+@celery_app.task(acks_late=True)
+def optimization_chunk_task(chunk: dict):
+    """
+    Celery task to evaluate one (fold, parameter chunk) of an optimization job.
+    Bars are read from the worker's bar store; only metrics are returned.
+    """
+    return optimization.evaluate_chunk(chunk)
+
+@celery_app.task(acks_late=True)
+def optimization_finish_task(results: list, spec: dict):
+    """
+    Chord callback combining chunk results into the job summary.
+    """
+    summary = optimization.finish(spec, results)
+    logger.info(f"Optimization {spec['job_hash']} finished")
+    return {"job_hash": summary["job_hash"], "best_pair": summary["best_pair"]}
+
+@celery_app.task
+def sweep_array_store_task():
+    """
+    Celery beat task to delete array store files past their TTL.
+    """
+    from app.core.serialization import array_store
+    removed = array_store.sweep()
+    logger.info(f"Swept {removed} expired arrays")
+    return removed
+
+@celery_app.task
+def run_strategy_shard_task(shard: int, shards: int):
+    """
+    Celery task to run automated strategies for one instrument shard.
+    Long-running: start one per shard on dedicated workers. It never
+    returns, so it is acked on receipt; a late ack would let the broker
+    redeliver it to a second worker and run the shard twice.
+    """
+    from app.services import scheduler
+    logger.info(f"Starting strategy shard {shard}/{shards}")
+    asyncio.run(scheduler.run_shard(shard, shards))
@@ -0,0 +1,153 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+import httpx
+
+from app.services.kite_client import RATE_LIMITS
+
+
+class KiteStandIn:
+    """
+    In-process stand-in for the Kite Connect REST API, served through an
+    httpx transport:
+
+        stand_in = KiteStandIn(prices={"NSE:INFY": 1500.0})
+        client = AsyncKiteClient("key", "token", transport=stand_in.transport())
+
+    Orders fill immediately at the requested or last price. It enforces
+    Kite's per-second rate limits with 429s, can add network latency and
+    can be told to fail the next requests, and records every request so
+    tests can assert on call counts and ordering.
+    """
+
+    def __init__(self, prices: Optional[Dict[str, float]] = None, latency: float = 0.0):
+        self.prices: Dict[str, float] = dict(prices or {})
+        self.latency = latency
+        self.orders: Dict[str, Dict] = {}
+        self.positions: Dict[str, Dict] = {}
+        self.holdings: List[Dict] = []
+        self.requests: List[str] = []
+        self._failures: Deque[int] = deque()
+        self._calls: Dict[str, Deque[float]] = defaultdict(deque)
+        self._order_ids = itertools.count(230000000000001)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def fail_next(self, status_code: int, times: int = 1) -> None:
+        self._failures.extend([status_code] * times)
+
+    def _limit(self, method: str, path: str) -> str:
+        if path.startswith("/orders") and method != "GET":
+            return "order"
+        if path.startswith("/quote"):
+            return "quote"
+        if path.startswith("/instruments/historical"):
+            return "historical"
+        return "default"
+
+    def _rate_limited(self, limit: str) -> bool:
+        now = time.monotonic()
+        calls = self._calls[limit]
+        while calls and now - calls[0] >= 1.0:
+            calls.popleft()
+        if len(calls) >= RATE_LIMITS[limit]:
+            return True
+        calls.append(now)
+        return False
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        method, path = request.method, request.url.path
+        self.requests.append(f"{method} {path}")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._failures:
+            return _error(self._failures.popleft(), "Injected failure", "NetworkException")
+        if self._rate_limited(self._limit(method, path)):
+            return _error(429, "Too many requests", "NetworkException")
+
+        params = request.url.params
+        if path.startswith("/quote"):
+            return _ok(self._quotes(params.get_list("i"), path))
+        if method == "POST" and path.startswith("/orders/"):
+            return _ok(self._place(dict(parse_qsl(request.content.decode()))))
+        if method == "DELETE" and path.startswith("/orders/"):
+            order = self.orders.get(path.rsplit("/", 1)[-1])
+            if order is None:
+                return _error(400, "Order not found", "InputException")
+            if order["status"] == "OPEN":
+                order["status"] = "CANCELLED"
+            return _ok({"order_id": order["order_id"]})
+        if path == "/orders":
+            return _ok(list(self.orders.values()))
+        if path == "/portfolio/positions":
+            net = list(self.positions.values())
+            return _ok({"net": net, "day": net})
+        if path == "/portfolio/holdings":
+            return _ok(self.holdings)
+        if path == "/user/profile":
+            return _ok({"user_id": "AB1234", "user_name": "Stand-in"})
+        if path.startswith("/user/margins"):
+            return _ok({"equity": {"net": 1_000_000.0, "utilised": {"debits": 0.0}}})
+        return _error(404, f"No route for {method} {path}", "GeneralException")
+
+    def _quotes(self, instruments: List[str], path: str) -> Dict:
+        data = {}
+        for i, name in enumerate(instruments):
+            price = self.prices.get(name)
+            if price is None:
+                continue
+            quote = {"instrument_token": i + 1, "last_price": price}
+            if path != "/quote/ltp":
+                quote["ohlc"] = {"open": price, "high": price, "low": price, "close": price}
+            data[name] = quote
+        return data
+
+    def _place(self, form: Dict[str, str]) -> Dict:
+        order_id = str(next(self._order_ids))
+        name = f"{form['exchange']}:{form['tradingsymbol']}"
+        price = float(form.get("price") or self.prices.get(name, 0.0))
+        quantity = int(form["quantity"])
+        self.orders[order_id] = {
+            "order_id": order_id,
+            "status": "COMPLETE",
+            "tradingsymbol": form["tradingsymbol"],
+            "exchange": form["exchange"],
+            "transaction_type": form["transaction_type"],
+            "order_type": form["order_type"],
+            "product": form["product"],
+            "quantity": quantity,
+            "filled_quantity": quantity,
+            "pending_quantity": 0,
+            "price": price,
+            "average_price": price,
+            "tag": form.get("tag"),
+        }
+        signed = quantity if form["transaction_type"] == "BUY" else -quantity
+        position = self.positions.setdefault(name, {
+            "tradingsymbol": form["tradingsymbol"],
+            "exchange": form["exchange"],
+            "product": form["product"],
+            "quantity": 0,
+            "average_price": 0.0,
+            "last_price": price,
+        })
+        position["quantity"] += signed
+        position["last_price"] = price
+        return {"order_id": order_id}
+
+
+def _ok(data) -> httpx.Response:
+    return httpx.Response(200, content=json.dumps({"status": "success", "data": data}))
+
+
+def _error(status_code: int, message: str, error_type: str) -> httpx.Response:
+    return httpx.Response(
+        status_code,
+        content=json.dumps({"status": "error", "message": message, "error_type": error_type}),
+    )
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services import backtest
+
+
+@pytest.fixture
+def gapped_prices():
+    rng = np.random.default_rng(0)
+    prices = 100 + np.cumsum(rng.normal(0, 1, 300))
+    prices[:5] = np.nan
+    prices[100:103] = np.nan
+    return prices
+
+
+@pytest.mark.parametrize("min_periods", [None, 1, 3])
+def test_rolling_means_skip_nan_bars(gapped_prices, min_periods):
+    means = backtest.rolling_means(gapped_prices, (5, 20), min_periods=min_periods)
+    for window in (5, 20):
+        expected = pd.Series(gapped_prices).rolling(window, min_periods=min_periods).mean().to_numpy()
+        np.testing.assert_allclose(means[window][0], expected, equal_nan=True)
+
+
+def test_sma_grid_scores_series_with_nan_bars(gapped_prices):
+    result = backtest.run_sma_grid(gapped_prices, [(5, 20)])
+    assert result["trades"][0, 0] > 0
+    assert np.isfinite(result["total_return"][0, 0])
+    assert result["total_return"][0, 0] != 0.0
+
+
+def test_sma_grid_matches_on_nan_padded_matrix(gapped_prices):
+    padded = np.vstack([gapped_prices, np.r_[np.full(50, np.nan), gapped_prices[50:]]])
+    result = backtest.run_sma_grid(padded, [(5, 20)])
+    assert np.all(result["trades"] > 0)
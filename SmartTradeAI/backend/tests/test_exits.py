@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from app.models.trade import TradeStatus
+from app.services.exits import ExitMonitor
+from app.services.orders import Fill
+
+
+def fill(trade_id, quantity, price, stop_loss=None, target=None, trailing_sl=None, name="NSE:INFY"):
+    return Fill(trade_id, f"O{trade_id}", 7, 3, name, quantity, price, TradeStatus.EXECUTED, "CNC",
+                stop_loss, target, trailing_sl)
+
+
+@pytest.fixture
+def monitor():
+    monitor = ExitMonitor(persist_interval=1.0)
+    monitor.leader = True
+    return monitor
+
+
+def arm(monitor, *fills):
+    async def run():
+        for f in fills:
+            await monitor.on_fill(f)
+    asyncio.run(run())
+
+
+def fired(monitor, price, name="NSE:INFY"):
+    return sorted(exit.trade_id for exit in monitor.check(name, price))
+
+
+def test_long_and_short_stops_and_targets(monitor):
+    arm(monitor, fill(1, 10, 100.0, stop_loss=95.0, target=110.0), fill(2, -10, 100.0, stop_loss=105.0, target=90.0))
+    assert fired(monitor, 100.0) == []
+    assert fired(monitor, 95.5) == []
+    assert fired(monitor, 95.0) == [1]
+    assert fired(monitor, 90.0) == [2]
+    assert fired(monitor, 80.0) == []
+
+
+def test_later_fills_add_to_an_armed_exit(monitor):
+    arm(monitor, fill(1, 10, 100.0, target=110.0), fill(1, 15, 101.0, target=110.0))
+    assert monitor.exits[1].quantity == 25
+    assert [exit.quantity for exit in monitor.check("NSE:INFY", 111.0)] == [25]
+
+
+def test_trailing_stop_ratchets_with_the_best_price(monitor):
+    arm(monitor, fill(1, 10, 100.0, stop_loss=90.0, trailing_sl=5.0), fill(2, -10, 100.0, trailing_sl=4.0))
+    # the short's stop stays 4 above its best price, 100, so the rally takes it out
+    assert fired(monitor, 110.0) == [2]
+    assert monitor.exits[1].current_stop() == 105.0
+    assert fired(monitor, 107.0) == []
+    assert fired(monitor, 112.0) == []
+    assert monitor.exits[1].current_stop() == 107.0
+    assert fired(monitor, 107.0) == [1]
+
+
+def test_trailing_groups_merge_and_fire_in_distance_order(monitor):
+    arm(monitor, fill(1, 10, 100.0, trailing_sl=2.0), fill(2, 10, 104.0, trailing_sl=6.0))
+    assert fired(monitor, 120.0) == []
+    assert monitor.exits[1].group is monitor.exits[2].group
+    assert fired(monitor, 118.0) == [1]
+    assert fired(monitor, 115.0) == []
+    assert fired(monitor, 114.0) == [2]
+
+
+def test_disarmed_entries_never_fire_or_rearm(monitor):
+    arm(monitor, fill(1, 10, 100.0, stop_loss=95.0))
+    monitor.disarm(1)
+    arm(monitor, fill(1, 5, 99.0, stop_loss=95.0))
+    assert fired(monitor, 90.0) == []
+
+
+def test_fired_exits_can_be_rearmed_at_their_peak(monitor):
+    arm(monitor, fill(1, 10, 100.0, trailing_sl=5.0))
+    monitor.check("NSE:INFY", 110.0)
+    (exit,) = monitor.check("NSE:INFY", 104.0)
+    monitor.rearm(exit)
+    assert exit.current_stop() == 105.0
+    assert fired(monitor, 104.0) == [1]
+
+
+def test_followers_keep_recent_fills_without_arming(monitor):
+    monitor.leader = False
+    arm(monitor, fill(1, 10, 100.0, stop_loss=95.0))
+    assert monitor.exits == {} and len(monitor._recent) == 1
+    assert fired(monitor, 90.0) == []
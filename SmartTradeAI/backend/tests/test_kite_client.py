@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.kite_client import PRIORITY_ORDER, PRIORITY_QUOTE, AsyncKiteClient, KiteError, TokenBucket
+from app.services.prices import _Batcher
+from kite_stand_in import KiteStandIn
+
+
+def client_for(stand_in: KiteStandIn) -> AsyncKiteClient:
+    return AsyncKiteClient("key", "token", transport=stand_in.transport(), backoff=0.01)
+
+
+def test_token_bucket_paces_to_its_rate():
+    async def run():
+        bucket = TokenBucket(rate=20.0, burst=2.0)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # two from the burst, then one every 50ms
+    assert asyncio.run(run()) >= 0.18
+
+
+def test_token_bucket_grants_by_priority():
+    async def run():
+        bucket = TokenBucket(rate=50.0, burst=1.0)
+        await bucket.acquire()
+        order = []
+
+        async def take(priority, label):
+            await bucket.acquire(priority)
+            order.append(label)
+
+        await asyncio.gather(take(PRIORITY_QUOTE, "quote"), take(PRIORITY_ORDER, "order"))
+        return order
+
+    assert asyncio.run(run()) == ["order", "quote"]
+
+
+def test_order_placement_retries_429():
+    stand_in = KiteStandIn(prices={"NSE:INFY": 1500.0})
+    stand_in.fail_next(429)
+
+    async def run():
+        client = client_for(stand_in)
+        try:
+            return await client.place_order("INFY", "NSE", "BUY", 1, "CNC", "MARKET")
+        finally:
+            await client.close()
+
+    order_id = asyncio.run(run())
+    assert stand_in.orders[order_id]["status"] == "COMPLETE"
+    assert stand_in.requests == ["POST /orders/regular"] * 2
+
+
+def test_order_placement_does_not_retry_5xx():
+    stand_in = KiteStandIn(prices={"NSE:INFY": 1500.0})
+    stand_in.fail_next(503)
+
+    async def run():
+        client = client_for(stand_in)
+        try:
+            await client.place_order("INFY", "NSE", "BUY", 1, "CNC", "MARKET")
+        finally:
+            await client.close()
+
+    # Kite may have taken the order, so resending could place it twice
+    with pytest.raises(KiteError) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
+    assert stand_in.orders == {}
+    assert len(stand_in.requests) == 1
+
+
+def test_reads_retry_5xx_until_retries_run_out():
+    stand_in = KiteStandIn()
+    stand_in.fail_next(502, times=2)
+
+    async def run():
+        client = client_for(stand_in)
+        try:
+            return await client.orders()
+        finally:
+            await client.close()
+
+    assert asyncio.run(run()) == []
+    assert stand_in.requests == ["GET /orders"] * 3
+
+    stand_in = KiteStandIn()
+    stand_in.fail_next(504, times=4)
+    with pytest.raises(KiteError):
+        asyncio.run(run())
+    assert len(stand_in.requests) == 4
+
+
+def test_batcher_coalesces_lookups_into_one_call():
+    names = [f"NSE:S{i}" for i in range(50)]
+    stand_in = KiteStandIn(prices={name: 100.0 + i for i, name in enumerate(names)})
+
+    async def run():
+        client = client_for(stand_in)
+        batcher = _Batcher(client.ltp, max_batch=100, ttl=5.0, window=0.01)
+        try:
+            results = await asyncio.gather(*(batcher.get([name]) for name in names + names[:10]))
+            again = await batcher.get(names[:5])
+        finally:
+            await client.close()
+        return batcher, results, again
+
+    batcher, results, again = asyncio.run(run())
+    assert [r[name]["last_price"] for r, name in zip(results, names)] == [100.0 + i for i in range(50)]
+    # one call for 50 instruments; repeats and cached lookups add none
+    assert batcher.calls == 1
+    assert stand_in.requests == ["GET /quote/ltp"]
+    assert set(again) == set(names[:5])
@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.models.trade import TradeStatus, TradeType
+from app.services.orders import OrderTracker
+
+
+class Gate:
+    def __init__(self):
+        self.fills = []
+        self.released = []
+
+    def on_fill(self, user_id, name, quantity, price, reserved=True):
+        self.fills.append((name, quantity, pytest.approx(price), reserved))
+
+    def release(self, user_id, name, quantity):
+        self.released.append((name, quantity))
+
+
+class Books:
+    def __init__(self):
+        self.fills = []
+
+    def on_fill(self, portfolio_id, name, quantity, price):
+        self.fills.append((name, quantity, price))
+
+
+def trade(**overrides):
+    fields = dict(
+        id=1, order_id="A1", user_id=7, portfolio_id=3, exchange="NSE", symbol="INFY", product="CNC",
+        trade_type=TradeType.BUY, quantity=100, filled_quantity=0, price=100.0, status=TradeStatus.PENDING,
+        entry_time=None, stop_loss=None, target=None, trailing_sl=None,
+    )
+    fields.update(overrides)
+    return SimpleNamespace(**fields)
+
+
+def update(filled, average, status="OPEN", order_id="A1", **extra):
+    return {"order_id": order_id, "status": status, "filled_quantity": filled, "average_price": average, **extra}
+
+
+@pytest.fixture
+def tracker():
+    return OrderTracker(flush_interval=1.0, poll_interval=1.0, session_factory=None, books=Books(), gate=Gate())
+
+
+def test_each_fill_is_priced_from_the_change_in_average(tracker):
+    tracker.track(trade())
+    tracker.on_update(update(0, 0.0))
+    tracker.on_update(update(40, 100.0))
+    tracker.on_update(update(100, 102.0, "COMPLETE"))
+    assert tracker.books.fills == [("NSE:INFY", 40, 100.0), ("NSE:INFY", 60, pytest.approx(103.333333))]
+    assert tracker.gate.fills[1][3] is True
+    row = tracker._rows[1]
+    assert row["status"] == TradeStatus.EXECUTED
+    assert row["filled_quantity"] == 100 and row["price"] == 102.0
+    assert "A1" not in tracker.orders
+
+
+def test_updates_before_tracking_are_applied_on_track(tracker):
+    tracker.on_update(update(50, 99.0, order_id="A2"))
+    assert tracker.books.fills == [] and "A2" in tracker.early
+    tracker.track(trade(id=2, order_id="A2"))
+    assert tracker.books.fills == [("NSE:INFY", 50, 99.0)]
+    assert tracker._rows[2]["status"] == TradeStatus.PARTIALLY_FILLED
+    assert "A2" not in tracker.early
+
+
+def test_duplicate_and_stale_updates_change_nothing(tracker):
+    tracker.track(trade())
+    tracker.on_update(update(60, 100.0))
+    tracker.on_update(update(60, 100.0))
+    tracker.on_update(update(20, 100.0))
+    assert tracker.stale == 1
+    tracker.on_update(update(100, 100.0, "COMPLETE"))
+    tracker.track(trade(id=2, order_id="A2"))
+    tracker.on_update(update(100, 100.0, "COMPLETE"))
+    assert [quantity for _, quantity, _ in tracker.books.fills] == [60, 40]
+    assert tracker._rows[1]["status"] == TradeStatus.EXECUTED
+
+
+def test_terminal_states_release_the_unfilled_reservation(tracker):
+    tracker.track(trade(trade_type=TradeType.SELL))
+    tracker.on_update(update(30, 100.0))
+    tracker.on_update(update(30, 100.0, "CANCELLED"))
+    assert tracker.books.fills == [("NSE:INFY", -30, 100.0)]
+    assert tracker.gate.released == [("NSE:INFY", -70)]
+
+    tracker.track(trade(id=2, order_id="A2"))
+    tracker.on_update(update(0, 0.0, "REJECTED", order_id="A2", status_message="Insufficient funds"))
+    assert tracker.gate.released[-1] == ("NSE:INFY", 100)
+    assert tracker._rows[2]["notes"] == "Insufficient funds"
+
+    # resumed orders hold no reservation, so there is nothing to give back
+    tracker.track(trade(id=3, order_id="A3"), reserved=False)
+    tracker.on_update(update(0, 0.0, "CANCELLED", order_id="A3"))
+    assert len(tracker.gate.released) == 2
+
+
+def test_fills_shared_by_other_workers_are_booked_once(tracker):
+    shared = dict(
+        worker="other", trade_id=5, order_id="B5", user_id=7, portfolio_id=3, name="NSE:TCS", quantity=20,
+        filled=20, average=200.0, status="PARTIALLY_FILLED", product="CNC",
+    )
+    tracker.on_shared_fill(shared)
+    tracker.on_shared_fill(shared)
+    tracker.on_shared_fill({**shared, "worker": tracker.worker, "filled": 50})
+    assert tracker.books.fills == [("NSE:TCS", 20, 200.0)]
+    assert tracker.gate.fills == [("NSE:TCS", 20, pytest.approx(200.0), False)]
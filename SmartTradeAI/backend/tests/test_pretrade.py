@@ -0,0 +1,96 @@
+import pytest
+
+from app.services.pretrade import PreTradeRiskGate, RiskRejected
+
+NO_LIMITS = dict(
+    max_position_qty=0, max_order_notional=0, max_gross_notional=0, max_concentration=0,
+    concentration_floor=0, max_daily_loss=0, price_band=0, orders_per_second=0,
+)
+
+
+class Prices:
+    def __init__(self, **ltp):
+        self.ltp = {name.replace("_", ":"): price for name, price in ltp.items()}
+
+    def cached_ltp(self, name):
+        return self.ltp.get(name)
+
+
+def gate_with(prices=None, **limits):
+    gate = PreTradeRiskGate(prices=prices or Prices(NSE_INFY=100.0, NSE_TCS=200.0))
+    gate.set_limits(1, **{**NO_LIMITS, **limits})
+    return gate
+
+
+def rejected(gate, *args, **kwargs) -> str:
+    with pytest.raises(RiskRejected) as error:
+        gate.check(1, *args, **kwargs)
+    return error.value.code
+
+
+def test_position_limit_counts_reserved_orders():
+    gate = gate_with(max_position_qty=100)
+    gate.check(1, "NSE:INFY", 60)
+    assert rejected(gate, "NSE:INFY", 50) == "position"
+    # the reservation held the first order; releasing it frees the room
+    gate.release(1, "NSE:INFY", 60)
+    gate.check(1, "NSE:INFY", 100)
+
+
+def test_orders_that_shrink_a_position_pass_exposure_limits():
+    gate = gate_with(max_position_qty=100)
+    gate.on_fill(1, "NSE:INFY", 100, 100.0, reserved=False)
+    assert rejected(gate, "NSE:INFY", 1) == "position"
+    gate.check(1, "NSE:INFY", -100)
+    # flipping past flat is new exposure again
+    assert rejected(gate, "NSE:INFY", -101) == "position"
+
+
+def test_order_and_gross_notional():
+    gate = gate_with(max_order_notional=10_000, max_gross_notional=15_000)
+    assert rejected(gate, "NSE:INFY", 101) == "order_notional"
+    gate.check(1, "NSE:INFY", 100)
+    assert rejected(gate, "NSE:TCS", 26) == "gross_notional"
+    gate.check(1, "NSE:TCS", 25)
+
+
+def test_no_price_is_rejected_when_notional_limits_apply():
+    gate = gate_with(Prices(), max_order_notional=10_000)
+    assert rejected(gate, "NSE:NEW", 10) == "no_price"
+    gate.check(1, "NSE:NEW", 10, price=50.0, order_type="LIMIT")
+    gate_with(Prices()).check(1, "NSE:NEW", 10)
+
+
+def test_price_band_applies_to_priced_orders_only():
+    gate = gate_with(price_band=0.05)
+    assert rejected(gate, "NSE:INFY", 1, price=106.0, order_type="LIMIT") == "price_band"
+    gate.check(1, "NSE:INFY", 1, price=104.0, order_type="LIMIT")
+    gate.check(1, "NSE:INFY", 1, price=106.0, order_type="MARKET")
+
+
+def test_concentration_above_floor():
+    gate = gate_with(max_concentration=0.6, concentration_floor=5_000)
+    # below the floor a single position may be all of the exposure
+    gate.check(1, "NSE:INFY", 40)
+    assert rejected(gate, "NSE:INFY", 30) == "concentration"
+    gate.check(1, "NSE:TCS", 20)
+    gate.check(1, "NSE:INFY", 10)
+
+
+def test_daily_loss_blocks_new_exposure():
+    prices = Prices(NSE_INFY=100.0)
+    gate = gate_with(prices, max_daily_loss=1_000)
+    gate.on_fill(1, "NSE:INFY", 100, 100.0, reserved=False)
+    gate.on_fill(1, "NSE:INFY", -50, 90.0, reserved=False)
+    prices.ltp["NSE:INFY"] = 89.0
+    assert rejected(gate, "NSE:INFY", 1) == "daily_loss"
+    gate.check(1, "NSE:INFY", -50)
+
+
+def test_order_rate_is_throttled_except_for_unthrottled_legs():
+    gate = gate_with(orders_per_second=2)
+    gate.check(1, "NSE:INFY", 1)
+    gate.check(1, "NSE:INFY", 1)
+    gate.check(1, "NSE:INFY", 1, throttle=False)
+    assert rejected(gate, "NSE:INFY", 1) == "rate"
+    assert gate.rejections["rate"] == 1